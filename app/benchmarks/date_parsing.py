@@ -0,0 +1,76 @@
+"""
+Throughput benchmark for the shared date parser.
+
+Compares ``DateParser`` with the strptime loop it replaced, on a mix of
+Kobo-style values: ISO timestamps with offsets, day-first dates and a
+small set of appointment times that repeat constantly.
+
+Run from the app directory:
+    python -m benchmarks.date_parsing [value_count]
+"""
+import random
+import sys
+import time
+from datetime import datetime
+
+from core.dates import DateParser
+
+LEGACY_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%d-%m-%Y', '%d/%m/%Y')
+
+
+def legacy_parse(value):
+    """The previous approach: try each format, catching every miss"""
+    for fmt in LEGACY_FORMATS:
+        try:
+            return datetime.strptime(value[:19], fmt).date()
+        except ValueError:
+            continue
+    return datetime.now().date()
+
+
+def make_values(count, unique_days=730):
+    """Values as they arrive from a season of visits"""
+    values = []
+    for i in range(count):
+        day = random.randrange(unique_days)
+        year, month, dom = 2024 + day // 365, 1 + day % 365 // 31 % 12, 1 + day % 28
+        hour = random.choice((9, 10, 11, 13, 14, 15, 16))
+        kind = i % 4
+        if kind == 0:
+            values.append(f"{year}-{month:02d}-{dom:02d}T{hour:02d}:00:00.000+02:00")
+        elif kind == 1:
+            values.append(f"{year}-{month:02d}-{dom:02d}")
+        elif kind == 2:
+            values.append(f"{dom:02d}-{month:02d}-{year}")
+        else:
+            values.append(f"{dom:02d}/{month:02d}/{year}")
+    return values
+
+
+def run(count):
+    values = make_values(count)
+
+    start = time.perf_counter()
+    for value in values:
+        legacy_parse(value)
+    legacy = time.perf_counter() - start
+
+    parser = DateParser('visit_date', 'date')
+    start = time.perf_counter()
+    for value in values:
+        parser(value)
+    current = time.perf_counter() - start
+
+    uncached = DateParser('visit_date', 'date', cache_size=0)
+    start = time.perf_counter()
+    for value in values:
+        uncached(value)
+    no_lru = time.perf_counter() - start
+
+    print(f"{'strptime loop':>16}: {count / legacy:>12,.0f} values/s ({legacy:.2f}s)")
+    print(f"{'DateParser':>16}: {count / current:>12,.0f} values/s ({current:.2f}s, {parser.cache_info()})")
+    print(f"{'without LRU':>16}: {count / no_lru:>12,.0f} values/s ({no_lru:.2f}s)")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,68 @@
+"""
+Throughput benchmark for the compiled Kobo-to-Visit field mapping.
+
+Run from the app directory:
+    python -m benchmarks.field_mapping [submission_count]
+"""
+import random
+import sys
+import time
+
+from core.dates import DateParser
+from core.parallel_parse import ParallelMapper, default_processes
+from core.services.kobo_mapping import VISIT_FIELD_MAP, compile_mapping
+
+
+def make_submission(i, nested=False):
+    """Build a synthetic submission answering every mapped question"""
+    flat = {'_id': i, '_uuid': f"uuid-{i}", '_submission_time': '2025-04-05T10:00:00'}
+    for path, field_name, coerce, *_ in VISIT_FIELD_MAP:
+        if path in flat:
+            continue
+        name = getattr(coerce, '__name__', None)
+        if name == 'boolean':
+            flat[path] = random.choice(['ja', 'nee'])
+        elif name in ('integer', 'decimal'):
+            flat[path] = str(random.randint(0, 2500))
+        elif isinstance(coerce, DateParser) or name == 'hh_mm':
+            flat[path] = '2025-04-05T10:00:00.000+02:00'
+        elif path == '_attachments':
+            flat[path] = [{'filename': 'foto.jpg', 'download_url': 'https://kc.example/foto.jpg'}]
+        else:
+            flat[path] = random.choice(['schimmel vocht', 'tocht', 'Woonkamer', 'doorlopend'])
+    if not nested:
+        return flat
+
+    submission = {}
+    for key, value in flat.items():
+        group, _, field = key.rpartition('/')
+        (submission.setdefault(group, {}) if group else submission)[field or key] = value
+    return submission
+
+
+def run(count):
+    converter = compile_mapping()
+    for label, nested in (("flattened keys", False), ("nested groups", True)):
+        submissions = [make_submission(i, nested) for i in range(count)]
+        start = time.perf_counter()
+        for submission in submissions:
+            converter(submission)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>15}: {count / elapsed:>12,.0f} submissions/s "
+              f"({len(converter.plan)} fields, {elapsed:.2f}s for {count:,})")
+
+    # Full page mapping as the sync does it, including payload encoding in the workers
+    from core.services.kobotoolbox import KoboToolboxService
+    submissions = [make_submission(i) for i in range(count)]
+    for processes in sorted({0, default_processes()}):
+        mapper = ParallelMapper(KoboToolboxService(), processes=processes)
+        start = time.perf_counter()
+        for i in range(0, count, 1000):
+            mapper.map_page(submissions[i:i + 1000])
+        elapsed = time.perf_counter() - start
+        mapper.close()
+        print(f"{f'{processes} processes':>15}: {count / elapsed:>12,.0f} submissions/s ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
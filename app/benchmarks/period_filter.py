@@ -0,0 +1,108 @@
+"""
+Month filtering benchmark: ``strftime`` per row against date ranges.
+
+Builds a throwaway database of visits spread over five years and times
+the "visits this month" and "visits of a volunteer this month" counts, once
+with the ``visit_date.month``/``.year`` comparisons the pages used and once
+with ``in_period``.
+
+Run from the app directory:
+    python -m benchmarks.period_filter [visit_count]
+"""
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from peewee import SqliteDatabase
+
+from core.database import db
+from core.migrations import migrate_database
+from core.models import Appointment, Visit, Volunteer, in_period
+
+VOLUNTEERS = 50
+DAYS = 5 * 365
+
+
+def populate(count):
+    Volunteer.insert_many([{'name': f"Volunteer {i}"} for i in range(VOLUNTEERS)]).execute()
+
+    # The columns set below, plus those SQLite cannot leave NULL
+    filled = {'address', 'visit_date', 'volunteer', 'volunteer_2'}
+    fields = [f for f in Visit._meta.sorted_fields
+              if f.name != 'id' and (f.name in filled or not f.null or f.default is not None)]
+    defaults = {f.name: f.db_value(f.default() if callable(f.default) else f.default) for f in fields}
+    columns = ', '.join(f'"{f.column_name}"' for f in fields)
+    sql = f'INSERT INTO "visit" ({columns}) VALUES ({", ".join("?" * len(fields))})'
+
+    first_day = date(2021, 1, 1)
+    rng = random.Random(42)
+    batch = []
+    with db.atomic():
+        for i in range(count):
+            row = dict(defaults, address=f"Straat {i}",
+                       visit_date=(first_day + timedelta(days=rng.randrange(DAYS))).isoformat(),
+                       volunteer=rng.randrange(1, VOLUNTEERS + 1),
+                       volunteer_2=rng.randrange(1, VOLUNTEERS + 1) if i % 3 else None)
+            batch.append(tuple(row[f.name] for f in fields))
+            if len(batch) == 10_000:
+                db.cursor().executemany(sql, batch)
+                batch = []
+        if batch:
+            db.cursor().executemany(sql, batch)
+    db.execute_sql('ANALYZE')
+
+
+def timed(query, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = query.count()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def plan(query):
+    sql, params = query.sql()
+    return '; '.join(row[-1] for row in db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params))
+
+
+def run(count):
+    with tempfile.TemporaryDirectory() as directory:
+        db.initialize(SqliteDatabase(str(Path(directory) / 'bench.db'), pragmas={'journal_mode': 'wal'}))
+        db.connect()
+        migrate_database([Volunteer, Visit, Appointment])
+
+        start = time.perf_counter()
+        populate(count)
+        print(f"Inserted {count:,} visits in {time.perf_counter() - start:.1f}s\n")
+
+        year, month, volunteer = 2023, 6, 7
+        either = (Visit.volunteer == volunteer) | (Visit.volunteer_2 == volunteer)
+        cases = [
+            ("visits this month",
+             Visit.select().where((Visit.visit_date.month == month) & (Visit.visit_date.year == year)),
+             Visit.select().where(in_period(Visit.visit_date, year, month))),
+            ("volunteer this month",
+             Visit.select().where(either & (Visit.visit_date.month == month) & (Visit.visit_date.year == year)),
+             Visit.select().where(either & in_period(Visit.visit_date, year, month))),
+            ("visits this quarter",
+             Visit.select().where((Visit.visit_date.month.in_([4, 5, 6])) & (Visit.visit_date.year == year)),
+             Visit.select().where(in_period(Visit.visit_date, year, quarter=2))),
+        ]
+        for name, old, new in cases:
+            old_count, old_time = timed(old)
+            new_count, new_time = timed(new)
+            assert old_count == new_count, (name, old_count, new_count)
+            print(f"{name} ({new_count:,} visits)")
+            print(f"  {'strftime':>10}: {old_time * 1000:>9.2f} ms   {plan(old)}")
+            print(f"  {'in_period':>10}: {new_time * 1000:>9.2f} ms   {plan(new)}")
+            print(f"  {old_time / new_time:>10.0f}x faster\n")
+        db.close()
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -45,9 +45,39 @@ class Config:
     KOBO_BASE_URL = os.getenv('KOBO_BASE_URL', 'https://kf.kobotoolbox.org')
     KOBO_API_TOKEN = os.getenv('KOBO_API_TOKEN', '')
     KOBO_FORM_ID = os.getenv('KOBO_FORM_ID', '')
+    KOBO_PAGE_SIZE = int(os.getenv('KOBO_PAGE_SIZE', '1000'))
+    KOBO_EXPORT_DIR = DATA_DIR / "exports"
+    KOBO_PARSE_PROCESSES = int(os.getenv('KOBO_PARSE_PROCESSES', '-1'))  # -1: one per spare core, up to 4
+    KOBO_EXPORT_TIMEOUT = int(os.getenv('KOBO_EXPORT_TIMEOUT', '900'))
+    KOBO_ATTACHMENT_DIR = DATA_DIR / "attachments"
+    KOBO_ATTACHMENT_WORKERS = int(os.getenv('KOBO_ATTACHMENT_WORKERS', '4'))
     
     CALENDLY_API_TOKEN = os.getenv('CALENDLY_API_TOKEN', '')
     CALENDLY_USER_URI = os.getenv('CALENDLY_USER_URI', '')
+    CALENDLY_MAX_CONCURRENCY = int(os.getenv('CALENDLY_MAX_CONCURRENCY', '4'))
+    
+    # Shared HTTP client
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+    HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '5'))
+    HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', '0.5'))
+    HTTP_RATE_LIMIT_PER_SECOND = float(os.getenv('HTTP_RATE_LIMIT_PER_SECOND', '10'))
+    HTTP_RATE_LIMIT_BURST = int(os.getenv('HTTP_RATE_LIMIT_BURST', '20'))
+    HTTP_CACHE_DIR = DATA_DIR / "http_cache"
+    HTTP_CACHE_MAX_BYTES = int(os.getenv('HTTP_CACHE_MAX_MB', '50')) * 1024 * 1024
+    
+    # Photo thumbnails
+    THUMBNAIL_DIR = DATA_DIR / "thumbnails"
+    THUMBNAIL_SIZE = (160, 160)
+    PREVIEW_SIZE = (800, 800)
+    THUMBNAIL_PROCESSES = int(os.getenv('THUMBNAIL_PROCESSES', '-1'))  # -1: one per spare core, up to 2
+    
+    # Webhook receiver (push delivery from Kobo REST Services and Calendly)
+    WEBHOOK_ENABLED = os.getenv('WEBHOOK_ENABLED', 'False').lower() == 'true'
+    WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8765'))
+    KOBO_WEBHOOK_SECRET = os.getenv('KOBO_WEBHOOK_SECRET', '')
+    CALENDLY_WEBHOOK_SIGNING_KEY = os.getenv('CALENDLY_WEBHOOK_SIGNING_KEY', '')
+    SYNC_RECONCILE_MINUTES = int(os.getenv('SYNC_RECONCILE_MINUTES', '60'))
     
     # Link Generator Configuration
     DEFAULT_KOBO_FORM_URL = os.getenv(
@@ -0,0 +1,123 @@
+"""
+Date and time parsing shared by the KoboToolbox and Calendly services.
+
+Each field gets its own ``DateParser``. ISO 8601 input, which is what both
+APIs send, is handled by ``fromisoformat``. Anything else is tried against
+a short list of formats; the one that works is remembered and tried first
+for the next value of that field. Results are kept in an LRU because the
+same appointment dates and times recur constantly. Unparseable input raises
+``DateParseError`` naming the field; nothing falls back to today's date.
+"""
+import logging
+from datetime import date, datetime, time, timezone
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMATS = ('%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y', '%Y/%m/%d', '%Y%m%d')
+DATETIME_FORMATS = (
+    '%d-%m-%Y %H:%M', '%d-%m-%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y %H:%M:%S',
+) + DATE_FORMATS
+TIME_FORMATS = ('%H.%M', '%I:%M %p', '%I:%M%p', '%H%M')
+
+KINDS = ('date', 'datetime', 'time')
+
+
+class DateParseError(ValueError):
+    """A value could not be read as a date or time"""
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+        super().__init__(f"Unrecognised {field} value '{value}'")
+
+    def __reduce__(self):
+        # Keeps the error picklable for process-pool workers
+        return type(self), (self.field, self.value)
+
+
+class DateParser:
+    """Parser for one date, datetime or time field
+
+    ``utc=True`` returns timezone-aware UTC datetimes (values without an
+    offset are taken as UTC). Otherwise the wall-clock time is kept and any
+    offset dropped, matching how visits are stored.
+    """
+
+    def __init__(self, field, kind='date', formats=None, utc=False, cache_size=4096):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown date kind '{kind}'")
+        self.field = field
+        self.kind = kind
+        self.utc = utc
+        self.formats = tuple(formats or {
+            'date': DATE_FORMATS, 'datetime': DATETIME_FORMATS, 'time': TIME_FORMATS,
+        }[kind])
+        self.learned = None
+        self._parse_cached = lru_cache(maxsize=cache_size)(self._parse_text)
+
+    def __call__(self, value):
+        """Parse a raw value; ``None`` and blank strings give ``None``"""
+        if value is None:
+            return None
+        if isinstance(value, (date, time)):
+            return self._finish(value)
+        text = str(value).strip()
+        if not text:
+            return None
+        return self._parse_cached(text)
+
+    def cache_info(self):
+        return self._parse_cached.cache_info()
+
+    def _parse_text(self, text):
+        iso_parsers = (datetime.fromisoformat,)
+        # time.fromisoformat reads "10.30" as 10:00:00.3; dotted times go to '%H.%M'
+        if self.kind == 'time' and (':' in text or '.' not in text):
+            iso_parsers = (time.fromisoformat,) + iso_parsers
+        for parse_iso in iso_parsers:
+            try:
+                return self._finish(parse_iso(text))
+            except ValueError:
+                pass
+
+        if self.learned:
+            try:
+                return self._finish(datetime.strptime(text, self.learned))
+            except ValueError:
+                pass
+
+        for fmt in self.formats:
+            if fmt == self.learned:
+                continue
+            try:
+                parsed = datetime.strptime(text, fmt)
+            except ValueError:
+                continue
+            logger.debug(f"{self.field}: switching to date format '{fmt}'")
+            self.learned = fmt
+            return self._finish(parsed)
+
+        raise DateParseError(self.field, text)
+
+    def _finish(self, value):
+        """Convert a parsed value to the kind this field stores"""
+        if self.kind == 'time':
+            if isinstance(value, datetime):
+                value = value.time()
+            elif not isinstance(value, time):
+                raise DateParseError(self.field, value)
+            return value.replace(tzinfo=None)
+
+        if not isinstance(value, datetime):
+            if self.kind == 'date':
+                return value
+            value = datetime(value.year, value.month, value.day)
+
+        if self.kind == 'date':
+            return value.date()
+        if self.utc:
+            if value.tzinfo is None:
+                return value.replace(tzinfo=timezone.utc)
+            return value.astimezone(timezone.utc)
+        return value.replace(tzinfo=None)
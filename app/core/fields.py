@@ -0,0 +1,116 @@
+"""
+Custom peewee fields for EnergieFixers071.
+
+``CompressedJSONField`` stores raw API payloads as compressed JSON BLOBs.
+The first byte of every value names the codec it was written with, so
+codecs can be added or switched without rewriting existing rows. Values
+are only decoded when the attribute is read; rows loaded for lists never
+pay for parsing the payload.
+"""
+import ast
+import json
+import logging
+import zlib
+
+from peewee import BlobField, FieldAccessor
+
+logger = logging.getLogger(__name__)
+
+# codec id (header byte) -> (name, encode, decode)
+CODECS = {}
+CODEC_IDS = {}
+
+
+def register_codec(codec_id, name, encode, decode):
+    """Register a bytes -> bytes codec under a one-byte header id"""
+    if not 0 <= codec_id <= 255:
+        raise ValueError(f"Codec id must fit in one byte, got {codec_id}")
+    CODECS[codec_id] = (name, encode, decode)
+    CODEC_IDS[name] = codec_id
+
+
+register_codec(0, 'raw', bytes, bytes)
+register_codec(1, 'zlib', lambda data: zlib.compress(data, 6), zlib.decompress)
+
+try:
+    import lzma
+    register_codec(2, 'lzma', lzma.compress, lzma.decompress)
+except ImportError:  # Python built without liblzma
+    pass
+
+
+def encode_payload(value, codec='zlib'):
+    """Serialize a JSON-compatible value into a codec-tagged BLOB"""
+    codec_id = CODEC_IDS[codec]
+    data = json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+    return bytes((codec_id,)) + CODECS[codec_id][1](data)
+
+
+def decode_payload(raw):
+    """Turn a stored value back into Python data
+
+    Text values predate this field and hold JSON or a Python ``str()``
+    repr of a dict; they are parsed as such.
+    """
+    if raw is None:
+        return None
+    if isinstance(raw, str):
+        return parse_legacy_payload(raw)
+
+    raw = bytes(raw)
+    if not raw:
+        return None
+    codec = CODECS.get(raw[0])
+    if codec is None:
+        raise ValueError(f"Unknown payload codec {raw[0]}")
+    return json.loads(codec[2](raw[1:]))
+
+
+def parse_legacy_payload(text):
+    """Parse a payload stored as text by earlier versions"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        logger.warning("Could not parse legacy payload, keeping it as text")
+        return text
+
+
+class LazyPayloadAccessor(FieldAccessor):
+    """Decode the stored BLOB on first attribute access and keep the result"""
+
+    def __get__(self, instance, instance_type=None):
+        if instance is None:
+            return self.field
+        value = instance.__data__.get(self.name)
+        if isinstance(value, (bytes, bytearray, memoryview, str)):
+            value = decode_payload(value)
+            instance.__data__[self.name] = value
+        return value
+
+
+class CompressedJSONField(BlobField):
+    """JSON payload stored as a compressed, codec-tagged BLOB"""
+
+    accessor_class = LazyPayloadAccessor
+
+    def __init__(self, codec='zlib', *args, **kwargs):
+        if codec not in CODEC_IDS:
+            raise ValueError(f"Unknown payload codec '{codec}'")
+        self.codec = codec
+        super().__init__(*args, **kwargs)
+
+    def db_value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            # Still encoded: loaded but never read
+            return super().db_value(value)
+        return super().db_value(encode_payload(value, self.codec))
+
+    def python_value(self, value):
+        # Left encoded; LazyPayloadAccessor decodes on access
+        return value
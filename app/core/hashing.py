@@ -0,0 +1,11 @@
+"""
+Stable content hashes for change detection during sync.
+"""
+import hashlib
+import json
+
+
+def content_hash(payload):
+    """SHA-256 of a payload's canonical JSON form (sorted keys, no whitespace)"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
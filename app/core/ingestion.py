@@ -0,0 +1,194 @@
+"""
+Batched ingestion of parsed KoboToolbox submissions into the Visit table.
+"""
+import logging
+import sqlite3
+from datetime import datetime
+
+from peewee import EXCLUDED, OP, SQL, Case, Expression
+
+from core.database import db
+from core.hashing import content_hash
+from core.models import Visit
+
+logger = logging.getLogger(__name__)
+
+# SQLite caps the number of bound parameters per statement
+SQLITE_MAX_VARIABLES = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+# Columns the sync never overwrites on an existing visit
+PROTECTED_COLUMNS = {'id', 'kobo_submission_id', 'created_at'}
+
+
+class VisitIngestor:
+    """Buffer parsed visit rows and write them with batched upserts
+
+    Rows are keyed on ``kobo_submission_id`` and carry a hash of their
+    parsed content. Each flush fetches the stored hashes of the buffered ids
+    in one query; only new or changed rows are written, with an
+    ``INSERT ... ON CONFLICT DO UPDATE`` upsert inside a single transaction.
+    """
+
+    def __init__(self, batch_size=500, on_flush=None):
+        self.batch_size = batch_size
+        self.buffer = {}
+        self.stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        # Rows the database rejected, as (visit_data, error); drained by the caller
+        self.failed = []
+        # Ids of rows now on disk, written or already unchanged; drained by the caller
+        self.stored = []
+        # Called after every committed flush
+        self.on_flush = on_flush
+
+        self.fields = [f for f in Visit._meta.sorted_fields if f.name != 'id']
+        self._sql_cache = {}
+
+    def add(self, visit_data):
+        """Queue one parsed visit, flushing when the buffer is full"""
+        submission_id = visit_data.get('kobo_submission_id')
+        if submission_id is None:
+            logger.warning("Skipping visit without kobo_submission_id")
+            return
+
+        # Later duplicates of the same submission win
+        visit_data = dict(visit_data, kobo_submission_id=str(submission_id))
+        visit_data['content_hash'] = self._content_hash(visit_data)
+        self.buffer[visit_data['kobo_submission_id']] = visit_data
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows in one transaction"""
+        if not self.buffer:
+            return
+
+        rows = self.buffer
+        self.buffer = {}
+
+        stored_hashes = self._stored_hashes(list(rows))
+        inserts, updates, unchanged = [], [], []
+        for submission_id, visit_data in rows.items():
+            if submission_id not in stored_hashes:
+                inserts.append(visit_data)
+            elif stored_hashes[submission_id] == visit_data['content_hash']:
+                unchanged.append(submission_id)
+            else:
+                updates.append(visit_data)
+
+        if inserts or updates:
+            now = datetime.now()
+            try:
+                with db.atomic():
+                    for group in self._group_by_columns(inserts + updates).values():
+                        self._upsert(group, now)
+            except Exception as e:
+                logger.warning(f"Batch write failed ({e}), retrying {len(inserts) + len(updates)} rows one by one")
+                inserts, updates = self._write_rows_individually(inserts, updates, now)
+
+        self.stats['inserted'] += len(inserts)
+        self.stats['updated'] += len(updates)
+        self.stats['unchanged'] += len(unchanged)
+        self.stored.extend(unchanged)
+        self.stored.extend(visit_data['kobo_submission_id'] for visit_data in inserts + updates)
+        logger.debug(f"Flushed {len(rows)} visits: {len(inserts)} new, {len(updates)} updated")
+        if self.on_flush:
+            self.on_flush(self)
+
+    def _write_rows_individually(self, inserts, updates, now):
+        """Isolate the rows that break a batch; the rest are still written"""
+        written = ([], [])
+        for target, rows in zip(written, (inserts, updates)):
+            for visit_data in rows:
+                try:
+                    with db.atomic():
+                        self._upsert([visit_data], now)
+                    target.append(visit_data)
+                except Exception as e:
+                    self.failed.append((visit_data, e))
+                    self.stats['failed'] += 1
+        return written
+
+    def _content_hash(self, visit_data):
+        """Hash of the source payload plus the volunteers it was matched to
+
+        Parsed columns are not hashed: defaults such as ``date.today`` would
+        make an unchanged submission look different on every sync. Parser
+        processes hash the payload before encoding it and pass that along
+        as ``payload_hash``.
+        """
+        payload_hash = visit_data.pop('payload_hash', None)
+        if payload_hash is None:
+            payload = visit_data.get('visit_data')
+            if payload is None:
+                payload = {name: value for name, value in visit_data.items() if name != 'content_hash'}
+            payload_hash = content_hash(payload)
+        return content_hash([payload_hash, visit_data.get('volunteer'), visit_data.get('volunteer_2')])
+
+    def _stored_hashes(self, submission_ids):
+        """Map already-stored submission ids to their stored content hash"""
+        stored = {}
+        step = SQLITE_MAX_VARIABLES - 1
+        for i in range(0, len(submission_ids), step):
+            query = (Visit
+                     .select(Visit.kobo_submission_id, Visit.content_hash)
+                     .where(Visit.kobo_submission_id.in_(submission_ids[i:i + step]))
+                     .tuples())
+            stored.update(query)
+        return stored
+
+    def _group_by_columns(self, rows):
+        """Group rows by the set of columns the parser supplied"""
+        groups = {}
+        for visit_data in rows:
+            groups.setdefault(frozenset(visit_data), []).append(visit_data)
+        return groups
+
+    def _upsert(self, rows, now):
+        """Insert or update rows that share the same supplied columns"""
+        sql = self._upsert_sql(rows[0].keys())
+        values = [self._row_tuple(visit_data, now) for visit_data in rows]
+        db.cursor().executemany(sql, values)
+
+    def _upsert_sql(self, supplied):
+        """Compile (once per column set) the single-row upsert statement
+
+        Peewee builds multi-row inserts value by value in Python, which
+        dominates ingestion time; reusing one compiled statement with
+        ``executemany`` keeps the work inside SQLite.
+        """
+        key = frozenset(supplied)
+        if key not in self._sql_cache:
+            update = {
+                field: getattr(EXCLUDED, field.column_name)
+                for field in self.fields
+                if (field.name in supplied or field.name == 'updated_at')
+                and field.name not in PROTECTED_COLUMNS
+            }
+            if 'photos_url' in supplied:
+                # Downloaded copies only stay valid while the attachment list is the same
+                same_photos = Expression(Visit.photos_url, OP.IS, EXCLUDED.photos_url)
+                update[Visit.photos_local] = Case(None, [(same_photos, Visit.photos_local)], SQL('NULL'))
+            query = (Visit
+                     .insert_many([[None] * len(self.fields)], fields=self.fields)
+                     .on_conflict(conflict_target=[Visit.kobo_submission_id], update=update))
+            sql, params = query.sql()
+            if len(params) != len(self.fields):
+                # executemany binds exactly one value per field
+                raise ValueError(f"Upsert binds {len(params)} parameters for {len(self.fields)} fields")
+            self._sql_cache[key] = sql
+        return self._sql_cache[key]
+
+    def _row_tuple(self, visit_data, now):
+        """Build a full database row, filling unsupplied columns with model defaults"""
+        row = []
+        for field in self.fields:
+            if field.name in visit_data:
+                value = visit_data[field.name]
+            elif field.name == 'updated_at':
+                value = now
+            elif callable(field.default):
+                value = field.default()
+            else:
+                value = field.default
+            row.append(field.db_value(value))
+        return tuple(row)
@@ -0,0 +1,245 @@
+"""
+Versioned schema migrations.
+
+A new database is created straight from the models and stamped with the
+latest version. An existing one is brought up to date by running, in
+order, every migration newer than what the ``schema_version`` table
+records; each runs in its own transaction unless it says otherwise.
+
+Schema changes go here as a new ``@migration`` with the next version
+number. Where possible write them against table and column names rather
+than the current models, so they keep doing the same thing as the models
+change.
+"""
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+from peewee import CharField, DateTimeField, IntegerField, OperationalError, fn
+from playhouse.migrate import SqliteMigrator, migrate
+
+from core.database import db
+from core.fields import encode_payload, parse_legacy_payload
+from core.models import BaseModel
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple('Migration', 'version description apply atomic')
+
+MIGRATIONS = []
+
+
+def migration(version, description, atomic=True):
+    """Register ``apply(migrator, models)`` as schema version ``version``"""
+    def register(apply):
+        MIGRATIONS.append(Migration(version, description, apply, atomic))
+        return apply
+    return register
+
+
+class SchemaVersion(BaseModel):
+    """One row per applied migration"""
+    version = IntegerField(primary_key=True)
+    description = CharField(max_length=200)
+    applied_at = DateTimeField(default=datetime.now)
+
+    class Meta:
+        table_name = 'schema_version'
+
+
+def current_version():
+    return SchemaVersion.select(fn.MAX(SchemaVersion.version)).scalar() or 0
+
+
+def migrate_database(models):
+    """Create or upgrade the schema for ``models``; returns the versions applied"""
+    fresh = not any(db.table_exists(model._meta.table_name) for model in models)
+    db.create_tables([SchemaVersion], safe=True)
+
+    if fresh:
+        with db.atomic():
+            db.create_tables(models)
+            for step in MIGRATIONS:
+                SchemaVersion.create(version=step.version, description=step.description)
+        logger.info(f"Created database schema at version {current_version()}")
+        return []
+
+    applied = {version for version, in SchemaVersion.select(SchemaVersion.version).tuples()}
+    migrator = SqliteMigrator(db.obj)
+    done = []
+    for step in sorted(MIGRATIONS, key=lambda step: step.version):
+        if step.version in applied:
+            continue
+        logger.info(f"Applying schema migration {step.version}: {step.description}")
+        if step.atomic:
+            with db.atomic():
+                step.apply(migrator, models)
+                SchemaVersion.create(version=step.version, description=step.description)
+        else:
+            step.apply(migrator, models)
+            SchemaVersion.create(version=step.version, description=step.description)
+        done.append(step.version)
+
+    # Tables introduced since the database was created
+    db.create_tables(models, safe=True)
+    if done:
+        logger.info(f"Database schema migrated to version {current_version()}")
+    return done
+
+
+def add_missing_index(migrator, table, columns, unique=False):
+    """Index ``columns`` of ``table`` unless an index on exactly those columns exists
+
+    With ``unique`` only a unique index counts as existing.
+    """
+    if not db.table_exists(table):
+        return False
+    if any(index.columns == list(columns) and (index.unique or not unique)
+           for index in db.get_indexes(table)):
+        return False
+    # Named the way peewee names model indexes; names are database-wide, so
+    # one left on a table from an older schema forces a variant
+    name = f"{table}_{'_'.join(columns)}"
+    taken = db.execute_sql("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone()
+    migrate(migrator.add_index(table, columns, unique=unique, name=f"{name}_idx" if taken else name))
+    return True
+
+
+# ─── Migrations ────────────────────────────────────────────────────
+
+@migration(1, "Add columns introduced before versioned migrations")
+def add_missing_columns(migrator, models):
+    """Catch up databases created by any earlier release
+
+    A column add that fails rolls the migration back, so it is retried on
+    the next start instead of being recorded as applied.
+    """
+    added = 0
+    for model in models:
+        table = model._meta.table_name
+        if not db.table_exists(table):
+            continue
+        existing = {column.name for column in db.get_columns(table)}
+        for field in model._meta.sorted_fields:
+            if field.column_name in existing:
+                continue
+            # Indexed separately: an index name left by an older schema must not fail the add
+            column = field.clone()
+            column.index = column.unique = False
+            if not column.null and column.default is None:
+                # Existing rows have no value to give it
+                column.null = True
+            try:
+                migrate(migrator.add_column(table, field.column_name, column))
+            except OperationalError as e:
+                # SQLite matches column names case-insensitively
+                if 'duplicate column name' not in str(e):
+                    raise
+                logger.debug(f"Column {table}.{field.column_name} already exists: {e}")
+                continue
+            if field.index or field.unique:
+                add_missing_index(migrator, table, (field.column_name,), unique=field.unique)
+            added += 1
+    if added:
+        logger.info(f"Added {added} missing database columns")
+
+
+@migration(2, "Compress raw API payloads stored as text", atomic=False)
+def convert_legacy_payloads(migrator, models, batch_size=500):
+    """Re-encode payloads stored as text by earlier versions into compressed BLOBs"""
+    converted = 0
+    for model in models:
+        if not db.table_exists(model._meta.table_name):
+            continue
+        for field in model.payload_fields():
+            while True:
+                rows = list(model
+                            .select(model._meta.primary_key, field)
+                            .where(fn.typeof(field) == 'text')
+                            .limit(batch_size)
+                            .tuples())
+                if not rows:
+                    break
+                with db.atomic():
+                    for pk, text in rows:
+                        (model
+                         .update({field: encode_payload(parse_legacy_payload(text), field.codec)})
+                         .where(model._meta.primary_key == pk)
+                         .execute())
+                converted += len(rows)
+
+    if converted:
+        logger.info(f"Compressed {converted} stored payloads")
+        # Hand the freed pages back to the filesystem
+        db.execute_sql('VACUUM')
+    return converted
+
+
+@migration(3, "Index visit and appointment columns used by page filters")
+def add_page_indexes(migrator, models):
+    indexes = [
+        ('visit', ('visit_date',)),
+        ('visit', ('volunteer_id',)),
+        ('visit', ('volunteer_2_id',)),
+        ('visit', ('status',)),
+        ('visit', ('volunteer_id', 'visit_date')),
+        ('visit', ('volunteer_2_id', 'visit_date')),
+        ('appointment', ('start_time',)),
+    ]
+    added = sum(add_missing_index(migrator, table, columns) for table, columns in indexes)
+    if added:
+        logger.info(f"Added {added} indexes")
+
+
+@migration(4, "Unique indexes on the keys sync upserts conflict on")
+def add_upsert_keys(migrator, models):
+    """``ON CONFLICT`` needs a unique index on its target column
+
+    Databases from releases before the ``visit``/``appointment`` rename only
+    have them on the legacy tables. Duplicate keys are resolved first, keeping
+    the newest row: older visits keep their data but lose the submission id,
+    older appointments are moved to an ``appointment_duplicate`` table.
+    """
+    if db.table_exists('visit'):
+        cleared = db.execute_sql(
+            'UPDATE "visit" SET "kobo_submission_id" = NULL '
+            'WHERE "kobo_submission_id" IS NOT NULL AND "id" NOT IN '
+            '(SELECT MAX("id") FROM "visit" GROUP BY "kobo_submission_id")').rowcount
+        if cleared:
+            logger.warning(f"Detached {cleared} visits sharing a submission id with a newer visit")
+    if db.table_exists('appointment'):
+        duplicates = ('FROM "appointment" WHERE "calendly_event_uuid" IS NOT NULL AND "id" NOT IN '
+                      '(SELECT MAX("id") FROM "appointment" GROUP BY "calendly_event_uuid")')
+        moved = db.execute_sql(f'SELECT COUNT(*) {duplicates}').fetchone()[0]
+        if moved:
+            db.execute_sql('CREATE TABLE IF NOT EXISTS "appointment_duplicate" AS SELECT * FROM "appointment" WHERE 0')
+            db.execute_sql(f'INSERT INTO "appointment_duplicate" SELECT * {duplicates}')
+            db.execute_sql(f'DELETE {duplicates}')
+            logger.warning(f"Moved {moved} duplicate appointments to appointment_duplicate")
+
+    added = (add_missing_index(migrator, 'visit', ('kobo_submission_id',), unique=True)
+             + add_missing_index(migrator, 'appointment', ('calendly_event_uuid',), unique=True))
+    if added:
+        logger.info(f"Added {added} unique indexes")
+
+
+@migration(5, "Make columns dropped from the models nullable")
+def relax_legacy_columns(migrator, models):
+    """Columns left over from earlier releases must not block new rows
+
+    The sync only writes the columns the models define, so a leftover
+    ``NOT NULL`` column without a default rejects every insert. Its data is
+    kept; only the constraint goes.
+    """
+    relaxed = 0
+    for model in models:
+        table = model._meta.table_name
+        if not db.table_exists(table):
+            continue
+        known = {field.column_name for field in model._meta.sorted_fields}
+        for column in db.get_columns(table):
+            if column.name not in known and not column.null and column.default is None:
+                migrate(migrator.drop_not_null(table, column.name))
+                relaxed += 1
+    if relaxed:
+        logger.info(f"Made {relaxed} legacy columns nullable")
@@ -2,21 +2,35 @@
 Enhanced database models for EnergieFixers071 application with comprehensive visit data.
 """
 import logging
-from datetime import datetime, date
+from datetime import datetime, date, time
 from peewee import (
     Model, CharField, TextField, DateField, DateTimeField, 
-    BooleanField, IntegerField, FloatField, ForeignKeyField
+    BooleanField, IntegerField, FloatField, ForeignKeyField, SQL, fn
 )
+from core.fields import CompressedJSONField
 
 logger = logging.getLogger(__name__)
 
 # Import database proxy
 from core.database import db
 
+# Runs started before this belong to an earlier process and cannot still be going
+PROCESS_STARTED = datetime.now()
+
 class BaseModel(Model):
     """Base model class"""
     class Meta:
         database = db
+    
+    @classmethod
+    def payload_fields(cls):
+        return [field for field in cls._meta.sorted_fields if isinstance(field, CompressedJSONField)]
+    
+    @classmethod
+    def select_without_payloads(cls, *extra):
+        """Select every column except the raw API payloads, for list views"""
+        fields = [field for field in cls._meta.sorted_fields if not isinstance(field, CompressedJSONField)]
+        return cls.select(*fields, *extra)
 
 class Volunteer(BaseModel):
     """Enhanced volunteer model"""
@@ -55,7 +69,7 @@ class Visit(BaseModel):
     volunteer = ForeignKeyField(Volunteer, backref='visits', null=True)
     volunteer_2 = ForeignKeyField(Volunteer, backref='secondary_visits', null=True)  # Second volunteer
     address = CharField(max_length=200)
-    visit_date = DateField(default=date.today)
+    visit_date = DateField(default=date.today, index=True)
     start_time = DateTimeField(null=True)
     end_time = DateTimeField(null=True)
     appointment_time = CharField(max_length=20, null=True)
@@ -130,6 +144,7 @@ class Visit(BaseModel):
     resident_email = CharField(max_length=100, null=True, help_text="Resident email address")
     photos = TextField(null=True, help_text="Photo filenames")
     photos_url = TextField(null=True, help_text="Photo URLs")
+    photos_local = TextField(null=True, help_text="Downloaded photo paths, relative to the attachment store")
     
     # Complaint flags (derived from problems)
     mold_complaint = BooleanField(default=False)
@@ -139,20 +154,59 @@ class Visit(BaseModel):
     kobo_submission_id = CharField(max_length=50, null=True, unique=True)
     kobo_uuid = CharField(max_length=100, null=True)
     submission_time = DateTimeField(null=True)
-    visit_data = TextField(null=True)  # JSON storage for full form data
+    visit_data = CompressedJSONField(null=True)  # Full Kobo submission
+    content_hash = CharField(max_length=64, null=True)  # SHA-256 of the submission and matched volunteers
     
     # Metadata
-    status = CharField(max_length=20, default='completed')
+    status = CharField(max_length=20, default='completed', index=True)
     notes = TextField(null=True, help_text="Internal notes about the visit")
     created_at = DateTimeField(default=datetime.now)
     updated_at = DateTimeField(default=datetime.now)
+    
+    class Meta:
+        indexes = (
+            # Per-volunteer history, newest first
+            (('volunteer', 'visit_date'), False),
+            (('volunteer_2', 'visit_date'), False),
+        )
+
+class SyncCursor(BaseModel):
+    """High-water mark of the newest KoboToolbox submission synced per form"""
+    form_id = CharField(max_length=100, unique=True)
+    last_submission_time = CharField(max_length=40, null=True)  # Kobo ISO string, used verbatim in queries
+    last_submission_id = IntegerField(null=True)
+    last_synced_at = DateTimeField(null=True)
+    
+    @classmethod
+    def for_form(cls, form_id):
+        """Get the cursor for a form, creating an empty one if needed"""
+        cursor, _ = cls.get_or_create(form_id=form_id)
+        return cursor
+    
+    def is_seen(self, submission_time, submission_id):
+        """Check if a submission is at or behind this cursor"""
+        if not self.last_submission_time or not submission_time:
+            return False
+        if submission_time != self.last_submission_time:
+            return submission_time < self.last_submission_time
+        return (submission_id or 0) <= (self.last_submission_id or 0)
+    
+    def edited_since(self, last_edited):
+        """Check if a ``_last_edited`` stamp is at or after this cursor's position"""
+        return bool(self.last_submission_time and last_edited) and last_edited >= self.last_submission_time
+    
+    def advance(self, submission_time, submission_id):
+        """Move the cursor forward if the submission is newer"""
+        if submission_time and not self.is_seen(submission_time, submission_id):
+            self.last_submission_time = submission_time
+            self.last_submission_id = submission_id
 
 class Appointment(BaseModel):
     """Appointment model for Calendly integration"""
     calendly_event_uuid = CharField(max_length=100, unique=True)
     calendly_uri = CharField(max_length=200, null=True)
     event_name = CharField(max_length=200)
-    start_time = DateTimeField()
+    start_time = DateTimeField(index=True)
     end_time = DateTimeField()
     status = CharField(max_length=20, default='scheduled')
     location = CharField(max_length=200, null=True)
@@ -164,17 +218,157 @@ class Appointment(BaseModel):
     invitee_email = CharField(max_length=100, null=True)
     
     # Integration Data
-    calendly_data = TextField(null=True)  # JSON storage
+    calendly_data = CompressedJSONField(null=True)  # Full Calendly event
+    content_hash = CharField(max_length=64, null=True)  # SHA-256 of the event payload
     
     # Metadata
     created_at = DateTimeField(default=datetime.now)
     updated_at = DateTimeField(default=datetime.now)
 
+class BackfillWindow(BaseModel):
+    """Checkpoint for one time window of a historical backfill"""
+    source = CharField(max_length=20)
+    window_start = DateTimeField()
+    window_end = DateTimeField()
+    status = CharField(max_length=20, default='pending')
+    events_synced = IntegerField(default=0)
+    completed_at = DateTimeField(null=True)
+    
+    class Meta:
+        indexes = (
+            (('source', 'window_start', 'window_end'), True),
+        )
+
+class SyncRun(BaseModel):
+    """Journal entry for one sync run, checkpointed after every committed batch"""
+    source = CharField(max_length=20, default='kobo')
+    form_id = CharField(max_length=100, null=True)
+    mode = CharField(max_length=20, default='incremental')  # incremental, full, export, import, retry
+    status = CharField(max_length=20, default='running')  # running, completed, failed, interrupted
+    resumed_from = ForeignKeyField('self', null=True, backref='resumptions')
+    
+    # Position of the last committed batch
+    cursor_time = CharField(max_length=40, null=True)
+    cursor_id = IntegerField(null=True)
+    
+    # Counts
+    fetched = IntegerField(default=0)
+    inserted = IntegerField(default=0)
+    updated = IntegerField(default=0)
+    unchanged = IntegerField(default=0)
+    failed = IntegerField(default=0)
+    batches = IntegerField(default=0)
+    
+    # Timings
+    started_at = DateTimeField(default=datetime.now)
+    last_checkpoint_at = DateTimeField(null=True)
+    finished_at = DateTimeField(null=True)
+    error = TextField(null=True)
+    
+    @property
+    def duration(self):
+        """Run time in seconds, up to now for a run still going"""
+        return ((self.finished_at or datetime.now()) - self.started_at).total_seconds()
+    
+    @classmethod
+    def latest(cls, source, form_id, mode=None):
+        """The most recent run for a form, optionally of one ``mode``"""
+        query = cls.select().where((cls.source == source) & (cls.form_id == form_id))
+        if mode is not None:
+            query = query.where(cls.mode == mode)
+        return query.order_by(cls.started_at.desc(), cls.id.desc()).first()
+    
+    @classmethod
+    def interrupt_abandoned(cls, source, form_id):
+        """Mark runs an earlier process left running as interrupted, returning them
+        
+        Runs started by this process may still be going in another thread,
+        so only those older than ``PROCESS_STARTED`` are touched.
+        """
+        runs = list(cls
+                    .select()
+                    .where((cls.source == source) & (cls.form_id == form_id) &
+                           (cls.status == 'running') & (cls.started_at < PROCESS_STARTED)))
+        for run in runs:
+            run.status = 'interrupted'
+            run.save()
+        return runs
+
+class DeadLetter(BaseModel):
+    """Raw payload of a record that could not be synced, kept for retry"""
+    source = CharField(max_length=20, default='kobo')
+    record_id = CharField(max_length=100)  # Kobo submission id or Calendly event UUID
+    payload = CompressedJSONField(null=True)
+    stage = CharField(max_length=20)  # parse, write
+    error = TextField()
+    attempts = IntegerField(default=1)
+    sync_run = ForeignKeyField(SyncRun, null=True, backref='dead_letters', on_delete='SET NULL')
+    created_at = DateTimeField(default=datetime.now)
+    last_attempt_at = DateTimeField(default=datetime.now)
+    resolved_at = DateTimeField(null=True)
+    
+    class Meta:
+        indexes = (
+            (('source', 'record_id'), True),
+        )
+    
+    @classmethod
+    def record_many(cls, source, failures, sync_run=None):
+        """Store ``(record_id, payload, stage, error)`` failures, counting repeat attempts"""
+        now = datetime.now()
+        rows = [{
+            'source': source, 'record_id': str(record_id), 'payload': payload,
+            'stage': stage, 'error': str(error), 'sync_run': sync_run,
+            'created_at': now, 'last_attempt_at': now,
+        } for record_id, payload, stage, error in failures]
+        for i in range(0, len(rows), 100):
+            (cls
+             .insert_many(rows[i:i + 100])
+             .on_conflict(
+                 conflict_target=[cls.source, cls.record_id],
+                 preserve=[cls.payload, cls.stage, cls.error, cls.sync_run, cls.last_attempt_at],
+                 update={cls.attempts: cls.attempts + 1, cls.resolved_at: None})
+             .execute())
+    
+    @classmethod
+    def pending(cls, source):
+        return cls.select().where((cls.source == source) & cls.resolved_at.is_null())
+    
+    @classmethod
+    def resolve(cls, source, record_ids):
+        """Mark the letters of records that have since been stored as resolved"""
+        record_ids = [str(record_id) for record_id in record_ids]
+        resolved = 0
+        for i in range(0, len(record_ids), 500):
+            resolved += (cls
+                         .update(resolved_at=datetime.now())
+                         .where((cls.source == source) & cls.resolved_at.is_null() &
+                                cls.record_id.in_(record_ids[i:i + 500]))
+                         .execute())
+        return resolved
+
+class AttachmentBlob(BaseModel):
+    """One file in the content-addressed attachment store"""
+    sha256 = CharField(max_length=64, unique=True)
+    path = CharField(max_length=200)  # Relative to Config.KOBO_ATTACHMENT_DIR
+    size = IntegerField()
+    mimetype = CharField(max_length=100, null=True)
+    created_at = DateTimeField(default=datetime.now)
+
+class Attachment(BaseModel):
+    """A downloaded Kobo attachment; identical files share one blob"""
+    source_key = CharField(max_length=200, unique=True)  # Kobo attachment uid/id, or its URL
+    filename = CharField(max_length=255, null=True)
+    blob = ForeignKeyField(AttachmentBlob, backref='attachments')
+    downloaded_at = DateTimeField(default=datetime.now)
+
 def create_tables():
-    """Create all database tables"""
+    """Create the database tables, or migrate an existing database to the current schema"""
+    from core.migrations import migrate_database
+    
     try:
-        tables = [Volunteer, Visit, Appointment]
-        db.create_tables(tables, safe=True)
+        tables = [Volunteer, Visit, SyncCursor, Appointment, BackfillWindow, SyncRun, DeadLetter, AttachmentBlob, Attachment]
+        migrate_database(tables)
         logger.info(f"Created {len(tables)} database tables")
         
         # Create dummy data if tables are empty
@@ -423,6 +617,50 @@ def create_dummy_data():
     except Exception as e:
         logger.error(f"Failed to create dummy data: {e}")
 
+# Period filters
+def period_bounds(year, month=None, quarter=None):
+    """Half-open ``(start, end)`` dates covering a year, a quarter or a month"""
+    if month and quarter:
+        raise ValueError("Give a month or a quarter, not both")
+    if quarter:
+        if not 1 <= quarter <= 4:
+            raise ValueError(f"Invalid quarter {quarter}")
+        month, months = 3 * (quarter - 1) + 1, 3
+    elif month:
+        months = 1
+    else:
+        month, months = 1, 12
+    start = date(year, month, 1)
+    end_month = month - 1 + months
+    return start, date(year + end_month // 12, end_month % 12 + 1, 1)
+
+def in_period(field, year=None, month=None, quarter=None, start=None, end=None):
+    """Condition for ``field`` falling in a period, written as a date range
+    
+    ``field.month == m`` compiles to a ``strftime`` call per row, which no
+    index can serve; plain comparisons on the column can. Pass a ``year``
+    (with a ``month`` or ``quarter``), or custom ``start``/``end`` dates
+    where ``end`` is exclusive and either may be left open, not both forms.
+    """
+    if year is not None:
+        if start is not None or end is not None:
+            raise ValueError("Give a year or start/end bounds, not both")
+        start, end = period_bounds(year, month, quarter)
+    elif month or quarter:
+        raise ValueError("A month or quarter needs a year")
+    if isinstance(field, DateTimeField):
+        start = datetime.combine(start, time.min) if start and not isinstance(start, datetime) else start
+        end = datetime.combine(end, time.min) if end and not isinstance(end, datetime) else end
+    
+    conditions = []
+    if start is not None:
+        conditions.append(field >= start)
+    if end is not None:
+        conditions.append(field < end)
+    if not conditions:
+        raise ValueError("A period needs a year or at least one bound")
+    return conditions[0] if len(conditions) == 1 else conditions[0] & conditions[1]
+
 # Statistics functions with enhanced calculations
 def get_volunteer_stats():
     """Get comprehensive volunteer statistics"""
@@ -432,11 +670,9 @@ def get_volunteer_stats():
         total_visits = Visit.select().count()
         
         # Get visits this month
-        current_month = datetime.now().month
-        current_year = datetime.now().year
+        today = date.today()
         visits_this_month = Visit.select().where(
-            (Visit.visit_date.month == current_month) & 
-            (Visit.visit_date.year == current_year)
+            in_period(Visit.visit_date, today.year, today.month)
         ).count()
         
         # Calculate additional stats
@@ -465,10 +701,70 @@ def get_volunteer_stats():
             "volunteers_with_visits": 0
         }
 
+# Statistics for a volunteer without any visits
+EMPTY_VOLUNTEER_AGGREGATES = {
+    "visit_count": 0,
+    "first_visit": None,
+    "last_visit": None,
+    "monthly_average": 0,
+    "monthly": {},
+}
+
+def get_volunteer_aggregates(volunteer_ids=None):
+    """Visit statistics for every volunteer, or just ``volunteer_ids``, in one query
+    
+    Visits are counted for the primary and the second volunteer alike, once
+    per visit. Returns ``{volunteer_id: stats}`` with the keys of
+    ``EMPTY_VOLUNTEER_AGGREGATES``; ``monthly`` maps ``(year, month)`` to a
+    visit count. Volunteers without visits are left out.
+    """
+    try:
+        primary = (Visit
+                   .select(Visit.volunteer.alias('volunteer_id'), Visit.visit_date)
+                   .where(Visit.volunteer.is_null(False)))
+        # A volunteer entered in both slots already counts through the first
+        secondary = (Visit
+                     .select(Visit.volunteer_2.alias('volunteer_id'), Visit.visit_date)
+                     .where(Visit.volunteer_2.is_null(False) &
+                            (Visit.volunteer.is_null() | (Visit.volunteer_2 != Visit.volunteer))))
+        if volunteer_ids is not None:
+            primary = primary.where(Visit.volunteer.in_(list(volunteer_ids)))
+            secondary = secondary.where(Visit.volunteer_2.in_(list(volunteer_ids)))
+        
+        visits = primary.union_all(secondary).alias('visits')
+        month = fn.strftime('%Y-%m', visits.c.visit_date)
+        query = (Visit
+                 .select(visits.c.volunteer_id, month, fn.COUNT(SQL('*')),
+                         fn.MIN(visits.c.visit_date), fn.MAX(visits.c.visit_date))
+                 .from_(visits)
+                 .group_by(visits.c.volunteer_id, month)
+                 .tuples())
+        
+        aggregates = {}
+        for volunteer_id, year_month, count, first, last in query:
+            stats = aggregates.setdefault(volunteer_id, dict(EMPTY_VOLUNTEER_AGGREGATES, monthly={}))
+            first, last = date.fromisoformat(first[:10]), date.fromisoformat(last[:10])
+            stats["visit_count"] += count
+            stats["first_visit"] = min(first, stats["first_visit"] or first)
+            stats["last_visit"] = max(last, stats["last_visit"] or last)
+            year, month_number = year_month.split("-")
+            stats["monthly"][(int(year), int(month_number))] = count
+        
+        for stats in aggregates.values():
+            # Months from the first visit to the last, both included
+            first, last = stats["first_visit"], stats["last_visit"]
+            months = (last.year - first.year) * 12 + last.month - first.month + 1
+            stats["monthly_average"] = round(stats["visit_count"] / max(months, 1), 1)
+        return aggregates
+        
+    except Exception as e:
+        logger.error(f"Failed to get volunteer aggregates: {e}")
+        return {}
+
 def get_recent_visits(limit=10):
     """Get recent visits with enhanced data"""
     try:
-        return list(Visit.select().order_by(Visit.visit_date.desc()).limit(limit))
+        return list(Visit.select_without_payloads().order_by(Visit.visit_date.desc()).limit(limit))
     except Exception as e:
         logger.error(f"Failed to get recent visits: {e}")
         return []
@@ -476,7 +772,7 @@ def get_recent_visits(limit=10):
 def get_upcoming_appointments(limit=10):
     """Get upcoming appointments"""
     try:
-        return list(Appointment.select().where(
+        return list(Appointment.select_without_payloads().where(
             Appointment.start_time > datetime.now()
         ).order_by(Appointment.start_time).limit(limit))
     except Exception as e:
@@ -0,0 +1,115 @@
+"""
+Process-pool mapping of KoboToolbox submissions for large syncs and imports.
+
+Mapping a submission onto the Visit columns, hashing it and compressing the
+raw payload is pure CPU work. For pages large enough to outweigh pickling
+costs it is split into chunks and run on a ``ProcessPoolExecutor``; workers
+return plain tuples in ``mapped_fields()`` order, with the payload already
+encoded for its BLOB column. Smaller pages are mapped in-process.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def default_processes(setting=None, cap=4):
+    """Worker count from a ``*_PROCESSES`` setting; 0 keeps the work in-process
+
+    ``setting`` defaults to ``KOBO_PARSE_PROCESSES``. A negative value means
+    one less than the CPU count, at most ``cap``.
+    """
+    if setting is None:
+        setting = Config.KOBO_PARSE_PROCESSES
+    if setting >= 0:
+        return setting
+    return max(0, min(cap, (os.cpu_count() or 1) - 1))
+
+
+def mapped_fields():
+    """Column order of the tuples returned by workers"""
+    from core.services.kobotoolbox import VISIT_CONVERTER
+    fields = [field_name for _, _, field_name, *_ in VISIT_CONVERTER.plan]
+    return tuple(dict.fromkeys(fields + ['kobo_submission_id', 'submission_time', 'visit_data', 'status']))
+
+
+def map_chunk(submissions):
+    """Worker entry point: map a chunk of submissions
+
+    Yields per submission either ``('ok', values, uitvoerders, payload_hash)``
+    or ``('error', exception)``.
+    """
+    from core.fields import encode_payload
+    from core.hashing import content_hash
+    from core.models import Visit
+    from core.services.kobotoolbox import map_submission
+
+    codec = Visit.visit_data.codec
+    fields = mapped_fields()
+    results = []
+    for submission in submissions:
+        try:
+            visit_data, uitvoerders = map_submission(submission)
+        except Exception as e:
+            results.append(('error', e))
+            continue
+        visit_data['visit_data'] = encode_payload(submission, codec)
+        values = tuple(visit_data[name] for name in fields)
+        results.append(('ok', values, uitvoerders, content_hash(submission)))
+    return results
+
+
+class ParallelMapper:
+    """Map pages of submissions, fanning large pages out to worker processes"""
+
+    def __init__(self, service, processes=None, chunk_size=250, min_parallel=500):
+        self.service = service
+        self.processes = default_processes() if processes is None else processes
+        self.chunk_size = chunk_size
+        self.min_parallel = min_parallel
+        self.fields = mapped_fields()
+        self.executor = None
+
+    def map_page(self, submissions):
+        """Map a page; returns ``(visit_data, uitvoerders, error)`` per submission
+
+        ``error`` is ``None`` on success; otherwise the other two are ``None``.
+        """
+        if self.processes < 1 or len(submissions) < self.min_parallel:
+            return [self._map_one(submission) for submission in submissions]
+
+        if self.executor is None:
+            logger.info(f"Starting {self.processes} parser processes")
+            self.executor = ProcessPoolExecutor(max_workers=self.processes)
+
+        chunks = [submissions[i:i + self.chunk_size] for i in range(0, len(submissions), self.chunk_size)]
+        mapped = []
+        for submission_chunk, results in zip(chunks, self.executor.map(map_chunk, chunks)):
+            for submission, result in zip(submission_chunk, results):
+                if result[0] == 'error':
+                    self.service._record_parse_error(submission, result[1])
+                    mapped.append((None, None, result[1]))
+                    continue
+                _, values, uitvoerders, payload_hash = result
+                visit_data = dict(zip(self.fields, values))
+                visit_data['payload_hash'] = payload_hash
+                mapped.append((visit_data, uitvoerders, None))
+        return mapped
+
+    def _map_one(self, submission):
+        from core.services.kobotoolbox import map_submission
+
+        try:
+            visit_data, uitvoerders = map_submission(submission)
+        except Exception as e:
+            self.service._record_parse_error(submission, e)
+            return None, None, e
+        return visit_data, uitvoerders, None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,233 @@
+"""
+Download of KoboToolbox photo attachments into a content-addressed store.
+
+Files are saved under ``Config.KOBO_ATTACHMENT_DIR`` by the SHA-256 of their
+content, so the same photo attached to several submissions is stored once.
+The ``Attachment`` table is the index: an attachment already in it, with
+its blob still on disk, is never requested again. Downloads run on a small
+thread pool and stream to a ``.part`` file; an interrupted download is
+resumed with an HTTP ``Range`` request on the next run. Only the calling
+thread writes to the database.
+
+Usage (from the ``app`` directory)::
+
+    python -m core.services.attachments
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path, PurePosixPath
+
+from config import Config
+from core.services.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+
+def attachment_key(attachment):
+    """Stable identity of a Kobo attachment entry"""
+    return str(attachment.get('uid') or attachment.get('id') or attachment['download_url'])
+
+
+def visit_attachments(submission):
+    """The downloadable entries of a submission's ``_attachments``"""
+    return [
+        attachment for attachment in (submission or {}).get('_attachments') or []
+        if isinstance(attachment, dict) and attachment.get('download_url')
+    ]
+
+
+class AttachmentStore:
+    """Content-addressed files: ``<root>/<sha[:2]>/<sha><ext>``"""
+
+    def __init__(self, root=None):
+        self.root = Path(root or Config.KOBO_ATTACHMENT_DIR)
+        self.partial_dir = self.root / 'partial'
+
+    def relative_path(self, sha256, extension=''):
+        return f"{sha256[:2]}/{sha256}{extension}"
+
+    def path(self, relative_path):
+        return self.root / relative_path
+
+    def exists(self, relative_path):
+        return self.path(relative_path).is_file()
+
+    def partial_path(self, key):
+        """Where an unfinished download of ``key`` is kept between runs"""
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+        return self.partial_dir / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.part"
+
+    def commit(self, partial, sha256, extension=''):
+        """Move a finished download into place, dropping it if the content is already stored"""
+        relative_path = self.relative_path(sha256, extension)
+        target = self.path(relative_path)
+        if target.is_file():
+            partial.unlink(missing_ok=True)
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(partial, target)
+        return relative_path
+
+
+class AttachmentDownloader:
+    """Fetch the attachments of synced visits that have no local copies yet"""
+
+    def __init__(self, headers=None, workers=None, store=None, http=None):
+        self.headers = headers or {}
+        self.workers = workers or Config.KOBO_ATTACHMENT_WORKERS
+        self.store = store or AttachmentStore()
+        self.http = http or get_http_client()
+        self.stats = {'visits': 0, 'downloaded': 0, 'reused': 0, 'failed': 0, 'bytes': 0}
+
+    def download_pending(self, batch_size=100):
+        """Download attachments for every visit missing ``photos_local``; returns stats"""
+        from core.models import Visit
+
+        self.stats = dict.fromkeys(self.stats, 0)
+        pending = (Visit
+                   .select(Visit.id, Visit.visit_data)
+                   .where(Visit.photos_url.is_null(False) & Visit.photos_local.is_null())
+                   .order_by(Visit.id))
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='attachments') as executor:
+            while True:
+                visits = list(pending.where(Visit.id > last_id).limit(batch_size))
+                if not visits:
+                    break
+                last_id = visits[-1].id
+                self._download_batch(visits, executor)
+
+        logger.info(
+            f"Attachments: {self.stats['downloaded']} downloaded ({self.stats['bytes'] / 1e6:.1f} MB), "
+            f"{self.stats['reused']} already stored, {self.stats['failed']} failed"
+        )
+        return self.stats
+
+    def _download_batch(self, visits, executor):
+        from core.models import Visit
+
+        attachments = {visit.id: visit_attachments(visit.visit_data) for visit in visits}
+        wanted = {attachment_key(a): a for entries in attachments.values() for a in entries}
+        paths = self._stored_paths(wanted)
+        self.stats['reused'] += len(paths)
+
+        futures = {
+            executor.submit(self._fetch, key, attachment): key
+            for key, attachment in wanted.items() if key not in paths
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                paths[key] = self._register(key, wanted[key], *future.result())
+                self.stats['downloaded'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.warning(f"Could not download attachment {key}: {e}")
+
+        for visit_id, entries in attachments.items():
+            keys = [attachment_key(a) for a in entries]
+            if all(key in paths for key in keys):
+                # An empty string marks a visit whose attachments are all gone
+                local = "\n".join(paths[key] for key in keys)
+                Visit.update(photos_local=local).where(Visit.id == visit_id).execute()
+                self.stats['visits'] += 1
+
+    def _stored_paths(self, wanted):
+        """Blob paths of the wanted attachments that are indexed and still on disk"""
+        from core.models import Attachment, AttachmentBlob
+
+        paths = {}
+        keys = list(wanted)
+        for i in range(0, len(keys), 500):
+            query = (Attachment
+                     .select(Attachment.source_key, AttachmentBlob.path)
+                     .join(AttachmentBlob)
+                     .where(Attachment.source_key.in_(keys[i:i + 500]))
+                     .tuples())
+            for key, path in query:
+                if self.store.exists(path):
+                    paths[key] = path
+        return paths
+
+    def _fetch(self, key, attachment):
+        """Stream one attachment to its ``.part`` file; runs on a pool thread
+
+        Returns ``(partial path, sha256, size)``. A ``.part`` left by an
+        earlier run is continued with a ``Range`` request when the server
+        supports it, and started over otherwise.
+        """
+        partial = self.store.partial_path(key)
+        offset = partial.stat().st_size if partial.exists() else 0
+        headers = dict(self.headers)
+        if offset:
+            headers['Range'] = f"bytes={offset}-"
+
+        with self.http.get(attachment['download_url'], headers=headers, stream=True, timeout=60) as response:
+            if offset and response.status_code == 416:
+                # The previous run had received everything
+                pass
+            else:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    offset = 0
+                with open(partial, 'ab' if offset else 'wb') as handle:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        handle.write(chunk)
+
+        digest = hashlib.sha256()
+        with open(partial, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return partial, digest.hexdigest(), partial.stat().st_size
+
+    def _register(self, key, attachment, partial, sha256, size):
+        """Store a finished download and index it"""
+        from core.models import Attachment, AttachmentBlob
+
+        filename = PurePosixPath(attachment.get('filename') or '').name or None
+        mimetype = attachment.get('mimetype')
+        extension = PurePosixPath(filename or '').suffix.lower() or mimetypes.guess_extension(mimetype or '') or ''
+
+        relative_path = self.store.commit(partial, sha256, extension)
+        blob, created = AttachmentBlob.get_or_create(
+            sha256=sha256, defaults={'path': relative_path, 'size': size, 'mimetype': mimetype}
+        )
+        if created:
+            self.stats['bytes'] += size
+        elif blob.path != relative_path:
+            # Same content under another extension: keep the first copy only
+            self.store.path(relative_path).unlink(missing_ok=True)
+        (Attachment
+         .insert(source_key=key, filename=filename, blob=blob)
+         .on_conflict(conflict_target=[Attachment.source_key],
+                      preserve=[Attachment.filename, Attachment.blob, Attachment.downloaded_at])
+         .execute())
+        return blob.path
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from core.database import initialize_database, close_database
+    from core.services.kobotoolbox import KoboToolboxService
+    if not initialize_database():
+        print("Error: Failed to initialize database. Check logs for details.")
+        return 1
+
+    try:
+        stats = KoboToolboxService().download_attachments()
+    finally:
+        close_database()
+    print(f"{stats['visits']} visits updated; {stats['downloaded']} files downloaded, "
+          f"{stats['reused']} already stored, {stats['failed']} failed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
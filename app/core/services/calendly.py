@@ -1,14 +1,20 @@
 """
 Calendly API service for fetching appointment data.
 """
-import requests
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, time, timedelta, timezone
 from config import Config
-from core.models import Appointment
+from core.database import db
+from core.dates import DateParser
+from core.hashing import content_hash
+from core.models import Appointment, BackfillWindow, DeadLetter
+from core.services.http_client import get_http_client
 import logging
 
 logger = logging.getLogger(__name__)
 
+EVENT_TIME = DateParser('Calendly event time', 'datetime', utc=True)
+
 class CalendlyService:
     """Service for interacting with Calendly API"""
     
@@ -16,50 +22,114 @@ class CalendlyService:
         self.api_token = Config.CALENDLY_API_TOKEN
         self.user_uri = Config.CALENDLY_USER_URI
         self.base_url = "https://api.calendly.com"
+        self.http = get_http_client()
         self.headers = {
             'Authorization': f'Bearer {self.api_token}',
             'Content-Type': 'application/json'
         }
+        self.last_sync_stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'canceled': 0, 'failed': 0}
     
     def test_connection(self):
         """Test API connection"""
         try:
             url = f"{self.base_url}/users/me"
-            response = requests.get(url, headers=self.headers, timeout=10)
+            response = self.http.get(url, headers=self.headers, timeout=10, cache=True)
             return response.status_code == 200
         except Exception as e:
             logger.error(f"Calendly connection test failed: {e}")
             return False
     
-    def get_scheduled_events(self, days_ahead=30):
-        """Fetch scheduled events from Calendly"""
-        try:
-            min_start_time = datetime.now().isoformat()
-            max_start_time = (datetime.now() + timedelta(days=days_ahead)).isoformat()
-            
-            url = f"{self.base_url}/scheduled_events"
-            params = {
-                'user': self.user_uri,
-                'min_start_time': min_start_time,
-                'max_start_time': max_start_time,
-                'count': 100
-            }
-            
-            response = requests.get(url, headers=self.headers, params=params, timeout=30)
+    def iter_scheduled_events(self, min_start_time, max_start_time, page_size=100):
+        """Yield every scheduled event in a time range, following page tokens"""
+        url = f"{self.base_url}/scheduled_events"
+        params = {
+            'user': self.user_uri,
+            'min_start_time': self._format_time(min_start_time),
+            'max_start_time': self._format_time(max_start_time),
+            'sort': 'start_time:asc',
+            'count': page_size
+        }
+        
+        while True:
+            response = self.http.get(url, headers=self.headers, params=params, timeout=30)
             response.raise_for_status()
             
             data = response.json()
-            return data.get('collection', [])
+            yield from data.get('collection', [])
+            
+            next_page_token = (data.get('pagination') or {}).get('next_page_token')
+            if not next_page_token:
+                break
+            params['page_token'] = next_page_token
+    
+    def get_scheduled_events(self, days_ahead=30):
+        """Fetch scheduled events from Calendly"""
+        try:
+            now = datetime.now()
+            return list(self.iter_scheduled_events(now, now + timedelta(days=days_ahead)))
             
         except Exception as e:
             logger.error(f"Failed to fetch Calendly events: {e}")
             return []
     
+    def backfill_appointments(self, start, end, window_days=30, max_workers=None):
+        """Import the appointment history between two dates
+        
+        ``start`` and ``end`` are dates (midnight UTC) or datetimes. The
+        range is split into windows that are fetched in parallel and stored
+        one window at a time. Completed windows are checkpointed, so
+        re-running an interrupted backfill only fetches the remaining ones.
+        """
+        start, end = self._as_utc(start), self._as_utc(end)
+        windows = []
+        window_start = start
+        while window_start < end:
+            window_end = min(window_start + timedelta(days=window_days), end)
+            window, _ = BackfillWindow.get_or_create(
+                source='calendly', window_start=window_start, window_end=window_end
+            )
+            if window.status != 'done':
+                windows.append(window)
+            window_start = window_end
+        
+        if not windows:
+            logger.info("Calendly backfill already complete")
+            return 0
+        
+        logger.info(f"Backfilling {len(windows)} Calendly windows from {start} to {end}")
+        synced_count = 0
+        max_workers = max(1, min(max_workers or Config.CALENDLY_MAX_CONCURRENCY, len(windows)))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='calendly-backfill') as executor:
+            futures = {
+                executor.submit(self._fetch_window, window): window
+                for window in windows
+            }
+            # Writes stay on this thread; workers only fetch
+            for future in as_completed(futures):
+                window = futures[future]
+                try:
+                    events = future.result()
+                    stats = self._reconcile_events(events, window.window_start, window.window_end)
+                    synced_count += stats['created'] + stats['updated'] + stats['canceled']
+                    window.status = 'done'
+                    window.events_synced = len(events)
+                    window.completed_at = datetime.now()
+                    window.save()
+                except Exception as e:
+                    logger.error(f"Backfill window {window.window_start} - {window.window_end} failed: {e}")
+        
+        logger.info(f"Backfilled {synced_count} appointments from Calendly")
+        return synced_count
+    
+    def _fetch_window(self, window):
+        """Fetch all events of one backfill window"""
+        return list(self.iter_scheduled_events(window.window_start, window.window_end))
+    
     def get_event_invitees(self, event_uuid):
-        """Get invitees for a specific event"""
+        """Get invitees for a specific event; None when they could not be fetched"""
         try:
             url = f"{self.base_url}/scheduled_events/{event_uuid}/invitees"
-            response = requests.get(url, headers=self.headers, timeout=10)
+            response = self.http.get(url, headers=self.headers, timeout=10)
             response.raise_for_status()
             
             data = response.json()
@@ -67,82 +137,249 @@ class CalendlyService:
             
         except Exception as e:
             logger.error(f"Failed to fetch event invitees: {e}")
-            return []
+            return None
     
-    def sync_appointments(self):
+    def sync_appointments(self, days_ahead=30):
         """Sync appointments from Calendly to local database"""
         try:
-            events = self.get_scheduled_events()
-            synced_count = 0
+            # Not get_scheduled_events: a failed fetch must not look like an
+            # empty window, or every local appointment would be canceled.
+            window_start = datetime.now()
+            window_end = window_start + timedelta(days=days_ahead)
+            events = list(self.iter_scheduled_events(window_start, window_end))
             
-            for event in events:
-                appointment_data = self._parse_event(event)
-                if appointment_data:
-                    appointment, created = Appointment.get_or_create(
-                        calendly_event_uuid=event.get('uuid'),
-                        defaults=appointment_data
-                    )
-                    if created:
-                        synced_count += 1
-                        # Get invitee information
-                        self._update_appointment_invitees(appointment, event.get('uuid'))
-            
-            logger.info(f"Synced {synced_count} appointments from Calendly")
+            stats = self._reconcile_events(events, window_start, window_end)
+            synced_count = stats['created'] + stats['updated'] + stats['canceled']
+            logger.info(f"Synced {synced_count} appointments from Calendly ({stats['unchanged']} unchanged)")
             return synced_count
-            
+        
         except Exception as e:
             logger.error(f"Appointment sync failed: {e}")
             return 0
     
-    def _parse_event(self, event):
-        """Parse Calendly event into appointment data"""
-        try:
-            appointment_data = {
-                'calendly_uri': event.get('uri'),
-                'event_name': event.get('name', 'Appointment'),
-                'start_time': self._parse_datetime(event.get('start_time')),
-                'end_time': self._parse_datetime(event.get('end_time')),
-                'status': event.get('status', 'scheduled').lower(),
-                'location': event.get('location', {}).get('location'),
-                'meeting_url': event.get('location', {}).get('join_url'),
-                'calendly_data': event
-            }
+    def apply_webhook(self, payload):
+        """Apply an ``invitee.created``/``invitee.canceled`` webhook delivery
+        
+        Returns False for deliveries of other event types, which are ignored,
+        and raises ``ValueError`` when the event cannot be parsed.
+        """
+        event_type = payload.get('event')
+        invitee = payload.get('payload') or {}
+        scheduled_event = invitee.get('scheduled_event')
+        if event_type not in ('invitee.created', 'invitee.canceled') or not scheduled_event:
+            logger.debug(f"Ignoring Calendly webhook '{event_type}'")
+            return False
+        
+        if event_type == 'invitee.canceled':
+            scheduled_event = dict(scheduled_event, status='canceled')
+        # Parsed up front so a bad event raises here instead of being dead-lettered as an event
+        self._parse_event(scheduled_event)
+        self._reconcile_events([scheduled_event], invitees_by_event={self._event_uuid(scheduled_event): [invitee]})
+        return True
+    
+    def retry_dead_letters(self):
+        """Apply every unresolved dead-lettered webhook delivery or event again
+        
+        Letters that go through are marked resolved; ones that fail again
+        keep their row with the attempt count raised.
+        """
+        resolved = 0
+        for letter in DeadLetter.pending('calendly'):
+            if not letter.payload:
+                continue
+            try:
+                if 'event' in letter.payload:
+                    self.apply_webhook(letter.payload)
+                else:
+                    # A scheduled event that failed to parse during a sync
+                    self._parse_event(letter.payload)
+                    self._reconcile_events([letter.payload])
+            except Exception as e:
+                logger.warning(f"Calendly dead letter {letter.record_id} failed again: {e}")
+                DeadLetter.record_many('calendly', [(letter.record_id, letter.payload, letter.stage, e)])
+                continue
+            letter.resolved_at = datetime.now()
+            letter.save()
+            resolved += 1
+        
+        logger.info(f"Retried Calendly dead letters, {resolved} resolved")
+        return resolved
+    
+    def _reconcile_events(self, events, window_start=None, window_end=None, invitees_by_event=None):
+        """Bring local appointments in line with a set of remote events
+        
+        Events whose payload hash changed are upserted by UUID. When a window
+        is given, local appointments in it that Calendly no longer returns
+        are marked canceled. All writes happen in one transaction. Invitees
+        already known (e.g. from a webhook payload) are not fetched again.
+        Events that cannot be parsed are dead-lettered instead of failing
+        the window.
+        """
+        stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'canceled': 0, 'failed': 0}
+        
+        # Every event Calendly still lists, parseable or not, is kept out of the cancel step
+        remote_uuids = set()
+        incoming = {}
+        failures = []
+        for event in events:
+            event_uuid = self._event_uuid(event)
+            remote_uuids.add(event_uuid)
+            try:
+                appointment_data = self._parse_event(event)
+            except Exception as e:
+                logger.error(f"Failed to parse Calendly event {event_uuid}: {e}")
+                failures.append((event_uuid, event, 'parse', e))
+                continue
+            appointment_data['calendly_event_uuid'] = event_uuid
+            appointment_data['content_hash'] = self._event_hash(event)
+            incoming[event_uuid] = appointment_data
+        stats['failed'] = len(failures)
+        
+        stored_hashes = self._stored_hashes(list(incoming))
+        changed = [
+            appointment_data for event_uuid, appointment_data in incoming.items()
+            if stored_hashes.get(event_uuid) != appointment_data['content_hash']
+        ]
+        stats['created'] = sum(1 for data in changed if data['calendly_event_uuid'] not in stored_hashes)
+        stats['updated'] = len(changed) - stats['created']
+        stats['unchanged'] = len(incoming) - len(changed)
+        
+        # Invitees are fetched for new or changed events only, before the transaction opens
+        if invitees_by_event is None:
+            invitees_by_event = self.fetch_invitees(data['calendly_event_uuid'] for data in changed)
+        for data in changed:
+            if invitees_by_event.get(data['calendly_event_uuid'], []) is None:
+                # No hash, so the next sync sees the event as changed and fetches its invitees again
+                data['content_hash'] = None
+        
+        now = datetime.now()
+        with db.atomic():
+            for i in range(0, len(changed), 100):
+                (Appointment
+                 .insert_many(changed[i:i + 100])
+                 .on_conflict(
+                     conflict_target=[Appointment.calendly_event_uuid],
+                     preserve=[Appointment._meta.fields[name] for name in changed[0]
+                               if name != 'calendly_event_uuid'],
+                     update={Appointment.updated_at: now})
+                 .execute())
             
-            # Determine meeting type
-            location_type = event.get('location', {}).get('type', '')
-            if 'phone' in location_type.lower():
-                appointment_data['meeting_type'] = 'phone'
-            elif 'zoom' in location_type.lower() or 'meet' in location_type.lower():
-                appointment_data['meeting_type'] = 'online'
-            else:
-                appointment_data['meeting_type'] = 'in_person'
+            for event_uuid, invitees in invitees_by_event.items():
+                if invitees:
+                    invitee = invitees[0]  # Take first invitee
+                    Appointment.update(
+                        invitee_name=invitee.get('name'),
+                        invitee_email=invitee.get('email')
+                    ).where(Appointment.calendly_event_uuid == event_uuid).execute()
             
-            return appointment_data
+            if window_start and window_end:
+                stats['canceled'] = self._cancel_missing(remote_uuids, window_start, window_end, now)
             
-        except Exception as e:
-            logger.error(f"Failed to parse Calendly event: {e}")
-            return None
+            if failures:
+                DeadLetter.record_many('calendly', failures)
+            if incoming:
+                DeadLetter.resolve('calendly', list(incoming))
+        
+        self.last_sync_stats = stats
+        return stats
+    
+    def _stored_hashes(self, event_uuids):
+        """Map already-stored event UUIDs to their payload hash"""
+        stored = {}
+        for i in range(0, len(event_uuids), 500):
+            stored.update(Appointment
+                          .select(Appointment.calendly_event_uuid, Appointment.content_hash)
+                          .where(Appointment.calendly_event_uuid.in_(event_uuids[i:i + 500]))
+                          .tuples())
+        return stored
+    
+    def _cancel_missing(self, remote_uuids, window_start, window_end, now):
+        """Cancel local appointments in the window that Calendly no longer lists"""
+        local_uuids = set(Appointment
+                          .select(Appointment.calendly_event_uuid)
+                          .where((Appointment.start_time >= window_start.astimezone(timezone.utc)) &
+                                 (Appointment.start_time < window_end.astimezone(timezone.utc)) &
+                                 (Appointment.status != 'canceled'))
+                          .tuples())
+        missing = [event_uuid for (event_uuid,) in local_uuids if event_uuid not in remote_uuids]
+        for i in range(0, len(missing), 500):
+            (Appointment
+             .update(status='canceled', updated_at=now)
+             .where(Appointment.calendly_event_uuid.in_(missing[i:i + 500]))
+             .execute())
+        if missing:
+            logger.info(f"Marked {len(missing)} appointments as canceled")
+        return len(missing)
+    
+    def _event_hash(self, event):
+        """Stable hash of an event payload, used to skip unchanged events"""
+        return content_hash(event)
+    
+    def _parse_event(self, event):
+        """Parse Calendly event into appointment data
+        
+        Raises ``ValueError`` when a start or end time is missing or
+        malformed, as the appointment cannot be stored without them.
+        """
+        for key in ('start_time', 'end_time'):
+            if not event.get(key):
+                raise ValueError(f"Calendly event has no {key}")
+        
+        location = event.get('location') or {}
+        appointment_data = {
+            'calendly_uri': event.get('uri'),
+            'event_name': event.get('name') or 'Appointment',
+            'start_time': self._parse_datetime(event.get('start_time')),
+            'end_time': self._parse_datetime(event.get('end_time')),
+            'status': (event.get('status') or 'scheduled').lower(),
+            'location': location.get('location'),
+            'meeting_url': location.get('join_url'),
+            'calendly_data': event
+        }
+        
+        # Determine meeting type
+        location_type = location.get('type') or ''
+        if 'phone' in location_type.lower():
+            appointment_data['meeting_type'] = 'phone'
+        elif 'zoom' in location_type.lower() or 'meet' in location_type.lower():
+            appointment_data['meeting_type'] = 'online'
+        else:
+            appointment_data['meeting_type'] = 'in_person'
+        
+        return appointment_data
     
     def _parse_datetime(self, datetime_string):
-        """Parse datetime string from Calendly"""
-        if not datetime_string:
-            return None
+        """Parse a Calendly ISO timestamp into an aware UTC datetime
         
-        try:
-            # Calendly uses ISO format
-            return datetime.fromisoformat(datetime_string.replace('Z', '+00:00'))
-        except Exception as e:
-            logger.error(f"Failed to parse datetime: {datetime_string}, {e}")
-            return None
+        Raises ``DateParseError`` for malformed values, so the event is
+        skipped instead of being stored with a wrong time.
+        """
+        return EVENT_TIME(datetime_string)
     
-    def _update_appointment_invitees(self, appointment, event_uuid):
-        """Update appointment with invitee information"""
-        try:
-            invitees = self.get_event_invitees(event_uuid)
-            if invitees:
-                invitee = invitees[0]  # Take first invitee
-                appointment.invitee_name = invitee.get('name')
-                appointment.invitee_email = invitee.get('email')
-                appointment.save()
-        except Exception as e:
-            logger.error(f"Failed to update appointment invitees: {e}")
+    def _format_time(self, value):
+        """Format a datetime as the UTC timestamp Calendly expects"""
+        if isinstance(value, str):
+            return value
+        return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    
+    def _as_utc(self, value):
+        """Aware UTC datetime for a backfill bound; dates start at midnight UTC"""
+        if isinstance(value, datetime):
+            return value.astimezone(timezone.utc)
+        if isinstance(value, date):
+            return datetime.combine(value, time.min, tzinfo=timezone.utc)
+        raise TypeError(f"Expected a date or datetime, got {type(value).__name__}")
+    
+    def _event_uuid(self, event):
+        """Get the event UUID, which Calendly v2 only exposes as the tail of the URI"""
+        return event.get('uuid') or (event.get('uri') or '').rstrip('/').rsplit('/', 1)[-1]
+    
+    def fetch_invitees(self, event_uuids, max_workers=None):
+        """Fetch invitees for many events concurrently on a bounded thread pool"""
+        event_uuids = list(event_uuids)
+        if not event_uuids:
+            return {}
+        
+        max_workers = max(1, min(max_workers or Config.CALENDLY_MAX_CONCURRENCY, len(event_uuids)))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='calendly') as executor:
+            return dict(zip(event_uuids, executor.map(self.get_event_invitees, event_uuids)))
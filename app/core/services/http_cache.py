@@ -0,0 +1,169 @@
+"""
+On-disk HTTP response cache with conditional revalidation.
+
+Responses that carry an ``ETag`` or ``Last-Modified`` validator are stored
+under ``Config.HTTP_CACHE_DIR``. The next request for the same URL sends
+``If-None-Match``/``If-Modified-Since``; a ``304 Not Modified`` is answered
+from disk, so an unchanged asset costs one small round trip. The cache is
+bounded in bytes and evicts the least recently used entries.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Response headers kept with a cached body
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+
+
+class HttpCache:
+    """Size-bounded LRU store of validated response bodies"""
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = Path(directory or Config.HTTP_CACHE_DIR)
+        self.max_bytes = Config.HTTP_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+
+        # key -> (last used, size); file mtimes carry recency across restarts
+        self.entries = {}
+        for meta_path in self.directory.glob('*.json'):
+            body_path = meta_path.with_suffix('.body')
+            if body_path.exists():
+                self.entries[meta_path.stem] = (
+                    meta_path.stat().st_mtime,
+                    body_path.stat().st_size + meta_path.stat().st_size,
+                )
+        self.total_bytes = sum(size for _, size in self.entries.values())
+
+    def key(self, url, params=None, headers=None):
+        """Cache key for a request; the credentials are part of it"""
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        authorization = (headers or {}).get('Authorization', '')
+        return hashlib.sha256(f"{full_url}\n{authorization}".encode('utf-8')).hexdigest()
+
+    def validators(self, key):
+        """Conditional request headers for a cached entry"""
+        meta = self._read_meta(key)
+        if meta is None:
+            return {}
+        headers = {}
+        if meta['headers'].get('ETag'):
+            headers['If-None-Match'] = meta['headers']['ETag']
+        if meta['headers'].get('Last-Modified'):
+            headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+        return headers
+
+    def revalidated(self, key, not_modified):
+        """Turn a 304 into the cached 200 response"""
+        meta = self._read_meta(key)
+        try:
+            body = (self.directory / f"{key}.body").read_bytes()
+        except OSError:
+            meta = None
+        if meta is None:
+            self.stats['misses'] += 1
+            return None
+
+        response = requests.Response()
+        response.status_code = meta['status']
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response._content = body
+        response.url = meta['url']
+        response.request = not_modified.request
+        response.encoding = not_modified.encoding
+        response.from_cache = True
+
+        self._touch(key)
+        self.stats['hits'] += 1
+        return response
+
+    def store(self, key, response):
+        """Persist a 200 response that can be revalidated later"""
+        headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+        if response.status_code != 200 or not ('ETag' in headers or 'Last-Modified' in headers):
+            return
+        if 'no-store' in headers.get('Cache-Control', ''):
+            return
+
+        meta = json.dumps({'url': response.url, 'status': response.status_code, 'headers': headers}).encode('utf-8')
+        size = len(meta) + len(response.content)
+        if size > self.max_bytes:
+            return
+
+        try:
+            self._write(self.directory / f"{key}.body", response.content)
+            self._write(self.directory / f"{key}.json", meta)
+        except OSError as e:
+            logger.warning(f"Could not cache {response.url}: {e}")
+            return
+
+        with self.lock:
+            _, previous = self.entries.get(key, (0, 0))
+            self.entries[key] = (os.path.getmtime(self.directory / f"{key}.json"), size)
+            self.total_bytes += size - previous
+            self.stats['stored'] += 1
+        self._evict()
+
+    def clear(self):
+        with self.lock:
+            keys = list(self.entries)
+        for key in keys:
+            self._remove(key)
+
+    def _read_meta(self, key):
+        try:
+            return json.loads((self.directory / f"{key}.json").read_bytes())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def _touch(self, key):
+        meta_path = self.directory / f"{key}.json"
+        try:
+            os.utime(meta_path)
+        except OSError:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.entries[key] = (meta_path.stat().st_mtime, self.entries[key][1])
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits its budget"""
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            victims = []
+            excess = self.total_bytes - self.max_bytes
+            for key, (_, size) in sorted(self.entries.items(), key=lambda item: item[1][0]):
+                if excess <= 0:
+                    break
+                victims.append(key)
+                excess -= size
+        for key in victims:
+            self._remove(key)
+            self.stats['evicted'] += 1
+
+    def _remove(self, key):
+        for suffix in ('.json', '.body'):
+            try:
+                (self.directory / f"{key}{suffix}").unlink()
+            except FileNotFoundError:
+                pass
+        with self.lock:
+            _, size = self.entries.pop(key, (0, 0))
+            self.total_bytes -= size
@@ -0,0 +1,152 @@
+"""
+Shared pooled HTTP client for the KoboToolbox and Calendly services.
+
+One ``requests.Session`` is reused by every service so TCP/TLS connections
+are kept alive between calls, and transient failures (429/5xx) are retried
+with exponential backoff that honours ``Retry-After``. Every attempt,
+retries included, passes through the per-host rate limiter. GETs made with
+``cache=True`` are revalidated against the on-disk response cache.
+"""
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InvalidHeader, MaxRetryError
+from urllib3.util.retry import Retry
+
+from config import Config
+from core.services.http_cache import HttpCache
+from core.services.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class JitteredRetry(Retry):
+    """Exponential backoff with jitter so parallel workers do not retry in lockstep"""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return backoff * random.uniform(0.5, 1.5) if backoff else 0
+
+
+class HttpClient:
+    """Thin wrapper around a pooled, retrying ``requests.Session``"""
+
+    def __init__(self, pool_size=None, max_retries=None, backoff_factor=None, rate_limiter=None, cache=None):
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self._cache = cache
+        self._cache_lock = threading.Lock()
+        pool_size = pool_size or Config.HTTP_POOL_SIZE
+        self.retry = JitteredRetry(
+            total=Config.HTTP_MAX_RETRIES if max_retries is None else max_retries,
+            backoff_factor=Config.HTTP_BACKOFF_FACTOR if backoff_factor is None else backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        # The adapter only retries connection errors; status retries happen in
+        # request() so each attempt goes through the rate limiter
+        adapter_retry = self.retry.new(status_forcelist=None, respect_retry_after_header=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=adapter_retry)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+            'User-Agent': f"{Config.APP_NAME}/{Config.APP_VERSION}",
+        })
+
+    def request(self, method, url, timeout=30, **kwargs):
+        """Send a request through the shared connection pool and host rate limiter
+
+        Retryable statuses are retried here with jittered backoff, or after
+        ``Retry-After`` when the server sends one. The last response is
+        returned once the retries run out.
+        """
+        host = urlsplit(url).netloc
+        retry = self.retry
+        while True:
+            self.rate_limiter.acquire(host)
+            response = self.session.request(method, url, timeout=timeout, **kwargs)
+            self.rate_limiter.observe(host, response.status_code, response.headers)
+
+            retry_after = response.headers.get('Retry-After')
+            if not retry.is_retry(method, response.status_code, retry_after is not None):
+                return response
+            try:
+                retry = retry.increment(method, url)
+            except MaxRetryError:
+                return response
+
+            delay = self._retry_delay(retry, retry_after)
+            logger.debug(f"{method} {url} returned {response.status_code}, retrying in {delay:.2f}s")
+            response.close()
+            time.sleep(delay)
+
+    def _retry_delay(self, retry, retry_after):
+        """Seconds to wait before the next attempt"""
+        if retry_after is not None:
+            try:
+                return retry.parse_retry_after(retry_after)
+            except InvalidHeader:
+                pass
+        return retry.get_backoff_time()
+
+    def get(self, url, cache=False, **kwargs):
+        """GET a URL; with ``cache`` the response is revalidated against the disk cache"""
+        if not cache:
+            return self.request('GET', url, **kwargs)
+        
+        http_cache = self.cache
+        key = http_cache.key(url, kwargs.get('params'), kwargs.get('headers'))
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers.update(http_cache.validators(key))
+        
+        response = self.request('GET', url, headers=headers, **kwargs)
+        if response.status_code == 304:
+            cached = http_cache.revalidated(key, response)
+            if cached is not None:
+                return cached
+            # Entry vanished between lookup and reply; fetch unconditionally
+            headers.pop('If-None-Match', None)
+            headers.pop('If-Modified-Since', None)
+            response = self.request('GET', url, headers=headers, **kwargs)
+        http_cache.store(key, response)
+        return response
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            with self._cache_lock:
+                if self._cache is None:
+                    self._cache = HttpCache()
+        return self._cache
+    
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Get the process-wide HTTP client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient()
+                logger.debug("Created shared HTTP client")
+    return _client
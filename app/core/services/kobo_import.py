@@ -0,0 +1,87 @@
+"""
+Offline import of downloaded KoboToolbox CSV/XLSX exports.
+
+Rows are streamed from the file, parsed by the same ``_parse_submission``
+logic as the API sync (the same ``SyncPipeline``) and upserted on
+``kobo_submission_id`` one chunk per transaction, so importing a file twice
+leaves the database unchanged.
+
+Usage (from the ``app`` directory)::
+
+    python -m core.services.kobo_import path/to/export.csv
+"""
+import argparse
+import logging
+import sys
+import time
+from datetime import datetime
+
+from core.services.kobo_export import iter_export_rows, iter_pages
+
+logger = logging.getLogger(__name__)
+
+
+def import_export_file(path, chunk_size=1000, progress=None):
+    """Import every row of a Kobo export file into the Visit table
+
+    ``progress(rows, stats)`` is called after each chunk. Returns the
+    ingestion stats plus the number of unparseable rows.
+    """
+    from core.models import SyncRun
+    from core.services.kobotoolbox import KoboToolboxService
+    from core.sync_pipeline import SyncPipeline
+    from core.volunteer_matcher import VolunteerMatcher
+
+    service = KoboToolboxService()
+    matcher = VolunteerMatcher.from_database()
+    journal = SyncRun.create(source='kobo', form_id=service.form_id, mode='import')
+    pipeline = SyncPipeline(service, matcher, batch_size=chunk_size, progress=progress, journal=journal)
+
+    # No cursor: a local file may be partial, so the API sync position is kept
+    try:
+        stats = pipeline.run(iter_pages(iter_export_rows(path), chunk_size), cursor=None)
+    except Exception as e:
+        journal.status, journal.error = 'failed', str(e)
+        raise
+    else:
+        journal.status = 'completed'
+    finally:
+        journal.finished_at = datetime.now()
+        journal.save()
+
+    stats = dict(stats, rows=pipeline.rows, skipped=pipeline.skipped, needs_review=len(matcher.review))
+    logger.info(f"Imported {path}: {stats}")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a KoboToolbox CSV/XLSX export into the visits database")
+    parser.add_argument('path', help="export file (.csv or .xlsx)")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="rows per transaction")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from core.database import initialize_database, close_database
+    if not initialize_database():
+        print("Error: Failed to initialize database. Check logs for details.")
+        return 1
+
+    started = time.perf_counter()
+
+    def report(rows, stats):
+        print(f"\r{rows:,} rows  ({stats['inserted']:,} new, {stats['updated']:,} updated, "
+              f"{stats['unchanged']:,} unchanged)", end='', flush=True)
+
+    try:
+        stats = import_export_file(args.path, chunk_size=args.chunk_size, progress=report)
+    finally:
+        close_database()
+
+    print(f"\nDone in {time.perf_counter() - started:.1f}s; "
+          f"{stats['skipped']} rows skipped, {stats['needs_review']} volunteer names need review")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Declarative mapping from KoboToolbox submission fields to Visit columns.
+
+Paths follow the XLSForm names of the EnergieFixers071 visit form
+(``group/field``). Adding or renaming a form question is a one-line change
+in ``VISIT_FIELD_MAP``; the table is compiled once into a converter that
+turns a submission into a dict of typed Visit values. Only questions
+confirmed on the form are mapped, and ``unknown_paths`` checks the table
+against the form's survey; every other answer stays in ``visit_data``.
+"""
+import re
+
+from core.dates import DateParser
+
+# ─── Coercers ──────────────────────────────────────────────────────
+# Each coercer takes a raw, non-None Kobo value and returns the typed value,
+# or None when the value is unusable so the column default applies. They
+# validate with regexes instead of raising, keeping the converter free of
+# per-field exception handling. Date coercers are the exception: a
+# malformed date raises ``DateParseError`` rather than defaulting to today.
+
+# Default for fields a submission cannot be stored without
+REQUIRED = object()
+
+
+class MissingValueError(ValueError):
+    """A required submission field is absent or blank"""
+
+    def __init__(self, field):
+        self.field = field
+        self.value = None
+        super().__init__(f"Missing {field} value")
+
+    def __reduce__(self):
+        return type(self), (self.field,)
+
+NUMBER = re.compile(r"^\s*(-?\d+(?:[.,]\d+)?)")
+
+# A date answer with no time part: '2025-04-05', '05-04-2025', '20250405'
+DATE_ONLY = re.compile(r"^\s*(?:\d{1,4}([-/.])\d{1,2}\1\d{1,4}|\d{8})\s*$")
+
+TRUE_VALUES = frozenset({'ja', 'yes', 'y', 'true', '1', 'waar', 'j'})
+
+
+def text(raw):
+    value = str(raw).strip()
+    return value or None
+
+
+def integer(raw):
+    if type(raw) is int:
+        return raw
+    match = NUMBER.match(str(raw))
+    return int(float(match.group(1).replace(',', '.'))) if match else None
+
+
+def decimal(raw):
+    if type(raw) in (int, float):
+        return float(raw)
+    match = NUMBER.match(str(raw))
+    return float(match.group(1).replace(',', '.')) if match else None
+
+
+def boolean(raw):
+    if type(raw) is bool:
+        return raw
+    return str(raw).strip().lower() in TRUE_VALUES
+
+
+def calendar_date(field):
+    """Date parser for ``field``; datetimes are cut to their date"""
+    return DateParser(field, 'date')
+
+
+def timestamp(field):
+    """Wall-clock datetime parser; the UTC offset Kobo appends is dropped"""
+    return DateParser(field, 'datetime')
+
+
+def clock_time(field):
+    """``HH:MM`` from a time or datetime answer; None for a bare date"""
+    parse = DateParser(field, 'time')
+
+    def hh_mm(raw):
+        if DATE_ONLY.match(str(raw)):
+            return None
+        value = parse(raw)
+        return value.strftime('%H:%M') if value is not None else None
+    return hh_mm
+
+
+def contains(option):
+    """Flag set when a select_multiple answer includes ``option``"""
+    def coerce(raw):
+        return option in str(raw).lower().split()
+    return coerce
+
+
+def attachment_field(key):
+    """Newline-joined ``key`` of every entry in ``_attachments``"""
+    def coerce(raw):
+        values = [str(item[key]) for item in raw if isinstance(item, dict) and item.get(key)]
+        return "\n".join(values) or None
+    return coerce
+
+
+# ─── Mapping table ─────────────────────────────────────────────────
+# (kobo path, Visit field, coercer[, default]). A path may feed several
+# fields; when the full path is absent the last segment is tried, for forms
+# that keep questions at the root instead of in a group. A ``REQUIRED``
+# default raises ``MissingValueError`` when the answer is absent or blank.
+
+VISIT_FIELD_MAP = [
+    # Introduction group of the visit form
+    ('introductie/adres', 'address', text, ''),
+    ('introductie/afspraakTijd', 'visit_date', calendar_date('visit_date'), REQUIRED),
+    ('introductie/afspraakTijd', 'appointment_time', clock_time('appointment_time')),
+
+    # Submission metadata added by KoboToolbox
+    ('_uuid', 'kobo_uuid', text),
+    ('_attachments', 'photos', attachment_field('filename')),
+    ('_attachments', 'photos_url', attachment_field('download_url')),
+]
+
+# Group types that prefix the names of the questions they contain
+GROUP_TYPES = frozenset({'begin_group', 'begin_repeat'})
+GROUP_ENDS = frozenset({'end_group', 'end_repeat'})
+
+
+def form_paths(survey):
+    """``group/field`` path of every question in a form's ``content.survey``"""
+    paths = set()
+    groups = []
+    for row in survey:
+        kind = row.get('type')
+        if kind in GROUP_ENDS:
+            if groups:
+                groups.pop()
+            continue
+        name = row.get('name') or row.get('$autoname')
+        if not name:
+            continue
+        if kind in GROUP_TYPES:
+            groups.append(name)
+        else:
+            paths.add('/'.join(groups + [name]))
+    return paths
+
+
+def unknown_paths(survey, mapping=None):
+    """Mapped question paths the form does not ask, in table order
+
+    Underscored paths are submission metadata and never appear in the
+    survey. A path matches a question at the same path or, like ``lookup``,
+    a root-level question with the same name.
+    """
+    paths = form_paths(survey)
+    unknown = []
+    for path, *_ in VISIT_FIELD_MAP if mapping is None else mapping:
+        if path.startswith('_') or path in unknown:
+            continue
+        if path not in paths and path.rsplit('/', 1)[-1] not in paths:
+            unknown.append(path)
+    return unknown
+
+
+def flatten_submission(submission, prefix=''):
+    """Flatten nested group dicts into Kobo's ``group/field`` keys"""
+    if not prefix and not any(type(value) is dict for value in submission.values()):
+        return submission
+
+    flat = {}
+    for key, value in submission.items():
+        if type(value) is dict:
+            flat.update(flatten_submission(value, f"{prefix}{key}/"))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def lookup(flat, path):
+    """Get a value by full path, falling back to the bare field name"""
+    value = flat.get(path)
+    if value is None:
+        value = flat.get(path.rsplit('/', 1)[-1])
+    return value
+
+
+class SubmissionConverter:
+    """Mapping table compiled into a flat plan of lookups and coercers"""
+
+    def __init__(self, mapping, model):
+        self.plan = []
+        for entry in mapping:
+            path, field_name, coerce = entry[:3]
+            field = model._meta.fields.get(field_name)
+            if field is None:
+                raise ValueError(f"Unknown {model.__name__} field '{field_name}' for '{path}'")
+
+            default = entry[3] if len(entry) > 3 else field.default
+            leaf = path.rsplit('/', 1)[-1]
+            self.plan.append((
+                path, leaf if leaf != path else None, field_name, coerce,
+                default, callable(default),
+            ))
+
+    def convert_flat(self, flat):
+        """Convert an already-flattened submission"""
+        get = flat.get
+        row = {}
+        for path, leaf, field_name, coerce, default, default_is_factory in self.plan:
+            raw = get(path)
+            if raw is None and leaf is not None:
+                raw = get(leaf)
+
+            value = coerce(raw) if raw is not None and raw != '' else None
+            if value is None:
+                if default is REQUIRED:
+                    raise MissingValueError(field_name)
+                value = default() if default_is_factory else default
+            row[field_name] = value
+        return row
+
+    def __call__(self, submission):
+        return self.convert_flat(flatten_submission(submission))
+
+
+def compile_mapping(mapping=None, model=None):
+    """Compile a mapping table into a SubmissionConverter"""
+    if model is None:
+        from core.models import Visit
+        model = Visit
+    return SubmissionConverter(VISIT_FIELD_MAP if mapping is None else mapping, model)
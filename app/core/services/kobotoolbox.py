@@ -4,12 +4,54 @@ Uses direct REST API calls with requests library.
 """
 import requests
 import json
+import time
 from datetime import datetime
+from pathlib import Path
 from config import Config
+from core.dates import DateParseError, DateParser
+from core.services.http_client import get_http_client
+from core.services.kobo_export import iter_export_rows, iter_pages
+from core.services.kobo_mapping import MissingValueError, compile_mapping, flatten_submission, lookup, unknown_paths
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Compiled once; maps a submission onto every mirrored Visit column
+VISIT_CONVERTER = compile_mapping()
+SUBMISSION_TIME = DateParser('_submission_time', 'datetime')
+
+
+def parse_submission_time(submission_time):
+    """Parse the UTC ``_submission_time`` stamp into a naive datetime"""
+    if not submission_time:
+        return None
+    try:
+        return SUBMISSION_TIME(submission_time)
+    except DateParseError as e:
+        logger.warning(f"Could not parse submission time: {e}")
+        return None
+
+
+def map_submission(submission):
+    """Map a submission onto Visit columns without touching the database
+
+    Returns ``(visit_data, uitvoerders)``; the volunteer names are resolved
+    separately. Raises ``DateParseError`` for malformed dates and
+    ``MissingValueError`` for a missing visit date. Kept at module level
+    so process-pool workers can call it.
+    """
+    # Kobo returns flattened group/field keys, but older exports nest groups
+    flat = flatten_submission(submission)
+    
+    visit_data = VISIT_CONVERTER.convert_flat(flat)
+    visit_data.update({
+        'kobo_submission_id': submission.get('_id'),
+        'submission_time': parse_submission_time(submission.get('_submission_time')),
+        'visit_data': submission,  # Store full submission as JSON
+        'status': 'completed'
+    })
+    return visit_data, lookup(flat, 'introductie/uitvoerders') or ''
+
 class KoboToolboxService:
     """Service for interacting with KoboToolbox API using direct REST calls"""
     
@@ -17,6 +59,11 @@ class KoboToolboxService:
         self.base_url = Config.KOBO_BASE_URL
         self.api_token = Config.KOBO_API_TOKEN
         self.form_id = Config.KOBO_FORM_ID
+        self.last_sync_stats = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        self.volunteer_matcher = None
+        self.parse_errors = []
+        self.field_map_checked = False
+        self.http = get_http_client()
         
         # Set up headers for API requests
         self.headers = {
@@ -38,7 +85,7 @@ class KoboToolboxService:
         try:
             # Test connection by getting user info
             url = f"{self.base_url}/api/v2/assets/"
-            response = requests.get(url, headers=self.headers, timeout=10)
+            response = self.http.get(url, headers=self.headers, timeout=10, cache=True)
             
             if response.status_code == 200:
                 logger.info("KoboToolbox connection successful")
@@ -51,6 +98,51 @@ class KoboToolboxService:
             logger.error(f"KoboToolbox connection test failed: {e}")
             return False
     
+    def iter_form_pages(self, page_size=None, query=None, sort=None):
+        """Yield form submissions one page at a time, following the ``next`` link"""
+        if not self.is_configured():
+            logger.warning("KoboToolbox API not configured - no pages to fetch")
+            return
+        
+        page_size = page_size or Config.KOBO_PAGE_SIZE
+        url = f"{self.base_url}/api/v2/assets/{self.form_id}/data/"
+        params = {'format': 'json', 'start': 0, 'limit': page_size}
+        if query:
+            params['query'] = json.dumps(query)
+        if sort:
+            params['sort'] = json.dumps(sort)
+        
+        fetched = 0
+        while url:
+            logger.debug(f"Fetching KoboToolbox page: {url} {params or ''}")
+            response = self.http.get(url, headers=self.headers, params=params, timeout=30)
+            response.raise_for_status()
+            
+            data = response.json()
+            results = data.get('results', [])
+            if not results:
+                break
+            
+            fetched += len(results)
+            yield results
+            
+            # The ``next`` link already carries start/limit/query; fall back to
+            # advancing the offset ourselves for servers that omit it.
+            next_url = data.get('next')
+            if next_url:
+                url, params = next_url, None
+            elif len(results) < page_size or params is None:
+                break
+            else:
+                params['start'] += len(results)
+        
+        logger.info(f"Retrieved {fetched} submissions from KoboToolbox")
+    
+    def iter_submissions(self, page_size=None, query=None, sort=None):
+        """Stream form submissions without holding the whole form in memory"""
+        for page in self.iter_form_pages(page_size=page_size, query=query, sort=sort):
+            yield from page
+    
     def get_form_data(self, limit=None, since_date=None):
         """Fetch form submissions from KoboToolbox"""
         if not self.is_configured():
@@ -58,23 +150,17 @@ class KoboToolboxService:
             return []
         
         try:
-            # Build API URL for form data
-            url = f"{self.base_url}/api/v2/assets/{self.form_id}/data/"
-            params = {}
-            
-            if limit:
-                params['limit'] = limit
+            query = None
             if since_date:
-                params['start'] = since_date.isoformat()
-            
-            logger.info(f"Fetching data from KoboToolbox: {url}")
-            response = requests.get(url, headers=self.headers, params=params, timeout=30)
-            response.raise_for_status()
+                query = {'_submission_time': {'$gte': since_date.isoformat()}}
             
-            data = response.json()
-            results = data.get('results', [])
+            page_size = min(limit, Config.KOBO_PAGE_SIZE) if limit else None
+            results = []
+            for submission in self.iter_submissions(page_size=page_size, query=query):
+                results.append(submission)
+                if limit and len(results) >= limit:
+                    break
             
-            logger.info(f"Retrieved {len(results)} submissions from KoboToolbox")
             return results
             
         except requests.exceptions.RequestException as e:
@@ -84,129 +170,304 @@ class KoboToolboxService:
             logger.error(f"Unexpected error fetching KoboToolbox data: {e}")
             return []
     
-    def sync_visits(self):
-        """Sync visits from KoboToolbox to local database"""
+    def sync_visits(self, full=False):
+        """Sync visits from KoboToolbox to local database
+        
+        Only submissions submitted or edited since the stored sync cursor
+        are requested, unless ``full`` is set to rescan the whole form.
+        """
         if not self.is_configured():
             logger.info("KoboToolbox not configured - skipping sync")
             return 0
         
         try:
             # Import models here to avoid circular imports
-            from core.models import Visit, Volunteer
-            
-            submissions = self.get_form_data()
-            synced_count = 0
-            
-            for submission in submissions:
-                visit_data = self._parse_submission(submission)
-                if visit_data:
-                    try:
-                        # Check if visit already exists
-                        submission_id = submission.get('_id')
-                        existing_visit = Visit.select().where(
-                            Visit.kobo_submission_id == submission_id
-                        ).first()
-                        
-                        if not existing_visit:
-                            # Create new visit
-                            visit = Visit.create(**visit_data)
-                            synced_count += 1
-                            logger.debug(f"Created new visit: {visit.address}")
-                        else:
-                            # Update existing visit if submission is newer
-                            if self._should_update_visit(existing_visit, submission):
-                                for key, value in visit_data.items():
-                                    if key != 'kobo_submission_id':  # Don't update ID
-                                        setattr(existing_visit, key, value)
-                                existing_visit.save()
-                                synced_count += 1
-                                logger.debug(f"Updated visit: {existing_visit.address}")
-                                
-                    except Exception as e:
-                        logger.error(f"Failed to save visit: {e}")
-                        continue
-            
-            logger.info(f"Synced {synced_count} visits from KoboToolbox")
-            return synced_count
+            from core.models import SyncCursor
+            
+            self.check_field_map()
+            journal = self._start_journal('full' if full else 'incremental')
+            cursor = SyncCursor.for_form(self.form_id)
+            start = None
+            if full:
+                unfinished = journal.resumed_from
+                if unfinished and unfinished.cursor_time:
+                    # Pick up a crashed or failed rescan after its last committed batch
+                    logger.info(f"Resuming full sync from {unfinished.cursor_time}")
+                    start = SyncCursor(last_submission_time=unfinished.cursor_time,
+                                       last_submission_id=unfinished.cursor_id)
+                    journal.cursor_time, journal.cursor_id = unfinished.cursor_time, unfinished.cursor_id
+                    journal.save()
+            elif cursor.last_submission_time:
+                start = SyncCursor(last_submission_time=cursor.last_submission_time,
+                                   last_submission_id=cursor.last_submission_id)
+            
+            query = None
+            if start:
+                # $gte rather than $gt so submissions sharing the last timestamp
+                # are not lost; already-seen ones are skipped by the pipeline.
+                # Older submissions edited since are fetched again as well.
+                since = {'$gte': start.last_submission_time}
+                query = {'$or': [{'_submission_time': since}, {'_last_edited': since}]}
+            
+            # Consume the form as a stream so memory stays flat for large forms
+            pages = self.iter_form_pages(query=query, sort={'_submission_time': 1})
+            return self._ingest_submissions(pages, cursor, journal, start=start, ordered=True)
             
         except Exception as e:
             logger.error(f"Visit sync failed: {e}")
             return 0
     
-    def _parse_submission(self, submission):
-        """Parse KoboToolbox submission into visit data"""
+    def check_field_map(self):
+        """Raise if ``VISIT_FIELD_MAP`` maps questions the form does not ask
+        
+        Checked once per service against the form's survey, so a renamed
+        question stops the sync instead of silently storing defaults.
+        """
+        if self.field_map_checked:
+            return
+        
+        form_info = self.get_form_info()
+        if not form_info:
+            logger.warning("Could not fetch the form to check the field mapping")
+            return
+        
+        unknown = unknown_paths(form_info.get('content', {}).get('survey', []))
+        if unknown:
+            raise ValueError(f"Mapped fields not on form {self.form_id}: {', '.join(unknown)}")
+        self.field_map_checked = True
+    
+    def _start_journal(self, mode):
+        """Open a ``SyncRun`` for this form, linked to the last run of its mode if that did not complete"""
+        from core.models import SyncRun
+        
+        for run in SyncRun.interrupt_abandoned('kobo', self.form_id):
+            logger.warning(
+                f"Previous {run.mode} sync (run {run.id}) was interrupted after {run.batches} batches"
+            )
+        # Looked up per mode so a failed full sync can still be resumed after
+        # incremental syncs have completed in between
+        previous = SyncRun.latest('kobo', self.form_id, mode=mode)
+        if previous and previous.status not in ('failed', 'interrupted'):
+            previous = None
+        return SyncRun.create(source='kobo', form_id=self.form_id, mode=mode, resumed_from=previous)
+    
+    def _ingest_submissions(self, pages, cursor, journal, start=None, ordered=False):
+        """Parse and store pages of submissions, advancing the sync cursor
+        
+        Fetching, parsing, volunteer matching and writing run as the stages
+        of a ``SyncPipeline``, so network waits and database writes overlap.
+        ``journal`` is checkpointed after every batch and closed here. Pages
+        sorted by submission time are ``ordered``, which lets the cursor be
+        saved as the sync goes.
+        """
+        from core.sync_pipeline import SyncPipeline
+        from core.volunteer_matcher import VolunteerMatcher
+        
+        # Rebuilt every sync so newly added volunteers are picked up
+        self.volunteer_matcher = VolunteerMatcher.from_database()
+        self.parse_errors = []
+        
+        pipeline = SyncPipeline(self, self.volunteer_matcher, journal=journal, ordered=ordered)
         try:
-            # Extract data from introductie group (as per your existing structure)
-            intro_data = submission.get('introductie', {})
-            
-            if not intro_data:
-                # If no introductie group, try to get data from root level
-                intro_data = submission
-            
-            # Parse visit data
-            visit_data = {
-                'kobo_submission_id': submission.get('_id'),
-                'address': intro_data.get('adres', ''),
-                'visit_date': self._parse_date(intro_data.get('afspraakTijd')),
-                'visit_data': submission,  # Store full submission as JSON
-                'status': 'completed'
-            }
-            
-            # Try to match volunteer by name
-            volunteer_names = intro_data.get('uitvoerders', '').split(',')
-            if volunteer_names and volunteer_names[0].strip():
-                volunteer_name = volunteer_names[0].strip()
-                try:
-                    from core.models import Volunteer
-                    volunteer = Volunteer.select().where(
-                        Volunteer.name.contains(volunteer_name)
-                    ).first()
-                    if volunteer:
-                        visit_data['volunteer'] = volunteer
-                except Exception as e:
-                    logger.warning(f"Could not match volunteer '{volunteer_name}': {e}")
-            
-            return visit_data
-            
+            stats = pipeline.run(pages, cursor, start=start)
         except Exception as e:
-            logger.error(f"Failed to parse submission: {e}")
-            return None
+            journal.status = 'failed'
+            journal.error = str(e)
+            journal.finished_at = datetime.now()
+            journal.save()
+            raise
+        
+        journal.status = 'completed'
+        journal.finished_at = datetime.now()
+        journal.save()
+        
+        self.last_sync_stats = dict(
+            stats, needs_review=len(self.volunteer_matcher.review), invalid=len(self.parse_errors),
+            dead_letters=pipeline.skipped + stats['failed'],
+        )
+        synced_count = stats['inserted'] + stats['updated']
+        
+        if cursor is not None:
+            cursor.last_synced_at = datetime.now()
+            cursor.save()
+        
+        logger.info(
+            f"Synced {synced_count} visits from KoboToolbox "
+            f"({self.last_sync_stats['unchanged']} unchanged, "
+            f"{self.last_sync_stats['dead_letters']} dead-lettered) in {journal.duration:.1f}s"
+        )
+        return synced_count
     
-    def _parse_date(self, date_string):
-        """Parse date string from KoboToolbox"""
-        if not date_string:
-            return datetime.now().date()
+    def retry_dead_letters(self):
+        """Run every unresolved dead-lettered submission through the sync again
+        
+        Letters that go through are marked resolved, as they are whenever
+        their submission is stored; ones that fail again keep their row
+        with the attempt count raised.
+        """
+        if not self.is_configured():
+            return 0
         
         try:
-            # Try different date formats commonly used in KoboToolbox
-            for fmt in ['%Y-%m-%d', '%d/%m/%Y', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%fZ']:
-                try:
-                    parsed = datetime.strptime(str(date_string).split('T')[0], fmt.split('T')[0])
-                    return parsed.date()
-                except ValueError:
-                    continue
-            
-            # If all formats fail, return today
-            logger.warning(f"Could not parse date '{date_string}', using today")
-            return datetime.now().date()
+            from core.models import DeadLetter
+            
+            letters = [letter for letter in DeadLetter.pending('kobo') if letter.payload]
+            if not letters:
+                return 0
             
+            journal = self._start_journal('retry')
+            pages = iter_pages((letter.payload for letter in letters), Config.KOBO_PAGE_SIZE)
+            # No cursor: retried submissions are older than the sync position.
+            # Letters are resolved by the pipeline as their submissions are stored.
+            synced_count = self._ingest_submissions(pages, None, journal)
+            
+            resolved = (DeadLetter
+                        .select()
+                        .where(DeadLetter.id.in_([letter.id for letter in letters]) &
+                               DeadLetter.resolved_at.is_null(False))
+                        .count())
+            logger.info(f"Retried {len(letters)} dead letters, {resolved} resolved")
+            return synced_count
+            
+        except Exception as e:
+            logger.error(f"Dead letter retry failed: {e}")
+            return 0
+    
+    def download_attachments(self):
+        """Fetch photo attachments of synced visits into the local attachment store"""
+        from core.services.attachments import AttachmentDownloader
+        
+        downloader = AttachmentDownloader(headers={'Authorization': self.headers['Authorization']}, http=self.http)
+        try:
+            return downloader.download_pending()
         except Exception as e:
-            logger.error(f"Error parsing date '{date_string}': {e}")
-            return datetime.now().date()
+            logger.error(f"Attachment download failed: {e}")
+            return downloader.stats
+    
+    def create_export(self, export_type='csv'):
+        """Start an asynchronous export of the whole form and return the export task"""
+        url = f"{self.base_url}/api/v2/assets/{self.form_id}/exports/"
+        payload = {
+            'type': export_type,
+            'lang': '_xml',  # XML names, matching the data API keys
+            'hierarchy_in_labels': True,
+            'group_sep': '/',
+            'multiple_select': 'both',
+            'fields_from_all_versions': True,
+        }
+        response = self.http.post(url, headers=self.headers, json=payload, timeout=30)
+        response.raise_for_status()
+        return response.json()
+    
+    def wait_for_export(self, export, poll_interval=2.0, timeout=None):
+        """Poll an export task until Kobo has built the file; return the download URL"""
+        timeout = timeout or Config.KOBO_EXPORT_TIMEOUT
+        deadline = time.monotonic() + timeout
+        delay = poll_interval
+        while True:
+            status = export.get('status')
+            if status == 'complete':
+                return export['result']
+            if status == 'error':
+                raise RuntimeError(f"Kobo export {export.get('uid')} failed: {export.get('messages')}")
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Kobo export {export.get('uid')} not ready after {timeout}s")
+            
+            time.sleep(delay)
+            delay = min(delay * 1.5, 30)
+            response = self.http.get(export['url'], headers=self.headers, timeout=30)
+            response.raise_for_status()
+            export = response.json()
+    
+    def download_export(self, result_url, destination, chunk_size=1024 * 1024):
+        """Stream an export file to disk"""
+        destination = Path(destination)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        partial = destination.with_name(destination.name + '.part')
+        
+        headers = {'Authorization': self.headers['Authorization']}
+        with self.http.get(result_url, headers=headers, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(partial, 'wb') as handle:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    handle.write(chunk)
+        
+        partial.replace(destination)
+        return destination
     
-    def _should_update_visit(self, visit, submission):
-        """Check if visit should be updated based on submission time"""
-        submission_time = submission.get('_submission_time')
-        if submission_time and visit.updated_at:
+    def sync_visits_from_export(self, export_type='csv'):
+        """Load the whole form through Kobo's export API instead of JSON pages
+        
+        Intended for initial loads of large forms: the export is built by
+        Kobo, downloaded in one stream and read back row by row.
+        """
+        if not self.is_configured():
+            logger.info("KoboToolbox not configured - skipping export sync")
+            return 0
+        
+        try:
+            from core.models import SyncCursor
+            
+            export = self.create_export(export_type)
+            logger.info(f"Requested KoboToolbox {export_type} export {export.get('uid')}")
+            result_url = self.wait_for_export(export)
+            
+            path = self.download_export(
+                result_url, Config.KOBO_EXPORT_DIR / f"{self.form_id}-{export.get('uid')}.{export_type}"
+            )
+            logger.info(f"Downloaded KoboToolbox export to {path}")
+            
             try:
-                # Parse submission time
-                sub_time = datetime.fromisoformat(
-                    submission_time.replace('Z', '+00:00').replace('+00:00', '')
-                )
-                return sub_time > visit.updated_at.replace(tzinfo=None)
-            except Exception as e:
-                logger.warning(f"Could not compare submission times: {e}")
-        return False
+                cursor = SyncCursor.for_form(self.form_id)
+                pages = iter_pages(iter_export_rows(path), Config.KOBO_PAGE_SIZE)
+                return self._ingest_submissions(pages, cursor, self._start_journal('export'))
+            finally:
+                path.unlink(missing_ok=True)
+            
+        except Exception as e:
+            logger.error(f"Export sync failed: {e}")
+            return 0
+    
+    def _get_volunteer_matcher(self):
+        """Get the volunteer index, building it on first use"""
+        if self.volunteer_matcher is None:
+            from core.volunteer_matcher import VolunteerMatcher
+            self.volunteer_matcher = VolunteerMatcher.from_database()
+        return self.volunteer_matcher
+    
+    def _parse_submission(self, submission, matcher=None):
+        """Parse KoboToolbox submission into visit data"""
+        mapped = self._map_submission(submission)
+        if mapped is None:
+            return None
+        visit_data, uitvoerders = mapped
+        return self._resolve_volunteers(visit_data, uitvoerders, matcher or self._get_volunteer_matcher())
+    
+    def _map_submission(self, submission):
+        """Map a submission onto Visit columns; returns ``(visit_data, uitvoerders)``"""
+        try:
+            return map_submission(submission)
+        except Exception as e:
+            self._record_parse_error(submission, e)
+            return None
+    
+    def _record_parse_error(self, submission, error):
+        if isinstance(error, (DateParseError, MissingValueError)):
+            logger.error(f"Rejected submission {submission.get('_id')}: {error}")
+            self.parse_errors.append({
+                'submission_id': submission.get('_id'), 'field': error.field, 'value': error.value
+            })
+        else:
+            logger.error(f"Failed to parse submission: {error}")
+    
+    def _resolve_volunteers(self, visit_data, uitvoerders, matcher):
+        """Resolve the first and second uitvoerders against the volunteer index"""
+        volunteer_id, volunteer_2_id = matcher.resolve_pair(uitvoerders, visit_data.get('kobo_submission_id'))
+        if volunteer_id:
+            visit_data['volunteer'] = volunteer_id
+        if volunteer_2_id:
+            visit_data['volunteer_2'] = volunteer_2_id
+        return visit_data
     
     def get_form_info(self):
         """Get information about the form"""
@@ -215,7 +476,7 @@ class KoboToolboxService:
         
         try:
             url = f"{self.base_url}/api/v2/assets/{self.form_id}/"
-            response = requests.get(url, headers=self.headers, timeout=10)
+            response = self.http.get(url, headers=self.headers, timeout=10, cache=True)
             response.raise_for_status()
             return response.json()
         except Exception as e:
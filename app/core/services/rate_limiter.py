@@ -0,0 +1,142 @@
+"""
+Per-host rate limiting for outbound API calls.
+
+Every host gets a token bucket with a configured baseline rate. Responses
+that carry ``X-RateLimit-Remaining``/``X-RateLimit-Reset`` (or a 429 with
+``Retry-After``) tighten it to the server's live quota, so concurrent
+fetchers run as fast as the quota allows and never faster.
+"""
+import logging
+import threading
+import time
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Reset values above this are absolute epoch seconds rather than a delay
+EPOCH_THRESHOLD = 1_000_000_000
+
+
+class TokenBucket:
+    """Token bucket, optionally capped by the quota a server reported"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+        # Server-reported budget until ``quota_reset``
+        self.quota_remaining = None
+        self.quota_reset = 0.0
+
+        self.calls = 0
+        self.throttled_calls = 0
+        self.throttled_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.quota_remaining is not None and now >= self.quota_reset:
+            self.quota_remaining = None
+
+    def _delay(self, now):
+        """Seconds until a call may proceed"""
+        if self.quota_remaining is not None and self.quota_remaining <= 0:
+            return max(0.0, self.quota_reset - now)
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0.0
+
+    def acquire(self):
+        """Block until a call is allowed and return the seconds spent waiting"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                delay = self._delay(now)
+                if delay <= 0:
+                    self.tokens -= 1
+                    if self.quota_remaining is not None:
+                        self.quota_remaining -= 1
+                    self.calls += 1
+                    if waited:
+                        self.throttled_calls += 1
+                        self.throttled_seconds += waited
+                    return waited
+            time.sleep(delay)
+            waited += delay
+
+    def update_quota(self, remaining, reset_in):
+        """Cap the bucket to a server-reported remaining quota"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.quota_remaining = remaining
+            self.quota_reset = now + max(0.0, reset_in)
+            self.tokens = min(self.tokens, max(remaining, 0))
+
+
+class RateLimiter:
+    """Token buckets keyed per API host, fed live from response headers"""
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate or Config.HTTP_RATE_LIMIT_PER_SECOND
+        self.burst = burst or Config.HTTP_RATE_LIMIT_BURST
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    def acquire(self, host):
+        """Wait for permission to call ``host``"""
+        waited = self.bucket(host).acquire()
+        if waited:
+            logger.debug(f"Throttled {waited:.2f}s before calling {host}")
+        return waited
+
+    def observe(self, host, status_code, headers):
+        """Update the host's bucket from a response's rate-limit headers"""
+        remaining = _header_number(headers, 'X-RateLimit-Remaining')
+        reset = _header_number(headers, 'X-RateLimit-Reset')
+        retry_after = _header_number(headers, 'Retry-After')
+
+        if status_code == 429:
+            remaining = 0
+            reset = retry_after if retry_after is not None else reset
+        if remaining is None or reset is None:
+            return
+
+        if reset > EPOCH_THRESHOLD:
+            reset -= time.time()
+        self.bucket(host).update_quota(int(remaining), reset)
+        if remaining <= 0:
+            logger.warning(f"Rate limit reached for {host}, pausing {max(reset, 0):.1f}s")
+
+    def stats(self):
+        """Per-host call and throttling counters"""
+        with self.lock:
+            buckets = dict(self.buckets)
+        return {
+            host: {
+                'calls': bucket.calls,
+                'throttled_calls': bucket.throttled_calls,
+                'throttled_seconds': round(bucket.throttled_seconds, 3),
+            }
+            for host, bucket in buckets.items()
+        }
+
+
+def _header_number(headers, name):
+    value = headers.get(name) if headers else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,126 @@
+"""
+Thumbnails and previews of downloaded visit photos.
+
+Decoding a phone photo takes far too long for the Tk thread, so images are
+scaled on a process pool and written to ``Config.THUMBNAIL_DIR`` as small
+JPEGs. A cached image is reused while it is newer than its source; photos in
+the content-addressed attachment store are named by their SHA-256, so
+replaced content always gets a fresh cache entry.
+"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from config import Config
+from core.parallel_parse import default_processes
+
+logger = logging.getLogger(__name__)
+
+SIZES = {
+    'thumb': Config.THUMBNAIL_SIZE,
+    'preview': Config.PREVIEW_SIZE,
+}
+
+
+def render(source, target, size):
+    """Worker entry point: write a JPEG of ``source`` scaled to fit ``size``"""
+    with Image.open(source) as image:
+        # Let the JPEG decoder skip detail we are about to throw away
+        image.draft('RGB', size)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        partial = f"{target}.{os.getpid()}.part"
+        image.save(partial, 'JPEG', quality=85, optimize=True)
+    os.replace(partial, target)
+    return target
+
+
+class ThumbnailCache:
+    """Render and cache scaled copies of photos off the UI thread"""
+
+    def __init__(self, root=None, processes=None):
+        self.root = Path(root or Config.THUMBNAIL_DIR)
+        # 0 renders on a background thread instead of worker processes
+        self.processes = default_processes(Config.THUMBNAIL_PROCESSES, cap=2) if processes is None else processes
+        self.executor = None
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def path_for(self, source, kind='thumb'):
+        """Cache location of ``source`` at size ``kind``"""
+        source = Path(source)
+        stem = source.stem
+        if len(stem) != 64:
+            # Not from the attachment store; key on the full path instead
+            stem = hashlib.sha256(str(source.resolve()).encode('utf-8')).hexdigest()
+        width, height = SIZES[kind]
+        return self.root / stem[:2] / f"{stem}-{width}x{height}.jpg"
+
+    def cached(self, source, kind='thumb'):
+        """The cached image if it is still newer than its source, else ``None``"""
+        target = self.path_for(source, kind)
+        try:
+            if target.stat().st_mtime_ns >= Path(source).stat().st_mtime_ns:
+                return target
+        except FileNotFoundError:
+            pass
+        return None
+
+    def request(self, source, kind='thumb'):
+        """Future resolving to the cached image path, rendering it if needed"""
+        target = self.path_for(source, kind)
+        with self.lock:
+            future = self.pending.get(target)
+            if future is not None:
+                return future
+            target.parent.mkdir(parents=True, exist_ok=True)
+            future = self._executor().submit(render, str(source), str(target), SIZES[kind])
+            self.pending[target] = future
+        future.add_done_callback(lambda _: self._forget(target))
+        return future
+
+    def _forget(self, target):
+        with self.lock:
+            self.pending.pop(target, None)
+
+    def _executor(self):
+        if self.executor is None:
+            if self.processes > 0:
+                logger.info(f"Starting {self.processes} thumbnail processes")
+                self.executor = ProcessPoolExecutor(max_workers=self.processes)
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='thumbnails')
+        return self.executor
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache():
+    """Get the process-wide thumbnail cache, creating it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ThumbnailCache()
+    return _cache
+
+
+def close_thumbnail_cache():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
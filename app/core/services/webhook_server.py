@@ -0,0 +1,276 @@
+"""
+Optional local webhook receiver for KoboToolbox and Calendly push delivery.
+
+KoboToolbox "REST Services" POST each new submission and Calendly POSTs
+``invitee.created``/``invitee.canceled`` events. Requests are verified,
+queued, and ingested by one consumer thread through the same parsing path
+as the polling sync. The consumer also runs the polling sync every
+``SYNC_RECONCILE_MINUTES`` as a fallback for missed deliveries.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Calendly signs "<t>.<body>"; older timestamps are rejected as replays
+CALENDLY_SIGNATURE_TOLERANCE = 180
+MAX_BODY_BYTES = 5 * 1024 * 1024
+
+
+def verify_kobo_token(headers, secret):
+    """Check the shared token configured as a custom header on the Kobo REST Service"""
+    token = headers.get('X-Kobo-Webhook-Token', '')
+    return bool(secret) and hmac.compare_digest(token, secret)
+
+
+def verify_calendly_signature(headers, body, signing_key, now=None):
+    """Check a ``Calendly-Webhook-Signature: t=...,v1=...`` header"""
+    if not signing_key:
+        return False
+
+    parts = dict(
+        item.split('=', 1) for item in headers.get('Calendly-Webhook-Signature', '').split(',') if '=' in item
+    )
+    timestamp, signature = parts.get('t', ''), parts.get('v1', '')
+    if not timestamp.isdigit() or not signature:
+        return False
+    if abs((now or time.time()) - int(timestamp)) > CALENDLY_SIGNATURE_TOLERANCE:
+        return False
+
+    expected = hmac.new(
+        signing_key.encode('utf-8'), f"{timestamp}.".encode('utf-8') + body, hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Accept, verify and enqueue webhook deliveries"""
+
+    server_version = f"{Config.APP_NAME}Webhooks"
+
+    def do_POST(self):
+        route = self.path.split('?', 1)[0].rstrip('/')
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            return self._reply(400, "invalid content length")
+        if length < 0:
+            return self._reply(400, "invalid content length")
+        if length > MAX_BODY_BYTES:
+            return self._reply(413, "payload too large")
+        body = self.rfile.read(length)
+
+        if route == '/kobo':
+            verified = verify_kobo_token(self.headers, Config.KOBO_WEBHOOK_SECRET)
+        elif route == '/calendly':
+            verified = verify_calendly_signature(self.headers, body, Config.CALENDLY_WEBHOOK_SIGNING_KEY)
+        else:
+            return self._reply(404, "unknown webhook")
+
+        if not verified:
+            logger.warning(f"Rejected unverified {route} webhook from {self.client_address[0]}")
+            return self._reply(401, "invalid signature")
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self._reply(400, "invalid json")
+        if not isinstance(payload, dict):
+            return self._reply(400, "expected a json object")
+
+        try:
+            self.server.receiver.queue.put_nowait((route.lstrip('/'), payload))
+        except queue.Full:
+            return self._reply(503, "busy")
+        self._reply(202, "queued")
+
+    def _reply(self, status, message):
+        body = json.dumps({'status': message}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Webhook {self.address_string()}: {format % args}")
+
+
+class WebhookReceiver:
+    """Local HTTP listener plus the single consumer thread that writes to the database"""
+
+    def __init__(self, host=None, port=None, queue_size=1000):
+        self.host = host or Config.WEBHOOK_HOST
+        self.port = Config.WEBHOOK_PORT if port is None else port
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = {'kobo': 0, 'calendly': 0, 'failed': 0}
+        self.server = None
+        self._stop = threading.Event()
+        self._threads = []
+        self._kobo = None
+        self._calendly = None
+
+    def start(self):
+        """Start listening and consuming in background threads"""
+        self.server = ThreadingHTTPServer((self.host, self.port), WebhookHandler)
+        self.server.receiver = self
+        self.port = self.server.server_address[1]
+
+        self._threads = [
+            threading.Thread(target=self.server.serve_forever, name='webhook-http', daemon=True),
+            threading.Thread(target=self._consume, name='webhook-consumer', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Webhook receiver listening on http://{self.host}:{self.port}")
+
+    def stop(self):
+        """Stop the listener and let the consumer drain"""
+        self._stop.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        logger.info("Webhook receiver stopped")
+
+    def _consume(self):
+        """Drain the queue in small batches; run the reconciliation poll when due"""
+        from core.database import db
+
+        interval = Config.SYNC_RECONCILE_MINUTES * 60
+        next_reconcile = time.monotonic() + interval if interval else None
+        try:
+            while not self._stop.is_set():
+                batch = self._next_batch()
+                if batch:
+                    # One bad batch must not stop the consumer thread
+                    try:
+                        self._ingest(batch)
+                    except Exception as e:
+                        self.stats['failed'] += len(batch)
+                        logger.error(f"Failed to ingest {len(batch)} webhook deliveries: {e}")
+                elif next_reconcile and time.monotonic() >= next_reconcile:
+                    try:
+                        self._reconcile()
+                    except Exception as e:
+                        logger.error(f"Scheduled reconciliation sync failed: {e}")
+                    next_reconcile = time.monotonic() + interval
+        finally:
+            if not db.is_closed():
+                db.close()
+
+    def _next_batch(self, max_items=200):
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        while len(batch) < max_items:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _services(self):
+        if self._kobo is None:
+            from core.services.kobotoolbox import KoboToolboxService
+            from core.services.calendly import CalendlyService
+            self._kobo = KoboToolboxService()
+            self._calendly = CalendlyService()
+        return self._kobo, self._calendly
+
+    def _ingest(self, batch):
+        """Feed queued payloads into the regular ingestion path"""
+        from core.ingestion import VisitIngestor
+        from core.models import DeadLetter
+        from core.services.kobotoolbox import map_submission
+        from core.volunteer_matcher import VolunteerMatcher
+
+        kobo, calendly = self._services()
+        # Rebuilt per batch so volunteers added since the last sync are matched
+        matcher = VolunteerMatcher.from_database() if any(source == 'kobo' for source, _ in batch) else None
+        # Sized so the batch is only written by the flush below
+        ingestor = VisitIngestor(batch_size=len(batch) + 1)
+        dead_letters = {'kobo': [], 'calendly': []}
+        for source, payload in batch:
+            try:
+                if source == 'kobo':
+                    visit_data, uitvoerders = map_submission(payload)
+                    ingestor.add(kobo._resolve_volunteers(visit_data, uitvoerders, matcher))
+                    self.stats['kobo'] += 1
+                else:
+                    calendly.apply_webhook(payload)
+                    self.stats['calendly'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"Failed to ingest {source} webhook: {e}")
+                record_id = payload.get('_id') if source == 'kobo' else (payload.get('payload') or {}).get('uri')
+                dead_letters[source].append((record_id, payload, 'parse', e))
+        # flush() empties the buffer before writing; keep the rows to dead-letter them
+        pending = list(ingestor.buffer.values())
+        try:
+            ingestor.flush()
+        except Exception as e:
+            self.stats['failed'] += len(pending)
+            logger.error(f"Failed to store pushed submissions: {e}")
+            dead_letters['kobo'].extend(
+                (visit_data['kobo_submission_id'], visit_data.get('visit_data'), 'write', e)
+                for visit_data in pending
+            )
+        for visit_data, error in ingestor.failed:
+            self.stats['failed'] += 1
+            dead_letters['kobo'].append((visit_data['kobo_submission_id'], visit_data['visit_data'], 'write', error))
+
+        try:
+            for source, failures in dead_letters.items():
+                if failures:
+                    DeadLetter.record_many(source, failures)
+            if ingestor.stored:
+                # A pushed copy of a dead-lettered submission settles its letter
+                DeadLetter.resolve('kobo', ingestor.stored)
+        except Exception as e:
+            logger.error(f"Failed to record dead letters: {e}")
+
+    def _reconcile(self):
+        """Periodic polling fallback for deliveries that never arrived"""
+        kobo, calendly = self._services()
+        logger.info("Running scheduled reconciliation sync")
+        kobo.sync_visits()
+        kobo.retry_dead_letters()
+        kobo.download_attachments()
+        if Config.CALENDLY_API_TOKEN:
+            calendly.sync_appointments()
+            calendly.retry_dead_letters()
+
+
+_receiver = None
+
+
+def start_webhook_receiver():
+    """Start the receiver when enabled in the configuration"""
+    global _receiver
+    if not Config.WEBHOOK_ENABLED or _receiver is not None:
+        return _receiver
+    try:
+        _receiver = WebhookReceiver()
+        _receiver.start()
+    except OSError as e:
+        logger.error(f"Could not start webhook receiver: {e}")
+        _receiver = None
+    return _receiver
+
+
+def stop_webhook_receiver():
+    global _receiver
+    if _receiver is not None:
+        _receiver.stop()
+        _receiver = None
@@ -0,0 +1,222 @@
+"""
+Staged KoboToolbox sync: fetch -> parse -> resolve volunteers -> write.
+
+Each stage runs in its own thread and hands work to the next through a
+bounded queue, so a slow stage applies backpressure instead of letting
+pages pile up in memory. Only the calling thread touches the database: it
+is the single writer that feeds ``VisitIngestor``, advances the cursor and
+checkpoints the ``SyncRun`` journal after every committed batch. Records
+that fail to parse or write are kept as ``DeadLetter`` rows.
+"""
+import logging
+import queue
+import threading
+from datetime import datetime
+from functools import partial
+
+from core.fields import decode_payload
+from core.ingestion import VisitIngestor
+from core.models import DeadLetter
+from core.parallel_parse import ParallelMapper
+
+logger = logging.getLogger(__name__)
+
+# End-of-stream marker passed down the queues
+_DONE = object()
+
+
+class SyncPipeline:
+    """Run a stream of submission pages through the sync stages
+
+    ``journal`` is the ``SyncRun`` to checkpoint. With ``ordered`` the pages
+    arrive sorted by submission time, so the cursor is saved at every
+    checkpoint and an interrupted run can pick up after its last batch.
+    """
+
+    def __init__(self, service, matcher, queue_size=4, batch_size=500, processes=None,
+                 progress=None, journal=None, ordered=False):
+        self.service = service
+        self.matcher = matcher
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.processes = processes
+        self.progress = progress
+        self.journal = journal
+        self.ordered = ordered
+        self.stopped = threading.Event()
+        self.errors = []
+        self.rows = 0
+        self.skipped = 0
+        self.position = (None, None)
+        self.dead_letters = []
+        # Set while rows handled since the last checkpoint are not yet recorded
+        self.unrecorded = False
+
+    def run(self, pages, cursor=None, start=None):
+        """Sync every page and return the ingestion stats
+
+        Submissions at or behind ``start`` (a ``SyncCursor`` position) are
+        dropped unless they were edited since. ``cursor`` is advanced past everything written; without one
+        no position is kept. The first error in any stage stops the pipeline
+        and is re-raised here; batches already written stay committed.
+        ``progress(rows, stats)`` is called after each page.
+        """
+        self.stopped.clear()
+        self.errors = []
+        self.rows = self.skipped = 0
+        self.dead_letters = []
+        self.unrecorded = False
+        mapper = ParallelMapper(self.service, processes=self.processes)
+        fetched, parsed, resolved = (queue.Queue(maxsize=self.queue_size) for _ in range(3))
+
+        stages = [
+            threading.Thread(target=self._produce, args=(pages, fetched), name='sync-fetch', daemon=True),
+            threading.Thread(target=self._transform, args=('parse', partial(self._parse, mapper=mapper, start=start), fetched, parsed),
+                             name='sync-parse', daemon=True),
+            threading.Thread(target=self._transform, args=('resolve', self._resolve, parsed, resolved),
+                             name='sync-resolve', daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+
+        ingestor = VisitIngestor(batch_size=self.batch_size, on_flush=partial(self._checkpoint, cursor=cursor))
+        try:
+            while True:
+                batch = self._get(resolved)
+                if batch is _DONE:
+                    break
+                for submission, visit_data, error in batch:
+                    self.position = (submission.get('_submission_time'), submission.get('_id'))
+                    self.rows += 1
+                    self.unrecorded = True
+                    if cursor is not None:
+                        cursor.advance(*self.position)
+                    if visit_data:
+                        ingestor.add(visit_data)
+                    else:
+                        self.skipped += 1
+                        self.dead_letters.append((submission.get('_id'), submission, 'parse', error))
+                if self.progress:
+                    self.progress(self.rows, ingestor.stats)
+            if not self.errors:
+                ingestor.flush()
+                if self.unrecorded:
+                    # Parse failures after the last flush still need recording
+                    self._checkpoint(ingestor, cursor=cursor)
+                if self.progress:
+                    self.progress(self.rows, ingestor.stats)
+        except Exception as e:
+            self._fail('write', e)
+        finally:
+            self.stopped.set()
+            for stage in stages:
+                stage.join()
+            mapper.close()
+
+        if self.errors:
+            stage_name, error = self.errors[0]
+            logger.error(f"Sync pipeline stopped in {stage_name} stage: {error}")
+            raise error
+        return ingestor.stats
+
+    def _checkpoint(self, ingestor, cursor=None):
+        """Record dead letters, the cursor and the journal once a batch is committed
+
+        Everything handed to the ingestor up to ``self.position`` is on disk
+        at this point, except the rows it reports in ``failed``.
+        """
+        self.unrecorded = False
+        failures, self.dead_letters = self.dead_letters, []
+        for visit_data, error in ingestor.failed:
+            payload = visit_data.get('visit_data')
+            if isinstance(payload, (bytes, bytearray, memoryview)):
+                payload = decode_payload(payload)
+            failures.append((visit_data['kobo_submission_id'], payload, 'write', error))
+        ingestor.failed.clear()
+        if failures:
+            DeadLetter.record_many('kobo', failures, sync_run=self.journal)
+        stored, ingestor.stored = ingestor.stored, []
+        if stored:
+            DeadLetter.resolve('kobo', stored)
+
+        if cursor is not None and self.ordered:
+            cursor.save()
+
+        if self.journal is not None:
+            journal = self.journal
+            if self.ordered:
+                journal.cursor_time, journal.cursor_id = self.position
+            journal.fetched = self.rows
+            journal.inserted = ingestor.stats['inserted']
+            journal.updated = ingestor.stats['updated']
+            journal.unchanged = ingestor.stats['unchanged']
+            journal.failed = ingestor.stats['failed'] + self.skipped
+            journal.batches += 1
+            journal.last_checkpoint_at = datetime.now()
+            journal.save()
+
+    # ─── Stages ────────────────────────────────────────────────────
+
+    def _parse(self, page, mapper, start):
+        if start:
+            # Submissions edited since the last sync are behind the cursor but still new
+            page = [submission for submission in page
+                    if not start.is_seen(submission.get('_submission_time'), submission.get('_id'))
+                    or start.edited_since(submission.get('_last_edited'))]
+        return [(submission,) + mapped for submission, mapped in zip(page, mapper.map_page(page))]
+
+    def _resolve(self, parsed):
+        return [
+            (submission,
+             self.service._resolve_volunteers(visit_data, uitvoerders, self.matcher) if visit_data else None,
+             error)
+            for submission, visit_data, uitvoerders, error in parsed
+        ]
+
+    # ─── Plumbing ──────────────────────────────────────────────────
+
+    def _produce(self, pages, outbox):
+        try:
+            for page in pages:
+                if not self._put(outbox, page):
+                    return
+        except Exception as e:
+            self._fail('fetch', e)
+            return
+        self._put(outbox, _DONE)
+
+    def _transform(self, name, work, inbox, outbox):
+        try:
+            while True:
+                item = self._get(inbox)
+                if item is _DONE:
+                    break
+                result = work(item)
+                if result and not self._put(outbox, result):
+                    return
+        except Exception as e:
+            self._fail(name, e)
+            return
+        self._put(outbox, _DONE)
+
+    def _put(self, outbox, item):
+        """Block while the next stage is busy; give up once the pipeline stops"""
+        while not self.stopped.is_set():
+            try:
+                outbox.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, inbox):
+        while not self.stopped.is_set():
+            try:
+                return inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, stage_name, error):
+        self.errors.append((stage_name, error))
+        self.stopped.set()
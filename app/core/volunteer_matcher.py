@@ -0,0 +1,117 @@
+"""
+In-memory volunteer name index used to resolve KoboToolbox ``uitvoerders``.
+"""
+import logging
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Separators volunteers use between names in the free-text uitvoerders field
+NAME_SEPARATORS = re.compile(r"\s*(?:[,;&/+\n]|\ben\b|\band\b)\s*", re.IGNORECASE)
+NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_name(name):
+    """Lower-case a name and strip diacritics and punctuation into tokens"""
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return tuple(token for token in NON_WORD.split(stripped.lower()) if token)
+
+
+class VolunteerMatcher:
+    """Resolve free-text volunteer names to volunteer ids without per-row queries
+
+    Built once per sync. Lookups try, in order: the exact normalised name,
+    the name with initials dropped, and finally the volunteers whose name
+    contains every given token (single letters match as initials). A name
+    that fits more than one volunteer is not guessed; it is added to
+    ``review`` instead, keyed by its normalised name, with the submissions
+    that used it. Each ambiguous name is logged once per matcher.
+    """
+
+    def __init__(self, volunteers):
+        self.names = {}
+        self.exact = {}
+        self.without_initials = {}
+        self.tokens = {}
+        self.review = {}
+
+        for volunteer_id, name in volunteers:
+            tokens = normalize_name(name)
+            if not tokens:
+                continue
+            self.names[volunteer_id] = name
+            self.exact.setdefault(tokens, set()).add(volunteer_id)
+            self.without_initials.setdefault(self._drop_initials(tokens), set()).add(volunteer_id)
+            for token in tokens:
+                self.tokens.setdefault(token, set()).add(volunteer_id)
+
+        self._token_sets = {
+            volunteer_id: set(normalize_name(name)) for volunteer_id, name in self.names.items()
+        }
+
+    @classmethod
+    def from_database(cls):
+        """Build a matcher from the volunteer table in one query"""
+        from core.models import Volunteer
+        return cls(Volunteer.select(Volunteer.id, Volunteer.name).tuples())
+
+    @staticmethod
+    def _drop_initials(tokens):
+        return tuple(token for token in tokens if len(token) > 1) or tokens
+
+    def candidates(self, name):
+        """Get the ids of every volunteer the name could refer to"""
+        tokens = normalize_name(name)
+        if not tokens:
+            return set()
+
+        for index, key in ((self.exact, tokens), (self.without_initials, self._drop_initials(tokens))):
+            if key in index:
+                return index[key]
+
+        words = [token for token in tokens if len(token) > 1]
+        initials = [token for token in tokens if len(token) == 1]
+        if not words:
+            return set()
+
+        matches = set.intersection(*(self.tokens.get(word, set()) for word in words))
+        for initial in initials:
+            matches = {
+                volunteer_id for volunteer_id in matches
+                if any(token.startswith(initial) for token in self._token_sets[volunteer_id])
+            }
+        return matches
+
+    def resolve(self, name, submission_id=None):
+        """Get the volunteer id for a name, or None if unknown or ambiguous"""
+        matches = self.candidates(name)
+        if len(matches) == 1:
+            return next(iter(matches))
+
+        if matches:
+            key = normalize_name(name)
+            entry = self.review.get(key)
+            if entry is None:
+                entry = self.review[key] = {
+                    'name': name,
+                    'candidates': sorted(self.names[volunteer_id] for volunteer_id in matches),
+                    'submission_ids': [],
+                }
+                logger.warning(f"Ambiguous volunteer '{name}' (first in submission {submission_id}), needs review")
+            entry['submission_ids'].append(submission_id)
+        else:
+            logger.debug(f"No volunteer matches '{name}' in submission {submission_id}")
+        return None
+
+    def resolve_pair(self, uitvoerders, submission_id=None):
+        """Resolve the first two names in an uitvoerders field"""
+        names = [name for name in NAME_SEPARATORS.split(uitvoerders or '') if name.strip()]
+        resolved = [self.resolve(name.strip(), submission_id) for name in names[:2]]
+        resolved += [None] * (2 - len(resolved))
+
+        primary, secondary = resolved
+        if secondary == primary:
+            secondary = None
+        return primary, secondary
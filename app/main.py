@@ -46,6 +46,10 @@ def main():
             print("Error: Failed to initialize database. Check logs for details.")
             return 1
         
+        # Optional push delivery; polling remains the fallback
+        from core.services.webhook_server import start_webhook_receiver
+        start_webhook_receiver()
+        
         # Import and run GUI after database is ready
         import ttkbootstrap as ttk
         from ui.root import MainApplication
@@ -64,6 +68,18 @@ def main():
     
     finally:
         # Cleanup
+        try:
+            from core.services.webhook_server import stop_webhook_receiver
+            stop_webhook_receiver()
+        except:
+            pass
+        
+        try:
+            from core.services.thumbnails import close_thumbnail_cache
+            close_thumbnail_cache()
+        except:
+            pass
+        
         try:
             from core.database import close_database
             close_database()
@@ -71,5 +87,9 @@ def main():
             pass
 
 if __name__ == "__main__":
+    # Parser worker processes re-import this module in frozen builds
+    import multiprocessing
+    multiprocessing.freeze_support()
+    
     exit_code = main()
     sys.exit(exit_code)
@@ -0,0 +1,36 @@
+"""
+Shared fixtures: an in-memory database behind the ``db`` proxy.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from peewee import SqliteDatabase
+
+# Add app directory to Python path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.database import db
+from core.migrations import migrate_database
+from core.models import (
+    Appointment, Attachment, AttachmentBlob, BackfillWindow, DeadLetter, SyncCursor, SyncRun, Visit, Volunteer,
+)
+
+# As created by core.models.create_tables
+MODELS = [Volunteer, Visit, SyncCursor, Appointment, BackfillWindow, SyncRun, DeadLetter, AttachmentBlob, Attachment]
+
+
+@pytest.fixture
+def database():
+    test_db = SqliteDatabase(':memory:', pragmas={'foreign_keys': 1})
+    db.initialize(test_db)
+    db.connect()
+    yield test_db
+    db.close()
+
+
+@pytest.fixture
+def tables(database):
+    """The in-memory database with the current schema"""
+    migrate_database(MODELS)
+    return database
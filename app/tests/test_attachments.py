@@ -0,0 +1,113 @@
+"""
+Attachment downloads into the content-addressed store.
+"""
+import hashlib
+from datetime import date
+
+from core.models import Attachment, AttachmentBlob, Visit
+from core.services.attachments import AttachmentDownloader, AttachmentStore
+
+PHOTO = b"\xff\xd8 kitchen radiator " * 100
+OTHER = b"\xff\xd8 front door " * 100
+
+
+class StubResponse:
+    def __init__(self, status_code, body=b""):
+        self.status_code = status_code
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise OSError(f"HTTP {self.status_code}")
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+
+class StubHttp:
+    """Serves ``files`` by URL, honouring ``Range`` requests"""
+
+    def __init__(self, files):
+        self.files = files
+        self.calls = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        self.calls.append((url, (headers or {}).get('Range')))
+        body = self.files[url]
+        if headers and 'Range' in headers:
+            start = int(headers['Range'][len("bytes="):-1])
+            return StubResponse(206, body[start:]) if start < len(body) else StubResponse(416)
+        return StubResponse(200, body)
+
+
+def url(name):
+    return f"https://kc.kobotoolbox.org/media/{name}"
+
+
+def visit_with(*names):
+    attachments = [{'uid': name, 'filename': f"fotos/{name}.jpg", 'mimetype': 'image/jpeg',
+                    'download_url': url(name)} for name in names]
+    return Visit.create(address="Straat 1", visit_date=date(2025, 3, 1), photos_url="\n".join(map(url, names)),
+                        visit_data={'_attachments': attachments})
+
+
+def downloader(tmp_path, files):
+    return AttachmentDownloader(workers=2, store=AttachmentStore(tmp_path), http=StubHttp(files))
+
+
+def test_identical_files_share_one_blob(tables, tmp_path):
+    first, second = visit_with('a'), visit_with('b', 'c')
+    attachments = downloader(tmp_path, {url('a'): PHOTO, url('b'): PHOTO, url('c'): OTHER})
+
+    stats = attachments.download_pending()
+    assert (stats['visits'], stats['downloaded'], stats['bytes']) == (2, 3, len(PHOTO) + len(OTHER))
+    assert AttachmentBlob.select().count() == 2
+    assert Attachment.select().count() == 3
+    photo_path = f"{hashlib.sha256(PHOTO).hexdigest()[:2]}/{hashlib.sha256(PHOTO).hexdigest()}.jpg"
+    assert Visit.get_by_id(first.id).photos_local == photo_path
+    assert Visit.get_by_id(second.id).photos_local.split("\n")[0] == photo_path
+    assert (tmp_path / photo_path).read_bytes() == PHOTO
+    assert sorted(path.name for path in tmp_path.glob("*/*.jpg")) == sorted(
+        f"{hashlib.sha256(body).hexdigest()}.jpg" for body in (PHOTO, OTHER))
+
+
+def test_retry_skips_attachments_already_stored(tables, tmp_path):
+    visit_with('a')
+    files = {url('a'): PHOTO, url('b'): OTHER}
+    downloader(tmp_path, files).download_pending()
+
+    # A later visit reuses the stored attachment and fetches only the new one
+    visit = visit_with('a', 'b')
+    attachments = downloader(tmp_path, files)
+    stats = attachments.download_pending()
+    assert attachments.http.calls == [(url('b'), None)]
+    assert (stats['reused'], stats['downloaded']) == (1, 1)
+    assert len(Visit.get_by_id(visit.id).photos_local.split("\n")) == 2
+
+
+def test_interrupted_download_is_resumed(tables, tmp_path):
+    visit = visit_with('a')
+    attachments = downloader(tmp_path, {url('a'): PHOTO})
+    attachments.store.partial_path('a').write_bytes(PHOTO[:500])
+
+    stats = attachments.download_pending()
+    assert attachments.http.calls == [(url('a'), "bytes=500-")]
+    assert stats['downloaded'] == 1
+    assert attachments.store.path(Visit.get_by_id(visit.id).photos_local).read_bytes() == PHOTO
+    assert not attachments.store.partial_path('a').exists()
+
+
+def test_failed_download_leaves_the_visit_pending(tables, tmp_path):
+    visit = visit_with('a', 'b')
+    attachments = downloader(tmp_path, {url('a'): PHOTO})
+
+    stats = attachments.download_pending()
+    assert (stats['downloaded'], stats['failed'], stats['visits']) == (1, 1, 0)
+    assert Visit.get_by_id(visit.id).photos_local is None
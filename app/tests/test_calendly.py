@@ -0,0 +1,211 @@
+"""
+Calendly sync: event pagination, backfill windows, webhook deliveries,
+upserts by event UUID and cancellation of missing events.
+"""
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from core.models import Appointment, BackfillWindow, DeadLetter
+from core.services.calendly import CalendlyService
+
+WINDOW_START = datetime(2025, 3, 1, tzinfo=timezone.utc)
+WINDOW_END = WINDOW_START + timedelta(days=30)
+
+
+def event(uuid, day, **extra):
+    start = WINDOW_START + timedelta(days=day, hours=9)
+    return dict({
+        'uri': f"https://api.calendly.com/scheduled_events/{uuid}",
+        'name': "Energiebezoek",
+        'start_time': start.strftime('%Y-%m-%dT%H:%M:%S.000000Z'),
+        'end_time': (start + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%S.000000Z'),
+        'status': 'active',
+        'location': {'type': 'physical', 'location': "Straat 1"},
+    }, **extra)
+
+
+def reconcile(events):
+    return CalendlyService()._reconcile_events(events, WINDOW_START, WINDOW_END, invitees_by_event={})
+
+
+def test_reconcile_creates_updates_and_skips_unchanged(tables):
+    assert reconcile([event('a', 1), event('b', 2)])['created'] == 2
+    stats = reconcile([event('a', 1), event('b', 2, name="Herbezoek")])
+    assert (stats['created'], stats['updated'], stats['unchanged']) == (0, 1, 1)
+    assert Appointment.get(Appointment.calendly_event_uuid == 'b').event_name == "Herbezoek"
+
+
+def test_reconcile_cancels_only_events_calendly_dropped(tables):
+    reconcile([event('a', 1), event('b', 2), event('c', 3)])
+
+    # 'b' is still listed but no longer parses; 'c' is gone
+    stats = reconcile([event('a', 1), event('b', 2, start_time="not a time")])
+    assert stats['canceled'] == 1
+    statuses = dict(Appointment.select(Appointment.calendly_event_uuid, Appointment.status).tuples())
+    assert statuses == {'a': 'active', 'b': 'active', 'c': 'canceled'}
+
+
+@pytest.mark.parametrize('missing', ['start_time', 'end_time'])
+def test_events_without_times_are_dead_lettered(tables, missing):
+    stats = reconcile([event('a', 1), event('b', 2, **{missing: None})])
+    assert (stats['created'], stats['failed']) == (1, 1)
+    letter, = DeadLetter.pending('calendly')
+    assert (letter.record_id, letter.error) == ('b', f"Calendly event has no {missing}")
+
+
+def test_event_without_location_is_parsed(tables):
+    reconcile([event('a', 1, location=None)])
+    assert Appointment.get(Appointment.calendly_event_uuid == 'a').meeting_type == 'in_person'
+
+
+class StubResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+class StubHttp:
+    """Answers event list requests from ``pages(params)``, recording every call"""
+
+    def __init__(self, pages, invitees=None):
+        self.pages = pages
+        self.invitees = invitees or {}
+        self.calls = []
+
+    def get(self, url, headers=None, params=None, timeout=None, cache=False):
+        self.calls.append((url, dict(params or {})))
+        if url.endswith('/invitees'):
+            invitees = self.invitees.get(url.rsplit('/', 2)[-2], [])
+            if isinstance(invitees, Exception):
+                raise invitees
+            return StubResponse({'collection': invitees})
+        return StubResponse(self.pages(params))
+
+
+def calendly(pages, invitees=None):
+    service = CalendlyService()
+    service.http = StubHttp(pages, invitees)
+    return service
+
+
+def paged(*pages):
+    """Serve ``pages`` in order, chained by page tokens"""
+    def page(params):
+        index = int(params.get('page_token', 0))
+        token = str(index + 1) if index + 1 < len(pages) else None
+        return {'collection': pages[index], 'pagination': {'next_page_token': token}}
+    return page
+
+
+def test_events_follow_page_tokens():
+    service = calendly(paged([event('a', 1), event('b', 2)], [event('c', 3)], []))
+    events = list(service.iter_scheduled_events(WINDOW_START, WINDOW_END))
+    assert [service._event_uuid(e) for e in events] == ['a', 'b', 'c']
+    assert [params.get('page_token') for _, params in service.http.calls] == [None, '1', '2']
+    assert service.http.calls[0][1]['min_start_time'] == "2025-03-01T00:00:00.000000Z"
+
+
+def test_backfill_accepts_dates_and_checkpoints_windows(tables):
+    def page(params):
+        # Only the second window has an event
+        found = [event('a', 12)] if params['min_start_time'].startswith("2025-03-11") else []
+        return {'collection': found, 'pagination': {}}
+    service = calendly(page)
+
+    assert service.backfill_appointments(date(2025, 3, 1), date(2025, 3, 31), window_days=10) == 1
+    windows = BackfillWindow.select().order_by(BackfillWindow.window_start)
+    assert [(w.status, w.events_synced) for w in windows] == [('done', 0), ('done', 1), ('done', 0)]
+    assert windows[0].window_start == WINDOW_START
+    assert Appointment.get(Appointment.calendly_event_uuid == 'a').status == 'active'
+
+
+def test_backfill_resumes_after_completed_windows(tables):
+    done = WINDOW_START + timedelta(days=10)
+    BackfillWindow.create(source='calendly', window_start=WINDOW_START, window_end=done, status='done')
+    service = calendly(lambda params: {'collection': [], 'pagination': {}})
+
+    service.backfill_appointments(WINDOW_START, WINDOW_END, window_days=10)
+    requested = sorted(params['min_start_time'] for _, params in service.http.calls)
+    assert requested == ["2025-03-11T00:00:00.000000Z", "2025-03-21T00:00:00.000000Z"]
+    assert service.backfill_appointments(WINDOW_START, WINDOW_END, window_days=10) == 0
+    assert BackfillWindow.select().where(BackfillWindow.status != 'done').count() == 0
+
+
+def test_backfill_rejects_other_bounds(tables):
+    with pytest.raises(TypeError):
+        calendly(paged([])).backfill_appointments("2025-03-01", "2025-03-31")
+    assert BackfillWindow.select().count() == 0
+
+
+def test_invitees_are_matched_to_their_events(tables):
+    invitees = {uuid: [{'name': f"Bewoner {uuid}", 'email': f"{uuid}@example.org"}] for uuid in "abc"}
+    service = calendly(paged([event('a', 1), event('b', 2)], [event('c', 3)]), invitees)
+
+    assert service.sync_appointments() == 3
+    names = dict(Appointment.select(Appointment.calendly_event_uuid, Appointment.invitee_name).tuples())
+    assert names == {'a': "Bewoner a", 'b': "Bewoner b", 'c': "Bewoner c"}
+
+
+def test_failed_invitee_fetch_is_retried_next_sync(tables):
+    invitees = {'a': ConnectionError("timed out")}
+    service = calendly(paged([event('a', 1)]), invitees)
+
+    service.sync_appointments()
+    assert Appointment.get(Appointment.calendly_event_uuid == 'a').content_hash is None
+    invitees['a'] = [{'name': "Bewoner a", 'email': "a@example.org"}]
+    service.sync_appointments()
+    appointment = Appointment.get(Appointment.calendly_event_uuid == 'a')
+    assert appointment.invitee_name == "Bewoner a" and appointment.content_hash is not None
+
+
+def test_invitees_are_fetched_for_every_event():
+    invitees = {uuid: [{'name': uuid}] for uuid in "abcdef"}
+    service = calendly(paged([]), invitees)
+    fetched = service.fetch_invitees(iter("fedcba"), max_workers=3)
+    assert fetched == invitees
+    assert len(service.http.calls) == 6
+    assert service.fetch_invitees([]) == {}
+
+
+def delivery(uuid, day, event_type='invitee.created', **extra):
+    return {'event': event_type, 'payload': {
+        'uri': f"https://api.calendly.com/scheduled_events/{uuid}/invitees/i-{uuid}",
+        'name': "Bewoner", 'email': "bewoner@example.org", 'scheduled_event': event(uuid, day, **extra)}}
+
+
+def test_webhooks_create_and_cancel_appointments(tables):
+    service = CalendlyService()
+    assert service.apply_webhook(delivery('a', 1))
+    assert Appointment.get(Appointment.calendly_event_uuid == 'a').invitee_name == "Bewoner"
+    assert service.apply_webhook(delivery('a', 1, 'invitee.canceled'))
+    assert Appointment.get(Appointment.calendly_event_uuid == 'a').status == 'canceled'
+    assert not service.apply_webhook({'event': 'routing_form_submission.created', 'payload': {}})
+
+
+def test_dead_lettered_webhooks_are_retried(tables):
+    good, bad = delivery('a', 1), delivery('b', 2, start_time="not a time")
+    DeadLetter.record_many('calendly', [(good['payload']['uri'], good, 'write', "database is locked"),
+                                        (bad['payload']['uri'], bad, 'parse', "bad start time")])
+
+    assert CalendlyService().retry_dead_letters() == 1
+    assert Appointment.get(Appointment.calendly_event_uuid == 'a').invitee_email == "bewoner@example.org"
+    letter, = DeadLetter.pending('calendly')
+    assert (letter.record_id, letter.attempts) == (bad['payload']['uri'], 2)
+
+
+def test_dead_lettered_events_are_retried(tables):
+    reconcile([event('a', 1, start_time="")])
+    letter, = DeadLetter.pending('calendly')
+    letter.payload = event('a', 1)
+    letter.save()
+
+    assert calendly(paged([]), {'a': [{'name': "Bewoner a"}]}).retry_dead_letters() == 1
+    assert Appointment.get(Appointment.calendly_event_uuid == 'a').invitee_name == "Bewoner a"
@@ -0,0 +1,55 @@
+"""
+Date parsing shared by the KoboToolbox and Calendly services.
+"""
+import pickle
+from datetime import date, datetime, time, timezone
+
+import pytest
+
+from core.dates import DateParseError, DateParser
+
+
+@pytest.mark.parametrize('kind, raw, expected', [
+    ('date', "2025-03-01", date(2025, 3, 1)),
+    ('date', "2025-03-01T10:30:00+01:00", date(2025, 3, 1)),
+    ('date', "01-03-2025", date(2025, 3, 1)),
+    ('date', "01/03/2025", date(2025, 3, 1)),
+    ('datetime', "2025-03-01T10:30:00+01:00", datetime(2025, 3, 1, 10, 30)),
+    ('datetime', "01-03-2025 10:30", datetime(2025, 3, 1, 10, 30)),
+    ('time', "10:30", time(10, 30)),
+    ('time', "10.30", time(10, 30)),
+    ('time', "2025-03-01T10:30:00+01:00", time(10, 30)),
+])
+def test_parse(kind, raw, expected):
+    assert DateParser('field', kind)(raw) == expected
+
+
+def test_utc_datetimes_are_aware():
+    parse = DateParser('start_time', 'datetime', utc=True)
+    assert parse("2025-03-01T10:30:00+01:00") == datetime(2025, 3, 1, 9, 30, tzinfo=timezone.utc)
+    assert parse("2025-03-01T10:30:00") == datetime(2025, 3, 1, 10, 30, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize('raw', [None, "", "   "])
+def test_blank_is_none(raw):
+    assert DateParser('visit_date')(raw) is None
+
+
+@pytest.mark.parametrize('raw', ["gisteren", "31-02-2025", "2025-13-01"])
+def test_malformed_raises_naming_the_field(raw):
+    with pytest.raises(DateParseError) as caught:
+        DateParser('visit_date')(raw)
+    assert (caught.value.field, caught.value.value) == ('visit_date', raw)
+
+
+def test_working_format_is_learned_and_results_cached():
+    parse = DateParser('visit_date')
+    parse("01.03.2025")
+    assert parse.learned == '%d.%m.%Y'
+    parse("01.03.2025")
+    assert parse.cache_info().hits == 1
+
+
+def test_error_survives_pickling():
+    error = pickle.loads(pickle.dumps(DateParseError('visit_date', "gisteren")))
+    assert (error.field, error.value) == ('visit_date', "gisteren")
@@ -0,0 +1,70 @@
+"""
+Compressed payload storage and the conversion of payloads stored as text.
+"""
+from datetime import date
+
+import pytest
+
+from conftest import MODELS
+from core.database import db
+from core.fields import CODECS, decode_payload, encode_payload
+from core.migrations import convert_legacy_payloads
+from core.models import Visit
+
+SUBMISSION = {'_id': 7, 'introductie/adres': "Straat 1", 'opmerkingen': "Tocht bij de deur – €12", 'fotos': [1, 2]}
+
+
+def stored_payload(visit_id):
+    return db.execute_sql('SELECT "visit_data", typeof("visit_data") FROM "visit" WHERE "id" = ?', (visit_id,)).fetchone()
+
+
+@pytest.mark.parametrize('codec', sorted(name for name, _, _ in CODECS.values()))
+def test_codecs_round_trip(codec):
+    assert decode_payload(encode_payload(SUBMISSION, codec)) == SUBMISSION
+
+
+def test_payloads_are_stored_compressed_and_decoded_on_access(tables):
+    visit = Visit.create(address="Straat 1", visit_date=date(2025, 3, 1), visit_data=SUBMISSION)
+
+    raw, storage = stored_payload(visit.id)
+    assert storage == 'blob' and raw[0] == 1
+    loaded = Visit.get_by_id(visit.id)
+    assert isinstance(loaded.__data__['visit_data'], bytes)
+    assert loaded.visit_data == SUBMISSION
+    # A row saved without reading the payload keeps the same bytes
+    Visit.get_by_id(visit.id).save()
+    assert stored_payload(visit.id)[0] == raw
+
+
+@pytest.mark.parametrize('payload', [None, {}, []])
+def test_empty_payloads_round_trip(tables, payload):
+    visit = Visit.create(address="Straat 1", visit_date=date(2025, 3, 1), visit_data=payload)
+    assert Visit.get_by_id(visit.id).visit_data == payload
+
+
+def test_empty_and_unknown_blobs():
+    assert decode_payload(b"") is None
+    with pytest.raises(ValueError):
+        decode_payload(b"\xff{}")
+
+
+def test_text_payloads_are_converted(tables):
+    legacy = {
+        'json': '{"_id": 1, "adres": "Straat 1"}',
+        'repr': str({'_id': 2, 'adres': "Straat 2", 'klaar': True}),
+        'garbage': "not a payload {",
+    }
+    ids = {}
+    for name, text in legacy.items():
+        ids[name] = Visit.create(address=name, visit_date=date(2025, 3, 1)).id
+        db.execute_sql('UPDATE "visit" SET "visit_data" = ? WHERE "id" = ?', (text, ids[name]))
+    untouched = Visit.create(address="nieuw", visit_date=date(2025, 3, 1), visit_data=SUBMISSION).id
+    before = stored_payload(untouched)
+
+    assert convert_legacy_payloads(None, MODELS, batch_size=2) == 3
+    assert all(stored_payload(visit_id)[1] == 'blob' for visit_id in ids.values())
+    assert Visit.get_by_id(ids['json']).visit_data == {'_id': 1, 'adres': "Straat 1"}
+    assert Visit.get_by_id(ids['repr']).visit_data == {'_id': 2, 'adres': "Straat 2", 'klaar': True}
+    assert Visit.get_by_id(ids['garbage']).visit_data == "not a payload {"
+    assert stored_payload(untouched) == before
+    assert convert_legacy_payloads(None, MODELS) == 0
@@ -0,0 +1,82 @@
+"""
+On-disk HTTP cache: conditional revalidation and LRU eviction.
+"""
+import os
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from core.services.http_cache import HttpCache
+
+
+def response(url, body=b"{}", status=200, **headers):
+    result = requests.Response()
+    result.status_code = status
+    result.url = url
+    result.headers = CaseInsensitiveDict(headers)
+    result._content = body
+    return result
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return HttpCache(tmp_path, max_bytes=10_000)
+
+
+def test_key_depends_on_params_and_credentials(cache):
+    url = "https://kf.kobotoolbox.org/api/v2/assets/"
+    assert cache.key(url, {'page': 1}) == cache.key(url + "?page=1")
+    assert cache.key(url) != cache.key(url, headers={'Authorization': "Token a"})
+
+
+def test_304_is_answered_from_disk(cache):
+    url = "https://kf.kobotoolbox.org/api/v2/assets/"
+    key = cache.key(url)
+    cache.store(key, response(url, b'{"count": 1}', ETag='"v1"', **{'Last-Modified': "Sat, 01 Mar 2025 10:00:00 GMT"}))
+
+    assert cache.validators(key) == {'If-None-Match': '"v1"', 'If-Modified-Since': "Sat, 01 Mar 2025 10:00:00 GMT"}
+    cached = cache.revalidated(key, response(url, b"", status=304))
+    assert (cached.status_code, cached.json(), cached.from_cache) == (200, {'count': 1}, True)
+    assert cache.stats['hits'] == 1
+
+
+@pytest.mark.parametrize('status, headers', [
+    (200, {}),
+    (404, {'ETag': '"v1"'}),
+    (200, {'ETag': '"v1"', 'Cache-Control': "private, no-store"}),
+])
+def test_unvalidated_responses_are_not_stored(cache, status, headers):
+    key = cache.key("https://api.calendly.com/users/me")
+    cache.store(key, response("https://api.calendly.com/users/me", status=status, **headers))
+    assert cache.validators(key) == {}
+    assert cache.revalidated(key, response("https://api.calendly.com/users/me", status=304)) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    urls = {name: f"https://kf.kobotoolbox.org/{name}" for name in "abc"}
+    cache = HttpCache(tmp_path, max_bytes=2_500)
+    keys = {name: cache.key(url) for name, url in urls.items()}
+    for name in "ab":
+        cache.store(keys[name], response(urls[name], b"x" * 1_000, ETag=f'"{name}"'))
+
+    # File timestamps are coarse; make "a" the older entry, then use it again
+    os.utime(tmp_path / f"{keys['a']}.json", (0, 0))
+    os.utime(tmp_path / f"{keys['b']}.json", (1, 1))
+    cache = HttpCache(tmp_path, max_bytes=2_500)
+    cache.revalidated(keys['a'], response(urls['a'], status=304))
+
+    cache.store(keys['c'], response(urls['c'], b"x" * 1_000, ETag='"c"'))
+    assert cache.stats['evicted'] == 1
+    assert cache.validators(keys['b']) == {}
+    assert cache.validators(keys['a']) and cache.validators(keys['c'])
+    assert cache.total_bytes <= 2_500
+
+
+def test_entries_survive_a_restart(tmp_path):
+    url = "https://kf.kobotoolbox.org/a"
+    first = HttpCache(tmp_path)
+    first.store(first.key(url), response(url, ETag='"v1"'))
+    second = HttpCache(tmp_path)
+    assert second.total_bytes == first.total_bytes
+    assert second.validators(second.key(url)) == {'If-None-Match': '"v1"'}
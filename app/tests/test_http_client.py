@@ -0,0 +1,136 @@
+"""
+Shared HTTP client: retry policy, backoff and rate limiting of retries.
+"""
+import io
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from core.services import http_client
+from core.services.http_client import RETRY_STATUSES, HttpClient, JitteredRetry
+from core.services.rate_limiter import RateLimiter
+
+HOST = "kf.kobotoolbox.org"
+URL = f"https://{HOST}/api/v2/assets/"
+
+
+def retry_policy(**options):
+    return JitteredRetry(**dict({'total': 5, 'backoff_factor': 1, 'status_forcelist': RETRY_STATUSES,
+                                 'respect_retry_after_header': True}, **options))
+
+
+def after_failures(count):
+    policy = retry_policy()
+    for _ in range(count):
+        policy = policy.increment('GET', "https://kf.kobotoolbox.org/api/v2/assets/")
+    return policy
+
+
+@pytest.mark.parametrize('jitter', [0.5, 1.5])
+def test_backoff_is_jittered_within_half_to_one_and_a_half(monkeypatch, jitter):
+    monkeypatch.setattr(http_client.random, 'uniform', lambda low, high: {0.5: low, 1.5: high}[jitter])
+    # Three consecutive failures: urllib3 backs off factor * 2 ** 2
+    assert after_failures(3).get_backoff_time() == 4 * jitter
+
+
+def test_backoff_stays_within_bounds():
+    delays = [after_failures(3).get_backoff_time() for _ in range(200)]
+    assert all(2 <= delay <= 6 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_first_retry_is_immediate():
+    assert after_failures(1).get_backoff_time() == 0
+
+
+class RetryAfterResponse:
+    def __init__(self, value):
+        self.headers = {'Retry-After': value}
+
+
+def test_retry_after_is_honoured_without_jitter():
+    assert retry_policy().get_retry_after(RetryAfterResponse("7")) == 7
+    assert retry_policy().is_retry('GET', 429, has_retry_after=True)
+
+
+@pytest.mark.parametrize('method, status, retried', [
+    ('GET', 429, True),
+    ('GET', 500, True),
+    ('GET', 503, True),
+    ('GET', 404, False),
+    ('GET', 401, False),
+    ('PUT', 502, True),
+    ('POST', 503, False),
+    ('POST', 429, False),
+])
+def test_retried_methods_and_statuses(method, status, retried):
+    assert retry_policy().is_retry(method, status) is retried
+
+
+def response(status, **headers):
+    result = requests.Response()
+    result.status_code = status
+    result.headers = CaseInsensitiveDict(headers)
+    result.raw = io.BytesIO(b"")
+    return result
+
+
+class StubSession:
+    """Replays canned responses instead of touching the network"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, timeout=None, **kwargs):
+        self.calls.append(method)
+        return self.responses.pop(0)
+
+
+def client(*responses, max_retries=3, limiter=None):
+    result = HttpClient(max_retries=max_retries, backoff_factor=0, rate_limiter=limiter or RateLimiter(rate=20, burst=5))
+    result.session = StubSession(*responses)
+    return result
+
+
+def test_adapter_leaves_status_retries_to_the_client():
+    adapter_retry = HttpClient(rate_limiter=RateLimiter()).session.get_adapter(URL).max_retries
+    assert isinstance(adapter_retry, JitteredRetry)
+    assert not adapter_retry.is_retry('GET', 429, has_retry_after=True)
+    assert not adapter_retry.is_retry('GET', 503)
+
+
+def test_retried_429_throttles_the_shared_limiter():
+    limiter = RateLimiter(rate=20, burst=5)
+    http = client(response(429, **{'Retry-After': "0"}), response(200), limiter=limiter)
+
+    assert http.request('GET', URL).status_code == 200
+    assert http.session.calls == ['GET', 'GET']
+    bucket = limiter.bucket(HOST)
+    # The 429 emptied the bucket, so the retry had to wait for a fresh token
+    assert (bucket.calls, bucket.throttled_calls) == (2, 1)
+    assert bucket.tokens < 1
+
+
+def test_every_attempt_is_observed(monkeypatch):
+    observed = []
+    limiter = RateLimiter(rate=1000, burst=5)
+    monkeypatch.setattr(limiter, 'observe', lambda host, status, headers: observed.append(status))
+
+    http = client(response(503), response(502), response(200), limiter=limiter)
+    assert http.request('GET', URL).status_code == 200
+    assert observed == [503, 502, 200]
+    assert limiter.bucket(HOST).calls == 3
+
+
+def test_last_response_is_returned_when_retries_run_out():
+    http = client(*(response(503) for _ in range(3)), max_retries=2)
+    assert http.request('GET', URL).status_code == 503
+    assert len(http.session.calls) == 3
+
+
+def test_posts_are_not_retried():
+    http = client(response(503), response(200))
+    assert http.request('POST', URL).status_code == 503
+    assert http.session.calls == ['POST']
@@ -0,0 +1,49 @@
+"""
+Sync writes: batched visit upserts.
+"""
+from datetime import date
+
+from core.ingestion import VisitIngestor
+from core.models import Visit
+
+
+def visit(submission_id, address="Straat 1", **extra):
+    return dict({'kobo_submission_id': submission_id, 'address': address, 'visit_date': date(2025, 3, 1)}, **extra)
+
+
+def ingest(*rows, batch_size=500):
+    ingestor = VisitIngestor(batch_size=batch_size)
+    for row in rows:
+        ingestor.add(row)
+    ingestor.flush()
+    return ingestor
+
+
+def test_ingestor_counts_inserts_updates_and_unchanged(tables):
+    assert ingest(visit(1), visit(2)).stats['inserted'] == 2
+
+    stats = ingest(visit(1), visit(2, address="Straat 9"), visit(3)).stats
+    assert (stats['inserted'], stats['updated'], stats['unchanged']) == (1, 1, 1)
+    assert Visit.get(Visit.kobo_submission_id == '2').address == "Straat 9"
+    assert Visit.select().count() == 3
+
+
+def test_ingestor_keeps_the_last_duplicate_and_flushes_full_batches(tables):
+    flushes = []
+    ingestor = VisitIngestor(batch_size=2, on_flush=lambda ingestor: flushes.append(dict(ingestor.stats)))
+    for row in (visit(1), visit(1, address="Straat 2"), visit(2), visit(3)):
+        ingestor.add(row)
+    assert len(flushes) == 1
+    ingestor.flush()
+    assert Visit.get(Visit.kobo_submission_id == '1').address == "Straat 2"
+    assert ingestor.stats['inserted'] == 3
+
+
+def test_rows_the_database_rejects_are_isolated(tables):
+    ingestor = ingest(visit(1), visit(2, address=None), visit(3))
+    assert ingestor.stats['inserted'] == 2
+    assert ingestor.stats['failed'] == 1
+    (failed_row, error), = ingestor.failed
+    assert failed_row['kobo_submission_id'] == '2'
+    assert 'NOT NULL' in str(error)
+    assert sorted(Visit.select(Visit.kobo_submission_id).tuples()) == [('1',), ('3',)]
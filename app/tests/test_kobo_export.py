@@ -0,0 +1,54 @@
+"""
+Kobo export readers: CSV and XLSX rows shaped like data API submissions.
+"""
+import csv
+from datetime import datetime
+
+import pytest
+
+from core.services.kobo_export import iter_export_rows, iter_pages
+
+HEADER = ['_id', '_submission_time', 'introductie/adres', 'introductie/afspraakTijd', 'afsluiting/opmerkingen']
+ROWS = [
+    ['1', "2025-03-01T12:00:00", "Straat 1", "2025-03-01T10:30:00", "Tocht bij de voordeur"],
+    ['2', "2025-03-02T12:00:00", "Straat 2", "2025-03-02T09:00:00", ""],
+]
+EXPECTED = [
+    {'_id': 1, '_submission_time': "2025-03-01T12:00:00", 'introductie/adres': "Straat 1",
+     'introductie/afspraakTijd': "2025-03-01T10:30:00", 'afsluiting/opmerkingen': "Tocht bij de voordeur"},
+    {'_id': 2, '_submission_time': "2025-03-02T12:00:00", 'introductie/adres': "Straat 2",
+     'introductie/afspraakTijd': "2025-03-02T09:00:00"},
+]
+
+
+@pytest.mark.parametrize('delimiter', [';', ','])
+def test_csv_round_trip(tmp_path, delimiter):
+    path = tmp_path / "export.csv"
+    with open(path, 'w', newline='', encoding='utf-8-sig') as handle:
+        writer = csv.writer(handle, delimiter=delimiter)
+        writer.writerow(HEADER)
+        writer.writerows(ROWS)
+    assert list(iter_export_rows(path)) == EXPECTED
+
+
+def test_xlsx_round_trip(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    path = tmp_path / "export.xlsx"
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(HEADER)
+    # Excel hands back numbers and datetimes rather than strings
+    for submission_id, submitted, address, appointment, remarks in ROWS:
+        sheet.append([float(submission_id), datetime.fromisoformat(submitted), address,
+                      datetime.fromisoformat(appointment), remarks or None])
+    workbook.save(path)
+    assert list(iter_export_rows(path)) == EXPECTED
+
+
+def test_unknown_extension_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        iter_export_rows(tmp_path / "export.json")
+
+
+def test_rows_are_grouped_into_pages():
+    assert list(iter_pages(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
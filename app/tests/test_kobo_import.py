@@ -0,0 +1,71 @@
+"""
+Offline import of Kobo export files.
+"""
+import csv
+from datetime import date
+
+import pytest
+
+from core.models import DeadLetter, SyncRun, Visit
+from core.services.kobo_import import import_export_file
+
+HEADER = ['_id', '_submission_time', 'introductie/adres', 'afspraakTijd', 'bewoners/aantal_bewoners']
+
+
+def write_export(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as handle:
+        writer = csv.writer(handle, delimiter=';')
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+    return path
+
+
+def rows():
+    return [
+        ['1', "2025-03-01T12:00:00", "Straat 1", "2025-03-01T10:30:00", "3"],
+        ['2', "2025-03-02T12:00:00", "Straat 2", "gisteren", "2"],
+        ['3', "2025-03-03T12:00:00", "Straat 3", "03-03-2025", ""],
+    ]
+
+
+def test_columns_are_mapped_onto_visits(tables, tmp_path):
+    import_export_file(write_export(tmp_path / "export.csv", rows()))
+
+    first = Visit.get(Visit.kobo_submission_id == '1')
+    # Root-level 'afspraakTijd' falls back to the introductie/afspraakTijd mapping
+    assert (first.address, first.visit_date, first.appointment_time) == ("Straat 1", date(2025, 3, 1), "10:30")
+    # Unmapped questions are kept in the raw submission
+    assert first.visit_data['bewoners/aantal_bewoners'] == "3"
+    assert Visit.get(Visit.kobo_submission_id == '3').visit_date == date(2025, 3, 3)
+
+
+def test_xlsx_exports_are_imported(tables, tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    path = tmp_path / "export.xlsx"
+    workbook = openpyxl.Workbook()
+    workbook.active.append(HEADER)
+    for row in rows():
+        workbook.active.append(row)
+    workbook.save(path)
+
+    assert import_export_file(path)['inserted'] == 2
+    assert Visit.get(Visit.kobo_submission_id == '1').address == "Straat 1"
+
+
+def test_bad_rows_are_counted_and_dead_lettered(tables, tmp_path):
+    stats = import_export_file(write_export(tmp_path / "export.csv", rows()))
+
+    assert (stats['rows'], stats['inserted'], stats['skipped']) == (3, 2, 1)
+    journal = SyncRun.get(SyncRun.mode == 'import')
+    assert (journal.status, journal.failed) == ('completed', 1)
+    assert [letter.record_id for letter in DeadLetter.pending('kobo')] == ['2']
+
+
+def test_reimport_changes_nothing(tables, tmp_path):
+    path = write_export(tmp_path / "export.csv", rows())
+    import_export_file(path, chunk_size=2)
+    before = list(Visit.select(Visit.kobo_submission_id, Visit.address, Visit.updated_at).tuples())
+
+    stats = import_export_file(path, chunk_size=2)
+    assert (stats['inserted'], stats['updated'], stats['unchanged']) == (0, 0, 2)
+    assert list(Visit.select(Visit.kobo_submission_id, Visit.address, Visit.updated_at).tuples()) == before
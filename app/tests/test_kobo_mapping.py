@@ -0,0 +1,81 @@
+"""
+Submission mapping: typed Visit values from KoboToolbox submissions.
+"""
+from datetime import date
+
+import pytest
+
+from core.dates import DateParseError
+from core.services.kobo_mapping import VISIT_FIELD_MAP, MissingValueError, form_paths, unknown_paths
+from core.services.kobotoolbox import KoboToolboxService, map_submission
+
+
+def submission(**answers):
+    return dict({'_id': 7, 'introductie/adres': "Straat 1", 'introductie/afspraakTijd': "2025-03-01T10:30:00+01:00",
+                 '_attachments': [{'filename': "voor.jpg", 'download_url': "https://kc.example/voor.jpg"},
+                                  {'filename': "na.jpg", 'download_url': "https://kc.example/na.jpg"}]},
+                **answers)
+
+
+def test_answers_are_typed():
+    visit_data, _ = map_submission(submission())
+    assert visit_data['visit_date'] == date(2025, 3, 1)
+    assert visit_data['appointment_time'] == "10:30"
+    assert visit_data['address'] == "Straat 1"
+    assert visit_data['photos'] == "voor.jpg\nna.jpg"
+
+
+@pytest.mark.parametrize('answer, expected', [
+    ("2025-03-01T10:30:00+01:00", "10:30"),
+    ("2025-03-01", None),
+    ("01-03-2025", None),
+    ("01.03.2025", None),
+    (date(2025, 3, 1), None),
+])
+def test_appointment_time_needs_a_time_part(answer, expected):
+    visit_data, _ = map_submission(submission(**{'introductie/afspraakTijd': answer}))
+    assert visit_data['appointment_time'] == expected
+    assert visit_data['visit_date'] == date(2025, 3, 1)
+
+
+def test_nested_groups_are_flattened():
+    visit_data, _ = map_submission({'_id': 7, 'introductie': {'adres': "Straat 1", 'afspraakTijd': "2025-03-01T10:30:00"}})
+    assert (visit_data['address'], visit_data['visit_date']) == ("Straat 1", date(2025, 3, 1))
+
+
+@pytest.mark.parametrize('answer, error', [
+    ("gisteren", DateParseError),
+    ("", MissingValueError),
+    (None, MissingValueError),
+])
+def test_unusable_visit_date_is_rejected(answer, error):
+    with pytest.raises(error):
+        map_submission(submission(**{'introductie/afspraakTijd': answer}))
+
+
+def test_rejected_submissions_are_recorded():
+    kobo = KoboToolboxService()
+    assert kobo._map_submission(submission(**{'introductie/afspraakTijd': ""})) is None
+    assert kobo.parse_errors == [{'submission_id': 7, 'field': 'visit_date', 'value': None}]
+
+
+SURVEY = [
+    {'type': 'start', 'name': 'start'},
+    {'type': 'begin_group', 'name': 'introductie'},
+    {'type': 'text', 'name': 'adres'},
+    {'type': 'datetime', '$autoname': 'afspraakTijd'},
+    {'type': 'end_group'},
+    {'type': 'begin_group', 'name': 'bewoners'},
+    {'type': 'integer', 'name': 'aantal_bewoners'},
+    {'type': 'end_group'},
+]
+
+
+def test_form_paths_follow_groups():
+    assert form_paths(SURVEY) == {'start', 'introductie/adres', 'introductie/afspraakTijd', 'bewoners/aantal_bewoners'}
+
+
+def test_mapping_is_checked_against_the_form():
+    assert unknown_paths(SURVEY) == []
+    assert unknown_paths([{'type': 'text', 'name': 'adres'}]) == ['introductie/afspraakTijd']
+    assert unknown_paths(SURVEY, VISIT_FIELD_MAP + [('bewoners/ventilatie', 'address', None)]) == ['bewoners/ventilatie']
@@ -0,0 +1,130 @@
+"""
+KoboToolbox service: paging through form submissions, checking the form and the sync journal.
+"""
+from datetime import timedelta
+
+import pytest
+
+from core.models import PROCESS_STARTED, SyncCursor, SyncRun, Visit
+from core.services.kobotoolbox import KoboToolboxService
+
+DATA_URL = "https://kf.kobotoolbox.org/api/v2/assets/form/data/"
+
+
+class StubResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+class StubHttp:
+    """Serves ``pages`` in order, recording the URL and params of every call"""
+
+    def __init__(self, *pages):
+        self.pages = list(pages)
+        self.calls = []
+
+    def get(self, url, headers=None, params=None, timeout=None, cache=False):
+        self.calls.append((url, dict(params) if params else None))
+        return StubResponse(self.pages.pop(0))
+
+
+def kobo(*pages):
+    service = KoboToolboxService()
+    service.base_url, service.api_token, service.form_id = "https://kf.kobotoolbox.org", "token", 'form'
+    service.http = StubHttp(*pages)
+    return service
+
+
+def submissions(*ids):
+    return [{'_id': submission_id} for submission_id in ids]
+
+
+def test_pages_follow_the_next_link():
+    next_url = f"{DATA_URL}?format=json&limit=2&start=2"
+    service = kobo({'results': submissions(1, 2), 'next': next_url}, {'results': submissions(3), 'next': None})
+
+    pages = list(service.iter_form_pages(page_size=2, sort={'_id': 1}))
+    assert pages == [submissions(1, 2), submissions(3)]
+    (first_url, first_params), second = service.http.calls
+    assert (first_url, first_params['start'], first_params['limit'], first_params['sort']) == (DATA_URL, 0, 2, '{"_id": 1}')
+    # The next link already carries every parameter
+    assert second == (next_url, None)
+
+
+def test_pages_advance_the_offset_without_a_next_link():
+    service = kobo({'results': submissions(1, 2)}, {'results': submissions(3, 4)}, {'results': submissions(5)})
+
+    assert list(service.iter_submissions(page_size=2)) == submissions(1, 2, 3, 4, 5)
+    assert [params['start'] for _, params in service.http.calls] == [0, 2, 4]
+
+
+def test_empty_page_ends_the_stream():
+    service = kobo({'results': submissions(1, 2)}, {'results': []})
+    assert list(service.iter_form_pages(page_size=2)) == [submissions(1, 2)]
+    assert len(service.http.calls) == 2
+
+
+def test_unconfigured_service_fetches_nothing():
+    service = kobo()
+    service.api_token = ''
+    assert list(service.iter_form_pages()) == []
+    assert service.http.calls == []
+
+
+def form(*names):
+    return {'content': {'survey': [{'type': 'begin_group', 'name': 'introductie'}] +
+                                  [{'type': 'text', 'name': name} for name in names] + [{'type': 'end_group'}]}}
+
+
+def test_field_map_matches_the_form():
+    service = kobo(form('adres', 'afspraakTijd', 'uitvoerders'))
+    service.check_field_map()
+    service.check_field_map()
+    assert service.field_map_checked and len(service.http.calls) == 1
+
+
+def test_field_map_with_unknown_questions_fails():
+    service = kobo(form('adres'))
+    with pytest.raises(ValueError, match="introductie/afspraakTijd"):
+        service.check_field_map()
+    assert not service.field_map_checked
+
+
+def test_failed_full_sync_is_resumed_after_other_runs(tables):
+    service = kobo()
+    failed = SyncRun.create(form_id='form', mode='full', status='failed', cursor_time="2025-03-01T10:00:00")
+    SyncRun.create(form_id='form', mode='incremental', status='completed')
+
+    assert service._start_journal('full').resumed_from == failed
+    assert service._start_journal('incremental').resumed_from is None
+
+
+def test_only_runs_of_earlier_processes_are_interrupted(tables):
+    abandoned = SyncRun.create(form_id='form', started_at=PROCESS_STARTED - timedelta(hours=1))
+    live = SyncRun.create(form_id='form')
+
+    kobo()._start_journal('incremental')
+    assert SyncRun.get_by_id(abandoned.id).status == 'interrupted'
+    assert SyncRun.get_by_id(live.id).status == 'running'
+
+
+def test_incremental_sync_picks_up_edited_submissions(tables):
+    def answered(submission_id, adres, **meta):
+        return dict({'_id': submission_id, '_submission_time': f"2025-03-0{submission_id}T12:00:00",
+                     'introductie/adres': adres, 'introductie/afspraakTijd': "2025-03-01T10:00:00"}, **meta)
+
+    SyncCursor.create(form_id='form', last_submission_time="2025-03-05T12:00:00", last_submission_id=5)
+    edited = answered(2, "Straat 2b", _last_edited="2025-03-06T09:00:00")
+    service = kobo(form('adres', 'afspraakTijd'), {'results': [edited, answered(5, "Straat 5"), answered(6, "Straat 6")]})
+
+    assert service.sync_visits() == 2
+    _, (_, params) = service.http.calls
+    assert '"_last_edited": {"$gte": "2025-03-05T12:00:00"}' in params['query']
+    assert {visit.kobo_submission_id: visit.address for visit in Visit.select()} == {'2': "Straat 2b", '6': "Straat 6"}
+    assert SyncCursor.for_form('form').last_submission_id == 6
@@ -0,0 +1,225 @@
+"""
+Schema tests: migrations and the query plans of the page queries.
+"""
+from datetime import date, datetime
+
+import pytest
+from peewee import OperationalError
+
+from conftest import MODELS
+from core import migrations
+from core.database import db
+from core.ingestion import VisitIngestor
+from core.migrations import MIGRATIONS, current_version, migrate_database
+from core.models import Appointment, Visit, Volunteer, get_volunteer_aggregates, in_period, period_bounds
+
+
+def query_plan(query):
+    sql, params = query.sql()
+    return [row[-1] for row in db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def assert_uses_index(query):
+    """Fail when any table in the plan is read by a full scan"""
+    plan = query_plan(query)
+    assert any('INDEX' in step for step in plan), plan
+    # Peewee aliases tables (t1, t2, ...), so every SCAN step is checked
+    for step in plan:
+        if step.startswith('SCAN '):
+            assert 'INDEX' in step, plan
+
+
+def test_new_database_is_stamped_at_latest_version(database):
+    assert migrate_database(MODELS) == []
+    assert current_version() == max(step.version for step in MIGRATIONS)
+
+
+def test_migrations_index_an_unindexed_database(database):
+    db.create_tables(MODELS)
+    for model in (Visit, Appointment):
+        for index in db.get_indexes(model._meta.table_name):
+            if not index.unique:
+                db.execute_sql(f'DROP INDEX "{index.name}"')
+    Visit.create(address="Straat 1", visit_date=date(2025, 3, 1))
+
+    assert migrate_database(MODELS) == sorted(step.version for step in MIGRATIONS)
+    indexed = {tuple(index.columns) for index in db.get_indexes('visit')}
+    assert {('visit_date',), ('status',), ('volunteer_id', 'visit_date'), ('volunteer_2_id', 'visit_date')} <= indexed
+    assert Visit.select().count() == 1
+    assert migrate_database(MODELS) == []
+
+
+def test_migrated_legacy_tables_accept_upserts(database):
+    db.create_tables(MODELS)
+    # As left by earlier releases: no unique keys, plus a dropped NOT NULL column
+    for table in ('visit', 'appointment'):
+        for index in db.get_indexes(table):
+            db.execute_sql(f'DROP INDEX "{index.name}"')
+    for address in ("Straat 1", "Straat 1"):
+        Visit.create(address=address, visit_date=date(2025, 1, 1), kobo_submission_id="dup")
+    create_visit, = db.execute_sql("SELECT sql FROM sqlite_master WHERE name = 'visit'").fetchone()
+    columns = ', '.join(f'"{column.name}"' for column in db.get_columns('visit'))
+    db.execute_sql('ALTER TABLE "visit" RENAME TO "visit_old"')
+    db.execute_sql(create_visit.replace('PRIMARY KEY, ', 'PRIMARY KEY, "ventilation" INTEGER NOT NULL, ', 1))
+    db.execute_sql(f'INSERT INTO "visit" ({columns}, "ventilation") SELECT {columns}, 1 FROM "visit_old"')
+    db.execute_sql('DROP TABLE "visit_old"')
+    db.execute_sql('CREATE TABLE "visits" ("id" INTEGER NOT NULL PRIMARY KEY, "kobo_submission_id" VARCHAR(100))')
+    db.execute_sql('CREATE UNIQUE INDEX "visit_kobo_submission_id" ON "visits" ("kobo_submission_id")')
+
+    migrate_database(MODELS)
+    assert Visit.select().where(Visit.kobo_submission_id == "dup").count() == 1
+
+    for address in ("Straat 2", "Straat 3"):
+        ingestor = VisitIngestor()
+        ingestor.add({'kobo_submission_id': "k1", 'address': address, 'visit_date': date(2025, 2, 1)})
+        ingestor.flush()
+        assert ingestor.failed == []
+    assert Visit.get(Visit.kobo_submission_id == "k1").address == "Straat 3"
+
+    for name in ("Intake", "Follow-up"):
+        (Appointment
+         .insert(calendly_event_uuid="e1", event_name=name, start_time=datetime(2025, 1, 1, 9),
+                 end_time=datetime(2025, 1, 1, 10))
+         .on_conflict(conflict_target=[Appointment.calendly_event_uuid], preserve=[Appointment.event_name])
+         .execute())
+    assert Appointment.get(Appointment.calendly_event_uuid == "e1").event_name == "Follow-up"
+
+
+def unindexed_column(table, column):
+    """Drop ``column`` as if the database predates it"""
+    for index in db.get_indexes(table):
+        if column in index.columns:
+            db.execute_sql(f'DROP INDEX "{index.name}"')
+    db.execute_sql(f'ALTER TABLE "{table}" DROP COLUMN "{column}"')
+
+
+def test_missing_columns_are_added_with_their_indexes(database):
+    db.create_tables(MODELS)
+    unindexed_column('appointment', 'start_time')
+    unindexed_column('visit', 'content_hash')
+    db.execute_sql('ALTER TABLE "visit" RENAME COLUMN "status" TO "STATUS"')
+    # Index name taken by a table from an older release
+    db.execute_sql('CREATE TABLE "appointments" ("id" INTEGER NOT NULL PRIMARY KEY, "start_time" DATETIME)')
+    db.execute_sql('CREATE INDEX "appointment_start_time" ON "appointments" ("start_time")')
+
+    migrate_database(MODELS)
+    assert 'start_time' in {column.name for column in db.get_columns('appointment')}
+    assert 'content_hash' in {column.name for column in db.get_columns('visit')}
+    assert ['start_time'] in [index.columns for index in db.get_indexes('appointment')]
+    assert current_version() == max(step.version for step in MIGRATIONS)
+
+
+def test_failed_column_add_is_not_recorded(database, monkeypatch):
+    db.create_tables(MODELS)
+    unindexed_column('visit', 'content_hash')
+
+    def disk_full(*operations):
+        raise OperationalError("database or disk is full")
+    monkeypatch.setattr(migrations, 'migrate', disk_full)
+    with pytest.raises(OperationalError):
+        migrate_database(MODELS)
+    assert current_version() == 0
+
+    monkeypatch.undo()
+    assert 1 in migrate_database(MODELS)
+    assert 'content_hash' in {column.name for column in db.get_columns('visit')}
+
+
+def test_duplicate_appointments_are_kept_aside(database):
+    db.create_tables(MODELS)
+    for index in db.get_indexes('appointment'):
+        db.execute_sql(f'DROP INDEX "{index.name}"')
+    for uuid, name in (("e1", "Intake"), ("e1", "Follow-up"), ("e2", "Intake")):
+        Appointment.create(calendly_event_uuid=uuid, event_name=name, start_time=datetime(2025, 1, 1, 9),
+                           end_time=datetime(2025, 1, 1, 10))
+
+    migrate_database(MODELS)
+    kept = sorted(Appointment.select(Appointment.calendly_event_uuid, Appointment.event_name).tuples())
+    assert kept == [("e1", "Follow-up"), ("e2", "Intake")]
+    moved = db.execute_sql('SELECT "calendly_event_uuid", "event_name" FROM "appointment_duplicate"').fetchall()
+    assert moved == [("e1", "Intake")]
+
+
+def page_queries():
+    volunteer = 1
+    either_volunteer = (Visit.volunteer == volunteer) | (Visit.volunteer_2 == volunteer)
+    return {
+        'visit list': Visit.select_without_payloads().order_by(Visit.visit_date.desc()),
+        'recent visits': Visit.select_without_payloads().order_by(Visit.visit_date.desc()).limit(10),
+        'date filter': (Visit.select_without_payloads()
+                        .where((Visit.visit_date >= date(2025, 1, 1)) & (Visit.visit_date <= date(2025, 3, 31)))
+                        .order_by(Visit.visit_date.desc())),
+        'volunteer filter': Visit.select_without_payloads().where(either_volunteer).order_by(Visit.visit_date.desc()),
+        'volunteer visit count': Visit.select().where(either_volunteer),
+        'volunteer last visit': Visit.select().where(either_volunteer).order_by(Visit.visit_date.desc()).limit(1),
+        'status filter': Visit.select().where(Visit.status == 'completed'),
+        'visits this month': Visit.select().where(in_period(Visit.visit_date, 2025, 3)),
+        'volunteer month': Visit.select().where(either_volunteer & in_period(Visit.visit_date, 2025, 3)),
+        'upcoming appointments': (Appointment.select_without_payloads()
+                                  .where(Appointment.start_time > datetime(2025, 1, 1))
+                                  .order_by(Appointment.start_time)
+                                  .limit(10)),
+    }
+
+
+@pytest.mark.parametrize('name', list(page_queries()))
+def test_page_query_uses_index(database, name):
+    migrate_database(MODELS)
+    assert_uses_index(page_queries()[name])
+
+
+@pytest.mark.parametrize('period, bounds', [
+    ((2025, 3, None), (date(2025, 3, 1), date(2025, 4, 1))),
+    ((2025, 12, None), (date(2025, 12, 1), date(2026, 1, 1))),
+    ((2025, None, 4), (date(2025, 10, 1), date(2026, 1, 1))),
+    ((2025, None, None), (date(2025, 1, 1), date(2026, 1, 1))),
+])
+def test_period_bounds_are_half_open(period, bounds):
+    assert period_bounds(*period) == bounds
+
+
+def test_in_period_matches_month_and_year(database):
+    migrate_database(MODELS)
+    for day in (date(2025, 2, 28), date(2025, 3, 1), date(2025, 3, 31), date(2025, 4, 1), date(2024, 3, 15)):
+        Visit.create(address="Straat 1", visit_date=day)
+    by_range = Visit.select().where(in_period(Visit.visit_date, 2025, 3)).count()
+    by_strftime = Visit.select().where((Visit.visit_date.month == 3) & (Visit.visit_date.year == 2025)).count()
+    assert by_range == by_strftime == 2
+
+
+@pytest.mark.parametrize('period', [
+    {'year': 2025, 'start': date(2025, 1, 1)},
+    {'year': 2025, 'month': 3, 'end': date(2025, 6, 1)},
+    {'month': 3},
+    {'quarter': 2, 'start': date(2025, 1, 1)},
+    {},
+])
+def test_in_period_rejects_ambiguous_periods(period):
+    with pytest.raises(ValueError):
+        in_period(Visit.visit_date, **period)
+
+
+def test_in_period_accepts_open_bounds(database):
+    migrate_database(MODELS)
+    for day in (date(2025, 2, 28), date(2025, 3, 1), date(2025, 4, 1)):
+        Visit.create(address="Straat 1", visit_date=day)
+    assert Visit.select().where(in_period(Visit.visit_date, start=date(2025, 3, 1))).count() == 2
+    assert Visit.select().where(in_period(Visit.visit_date, end=date(2025, 3, 1))).count() == 1
+
+
+def test_volunteer_aggregates_count_each_visit_once(database):
+    migrate_database(MODELS)
+    ann, bob, cas = (Volunteer.create(name=name) for name in ("Ann", "Bob", "Cas"))
+    Visit.create(address="Straat 1", visit_date=date(2025, 1, 10), volunteer=ann, volunteer_2=bob)
+    Visit.create(address="Straat 2", visit_date=date(2025, 3, 5), volunteer=bob, volunteer_2=ann)
+    Visit.create(address="Straat 3", visit_date=date(2025, 3, 20), volunteer=ann, volunteer_2=ann)
+
+    aggregates = get_volunteer_aggregates()
+    assert cas.id not in aggregates
+    assert aggregates[ann.id]["visit_count"] == 3
+    assert aggregates[ann.id]["first_visit"] == date(2025, 1, 10)
+    assert aggregates[ann.id]["last_visit"] == date(2025, 3, 20)
+    assert aggregates[ann.id]["monthly"] == {(2025, 1): 1, (2025, 3): 2}
+    assert aggregates[ann.id]["monthly_average"] == 1.0
+    assert aggregates[bob.id]["visit_count"] == 2
+    assert list(get_volunteer_aggregates([bob.id])) == [bob.id]
@@ -0,0 +1,70 @@
+"""
+Process-pool mapping of submission pages.
+"""
+import pytest
+
+from core.dates import DateParseError
+from core.fields import CODEC_IDS, decode_payload
+from core.ingestion import VisitIngestor
+from core.models import Visit
+from core.parallel_parse import ParallelMapper, default_processes, map_chunk, mapped_fields
+from core.services.kobotoolbox import KoboToolboxService
+
+
+def page():
+    return [
+        {'_id': submission_id, '_submission_time': f"2025-03-01T12:00:{submission_id:02d}",
+         'introductie/adres': f"Straat {submission_id}", 'introductie/uitvoerders': "Anna en Bram",
+         'introductie/afspraakTijd': "gisteren" if submission_id == 3 else "2025-03-01T10:30:00",
+         'bewoners/aantal_bewoners': str(submission_id)}
+        for submission_id in range(1, 8)
+    ]
+
+
+def map_page(processes):
+    service = KoboToolboxService()
+    mapper = ParallelMapper(service, processes=processes, chunk_size=3, min_parallel=2)
+    try:
+        return mapper.map_page(page()), service
+    finally:
+        mapper.close()
+
+
+def test_workers_match_the_in_process_path():
+    serial, _ = map_page(processes=0)
+    parallel, _ = map_page(processes=2)
+    ingestor = VisitIngestor()
+
+    assert len(parallel) == len(serial) == 7
+    for (expected, expected_names, _), (visit_data, names, error) in zip(serial, parallel):
+        if expected is None:
+            continue
+        assert error is None and names == expected_names
+        assert decode_payload(visit_data['visit_data']) == expected['visit_data']
+        assert {name: value for name, value in visit_data.items() if name not in ('visit_data', 'payload_hash')} == \
+            {name: value for name, value in expected.items() if name != 'visit_data'}
+        assert ingestor._content_hash(dict(visit_data)) == ingestor._content_hash(dict(expected))
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_worker_errors_are_reported(processes):
+    mapped, service = map_page(processes)
+    visit_data, names, error = mapped[2]
+    assert (visit_data, names) == (None, None)
+    assert isinstance(error, DateParseError)
+    assert service.parse_errors == [{'submission_id': 3, 'field': 'visit_date', 'value': "gisteren"}]
+    assert sum(1 for visit_data, _, _ in mapped if visit_data) == 6
+
+
+def test_workers_encode_with_the_field_codec(monkeypatch):
+    monkeypatch.setattr(Visit.visit_data, 'codec', 'raw')
+    values = next(result[1] for result in map_chunk(page()) if result[0] == 'ok')
+    assert values[mapped_fields().index('visit_data')][0] == CODEC_IDS['raw']
+
+
+def test_default_processes(monkeypatch):
+    monkeypatch.setattr('os.cpu_count', lambda: 8)
+    assert default_processes(3) == 3
+    assert default_processes(0) == 0
+    assert default_processes(-1) == 4
+    assert default_processes(-1, cap=2) == 2
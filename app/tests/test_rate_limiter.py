@@ -0,0 +1,74 @@
+"""
+Per-host token buckets and their updates from rate-limit headers.
+"""
+import time
+
+import pytest
+
+from core.services.rate_limiter import RateLimiter, TokenBucket
+
+
+def test_bucket_allows_a_burst_then_paces():
+    bucket = TokenBucket(rate=50, capacity=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.02, abs=0.015)
+    assert (bucket.calls, bucket.throttled_calls) == (4, 1)
+
+
+def test_exhausted_quota_waits_for_the_reset():
+    bucket = TokenBucket(rate=1000, capacity=10)
+    bucket.update_quota(0, 0.05)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.04
+    assert bucket.quota_remaining is None
+
+
+def test_quota_caps_the_tokens():
+    bucket = TokenBucket(rate=1, capacity=10)
+    bucket.update_quota(2, 60)
+    assert bucket.tokens == 2
+    bucket.acquire()
+    assert bucket.quota_remaining == 1
+
+
+def test_observe_reads_remaining_and_reset():
+    limiter = RateLimiter(rate=10, burst=5)
+    limiter.observe('kf.kobotoolbox.org', 200, {'X-RateLimit-Remaining': '3', 'X-RateLimit-Reset': '30'})
+    bucket = limiter.bucket('kf.kobotoolbox.org')
+    assert bucket.quota_remaining == 3
+    assert bucket.quota_reset - time.monotonic() == pytest.approx(30, abs=1)
+
+
+def test_observe_converts_epoch_resets():
+    limiter = RateLimiter(rate=10, burst=5)
+    limiter.observe('api.calendly.com', 200,
+                    {'X-RateLimit-Remaining': '3', 'X-RateLimit-Reset': str(int(time.time()) + 30)})
+    assert limiter.bucket('api.calendly.com').quota_reset - time.monotonic() == pytest.approx(30, abs=2)
+
+
+def test_429_empties_the_bucket_until_retry_after():
+    limiter = RateLimiter(rate=10, burst=5)
+    limiter.observe('api.calendly.com', 429, {'Retry-After': '12'})
+    bucket = limiter.bucket('api.calendly.com')
+    assert (bucket.quota_remaining, bucket.tokens) == (0, 0)
+    assert bucket.quota_reset - time.monotonic() == pytest.approx(12, abs=1)
+
+
+@pytest.mark.parametrize('headers', [
+    {},
+    None,
+    {'X-RateLimit-Remaining': '3'},
+    {'X-RateLimit-Remaining': 'many', 'X-RateLimit-Reset': '30'},
+])
+def test_observe_ignores_incomplete_headers(headers):
+    limiter = RateLimiter(rate=10, burst=5)
+    limiter.observe('api.calendly.com', 200, headers)
+    assert limiter.bucket('api.calendly.com').quota_remaining is None
+
+
+def test_hosts_have_separate_buckets():
+    limiter = RateLimiter(rate=10, burst=1)
+    limiter.observe('api.calendly.com', 429, {'Retry-After': '60'})
+    assert limiter.acquire('kf.kobotoolbox.org') == 0.0
+    assert set(limiter.stats()) == {'api.calendly.com', 'kf.kobotoolbox.org'}
@@ -0,0 +1,30 @@
+"""
+The persisted Kobo high-water mark.
+"""
+import pytest
+
+from core.models import SyncCursor
+
+
+@pytest.mark.parametrize('submission_time, submission_id, seen', [
+    ("2025-03-01T10:00:00", 5, True),
+    ("2025-03-01T10:00:00", 4, True),
+    ("2025-03-01T10:00:00", 6, False),
+    ("2025-02-28T23:59:59", 9, True),
+    ("2025-03-01T10:00:01", 1, False),
+    (None, 1, False),
+])
+def test_cursor_is_seen(submission_time, submission_id, seen):
+    cursor = SyncCursor(form_id='form', last_submission_time="2025-03-01T10:00:00", last_submission_id=5)
+    assert cursor.is_seen(submission_time, submission_id) is seen
+
+
+def test_cursor_only_advances():
+    cursor = SyncCursor(form_id='form')
+    assert not cursor.is_seen("2025-03-01T10:00:00", 1)
+    cursor.advance("2025-03-01T10:00:00", 5)
+    cursor.advance("2025-02-01T10:00:00", 9)
+    cursor.advance("2025-03-01T10:00:00", 3)
+    assert (cursor.last_submission_time, cursor.last_submission_id) == ("2025-03-01T10:00:00", 5)
+    cursor.advance("2025-03-01T10:00:00", 6)
+    assert cursor.last_submission_id == 6
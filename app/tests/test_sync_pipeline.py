@@ -0,0 +1,63 @@
+"""
+The staged sync pipeline: journal checkpoints, dead letters and error propagation.
+"""
+import threading
+
+import pytest
+
+from core.models import DeadLetter, SyncCursor, SyncRun, Visit
+from core.services.kobotoolbox import KoboToolboxService
+from core.sync_pipeline import SyncPipeline
+from core.volunteer_matcher import VolunteerMatcher
+
+
+def submission(submission_id, afspraak="2025-03-01T10:00:00"):
+    return {'_id': submission_id, '_submission_time': f"2025-03-01T12:00:{submission_id:02d}",
+            'introductie/adres': f"Straat {submission_id}", 'introductie/afspraakTijd': afspraak}
+
+
+def pipeline(**options):
+    return SyncPipeline(KoboToolboxService(), VolunteerMatcher([]), processes=0, **options)
+
+
+def test_pipeline_writes_and_dead_letters_parse_failures(tables):
+    cursor = SyncCursor.for_form('form')
+    journal = SyncRun.create(form_id='form')
+    pages = [[submission(1), submission(2, afspraak="gisteren")], [submission(3)]]
+
+    stats = pipeline(ordered=True, journal=journal).run(iter(pages), cursor)
+    assert stats['inserted'] == 2
+    assert (journal.batches, journal.fetched, journal.failed) == (1, 3, 1)
+    assert [letter.record_id for letter in DeadLetter.pending('kobo')] == ['2']
+    assert SyncCursor.for_form('form').last_submission_id == 3
+
+
+def test_pipeline_checkpoints_once_per_flush(tables):
+    journal = SyncRun.create(form_id='form')
+    pipeline(batch_size=7, journal=journal).run(iter([[submission(i) for i in range(1, 8)]]))
+    assert (journal.batches, journal.inserted) == (1, 7)
+
+    journal = SyncRun.create(form_id='form')
+    pages = [[submission(i) for i in range(1, 8)], [submission(8, afspraak="gisteren")]]
+    pipeline(batch_size=7, journal=journal).run(iter(pages))
+    assert (journal.batches, journal.unchanged, journal.failed) == (2, 7, 1)
+
+
+def test_pipeline_reraises_a_fetch_error_after_committed_batches(tables):
+    written = threading.Event()
+
+    def pages():
+        yield [submission(1), submission(2)]
+        written.wait(5)
+        raise ConnectionError("page 2 timed out")
+
+    with pytest.raises(ConnectionError, match="page 2"):
+        pipeline(batch_size=2, progress=lambda rows, stats: written.set()).run(pages())
+    assert Visit.select().count() == 2
+
+
+def test_stored_submissions_resolve_their_dead_letters(tables):
+    DeadLetter.record_many('kobo', [(1, submission(1), 'write', "database is locked"),
+                                    (2, submission(2), 'parse', "Could not parse visit_date")])
+    pipeline().run(iter([[submission(1), submission(2, afspraak="gisteren")]]))
+    assert [letter.record_id for letter in DeadLetter.pending('kobo')] == ['2']
@@ -0,0 +1,66 @@
+"""
+Thumbnail rendering and the on-disk thumbnail cache.
+"""
+import os
+from pathlib import Path
+
+import pytest
+from PIL import Image, UnidentifiedImageError
+
+from core.services.thumbnails import SIZES, ThumbnailCache
+
+
+@pytest.fixture
+def thumbnails(tmp_path):
+    cache = ThumbnailCache(root=tmp_path / "thumbnails", processes=0)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / "photo.png"
+    Image.new('RGBA', (1200, 600), (200, 80, 20, 255)).save(path)
+    return path
+
+
+@pytest.mark.parametrize('processes', [0, 1])
+def test_thumbnails_are_rendered_to_fit(tmp_path, photo, processes):
+    thumbnails = ThumbnailCache(root=tmp_path / "thumbnails", processes=processes)
+    try:
+        target = thumbnails.request(photo).result(timeout=30)
+    finally:
+        thumbnails.close()
+    with Image.open(target) as image:
+        assert (image.format, image.mode) == ('JPEG', 'RGB')
+        assert image.size == (SIZES['thumb'][0], SIZES['thumb'][0] // 2)
+    assert not list(thumbnails.root.rglob("*.part"))
+
+
+def test_rendered_images_are_cached_until_the_source_changes(thumbnails, photo):
+    assert thumbnails.cached(photo) is None
+    target = Path(thumbnails.request(photo, 'preview').result(timeout=10))
+    assert thumbnails.cached(photo, 'preview') == target
+    assert thumbnails.cached(photo) is None
+
+    newer = target.stat().st_mtime_ns + 1_000_000_000
+    os.utime(photo, ns=(newer, newer))
+    assert thumbnails.cached(photo, 'preview') is None
+
+
+def test_store_names_are_reused_as_cache_keys(thumbnails, tmp_path):
+    stored = tmp_path / "ab" / f"{'ab' * 32}.jpg"
+    assert thumbnails.path_for(stored).name == f"{'ab' * 32}-160x160.jpg"
+    assert thumbnails.path_for(tmp_path / "a.jpg") != thumbnails.path_for(tmp_path / "b.jpg")
+
+
+def test_unreadable_files_fail_the_request(thumbnails, tmp_path):
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+
+    future = thumbnails.request(broken)
+    with pytest.raises(UnidentifiedImageError):
+        future.result(timeout=10)
+    assert thumbnails.cached(broken) is None
+    assert not thumbnails.path_for(broken).exists()
+    assert not thumbnails.pending
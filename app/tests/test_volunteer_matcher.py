@@ -0,0 +1,58 @@
+"""
+Volunteer name resolution for KoboToolbox uitvoerders.
+"""
+import logging
+
+import pytest
+
+from core.volunteer_matcher import VolunteerMatcher, normalize_name
+
+VOLUNTEERS = [
+    (1, "Willem de Vries"),
+    (2, "Willem Jansen"),
+    (3, "Anouk Bakker"),
+    (4, "José Martínez"),
+    (5, "P. J. van Dijk"),
+]
+
+
+@pytest.fixture
+def matcher():
+    return VolunteerMatcher(VOLUNTEERS)
+
+
+def test_normalize_name_strips_case_accents_and_punctuation():
+    assert normalize_name("  José-Martínez ") == ('jose', 'martinez')
+
+
+@pytest.mark.parametrize('name, volunteer_id', [
+    ("Anouk Bakker", 3),
+    ("anouk bakker", 3),
+    ("Jose Martinez", 4),
+    ("van Dijk", 5),
+    ("Bakker", 3),
+    ("W. Jansen", 2),
+    ("Onbekend", None),
+    ("", None),
+])
+def test_resolve(matcher, name, volunteer_id):
+    assert matcher.resolve(name) == volunteer_id
+
+
+def test_resolve_pair_splits_on_separators(matcher):
+    assert matcher.resolve_pair("Anouk Bakker & Willem Jansen") == (3, 2)
+    assert matcher.resolve_pair("Anouk Bakker en Anouk") == (3, None)
+    assert matcher.resolve_pair("") == (None, None)
+
+
+def test_ambiguous_name_is_reviewed_and_logged_once(matcher, caplog):
+    with caplog.at_level(logging.WARNING, logger='core.volunteer_matcher'):
+        for submission_id in range(100):
+            assert matcher.resolve("Willem", submission_id) is None
+        assert matcher.resolve("willem!", 100) is None
+
+    assert list(matcher.review) == [('willem',)]
+    entry = matcher.review[('willem',)]
+    assert entry['candidates'] == ["Willem Jansen", "Willem de Vries"]
+    assert entry['submission_ids'] == list(range(101))
+    assert len(caplog.records) == 1
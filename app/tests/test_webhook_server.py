@@ -0,0 +1,178 @@
+"""
+Webhook receiver: request verification and ingestion of queued deliveries.
+"""
+import hashlib
+import hmac
+import http.client
+import threading
+
+import pytest
+from peewee import OperationalError
+
+from core.ingestion import VisitIngestor
+from core.models import DeadLetter, Visit, Volunteer
+from config import Config
+from core.services.kobotoolbox import KoboToolboxService
+from core.services.webhook_server import WebhookReceiver, verify_calendly_signature, verify_kobo_token
+
+SIGNING_KEY = "calendly-key"
+BODY = b'{"event": "invitee.created"}'
+
+
+def calendly_headers(timestamp, body=BODY, key=SIGNING_KEY):
+    signature = hmac.new(key.encode('utf-8'), f"{timestamp}.".encode('utf-8') + body, hashlib.sha256).hexdigest()
+    return {'Calendly-Webhook-Signature': f"t={timestamp},v1={signature}"}
+
+
+def test_valid_calendly_signature():
+    assert verify_calendly_signature(calendly_headers(1000), BODY, SIGNING_KEY, now=1060)
+
+
+@pytest.mark.parametrize('headers, body, now', [
+    (calendly_headers(1000), b'{"event": "invitee.canceled"}', 1060),
+    (calendly_headers(1000, key="other-key"), BODY, 1060),
+    (calendly_headers(1000), BODY, 1000 + 181),
+    ({'Calendly-Webhook-Signature': "t=1000"}, BODY, 1060),
+    ({'Calendly-Webhook-Signature': "garbage"}, BODY, 1060),
+    ({}, BODY, 1060),
+])
+def test_invalid_calendly_signature(headers, body, now):
+    assert not verify_calendly_signature(headers, body, SIGNING_KEY, now=now)
+
+
+def test_calendly_signature_needs_a_signing_key():
+    assert not verify_calendly_signature(calendly_headers(1000, key=""), BODY, "", now=1060)
+
+
+@pytest.mark.parametrize('token, secret, valid', [
+    ("s3cret", "s3cret", True),
+    ("wrong", "s3cret", False),
+    ("", "", False),
+])
+def test_kobo_token(token, secret, valid):
+    assert verify_kobo_token({'X-Kobo-Webhook-Token': token}, secret) is valid
+
+
+def pushed(submission_id, **answers):
+    return dict({'_id': submission_id, 'adres': f"Straat {submission_id}", 'afspraakTijd': "2025-03-01T10:00:00"},
+                **answers)
+
+
+def receiver():
+    webhooks = WebhookReceiver(port=0)
+    webhooks._kobo, webhooks._calendly = KoboToolboxService(), None
+    return webhooks
+
+
+def test_pushed_submissions_are_stored(tables):
+    webhooks = receiver()
+    webhooks._ingest([('kobo', pushed(1)), ('kobo', pushed(2))])
+    assert Visit.select().count() == 2
+    assert webhooks.stats == {'kobo': 2, 'calendly': 0, 'failed': 0}
+
+
+def test_unparseable_submissions_are_dead_lettered_with_their_error(tables):
+    webhooks = receiver()
+    webhooks._ingest([('kobo', pushed(1, afspraakTijd="gisteren")), ('kobo', pushed(2, afspraakTijd=""))])
+    letters = {letter.record_id: letter for letter in DeadLetter.pending('kobo')}
+    assert "gisteren" in letters['1'].error
+    assert letters['2'].error == "Missing visit_date value"
+
+
+def test_volunteers_are_matched_per_batch(tables):
+    webhooks = receiver()
+    webhooks._ingest([('kobo', pushed(1, uitvoerders="Anna"))])
+    anna = Volunteer.create(name="Anna")
+    webhooks._ingest([('kobo', pushed(2, uitvoerders="Anna"))])
+    assert [visit.volunteer_id for visit in Visit.select().order_by(Visit.id)] == [None, anna.id]
+
+
+def test_pushed_submissions_resolve_their_dead_letters(tables):
+    DeadLetter.record_many('kobo', [(1, {'_id': 1}, 'write', "database is locked")])
+    receiver()._ingest([('kobo', pushed(1))])
+    assert not DeadLetter.pending('kobo').exists()
+
+
+class Recorder:
+    """Records the service methods called on it"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append(name)
+
+
+def test_reconcile_retries_dead_letters(monkeypatch):
+    monkeypatch.setattr(Config, 'CALENDLY_API_TOKEN', "token")
+    webhooks = receiver()
+    webhooks._kobo, webhooks._calendly = Recorder(), Recorder()
+
+    webhooks._reconcile()
+    assert webhooks._kobo.calls == ['sync_visits', 'retry_dead_letters', 'download_attachments']
+    assert webhooks._calendly.calls == ['sync_appointments', 'retry_dead_letters']
+
+
+def test_failed_flush_dead_letters_the_batch(tables, monkeypatch):
+    def locked(self, submission_ids):
+        raise OperationalError("database is locked")
+    monkeypatch.setattr(VisitIngestor, '_stored_hashes', locked)
+
+    webhooks = receiver()
+    webhooks._ingest([('kobo', pushed(1)), ('kobo', pushed(2))])
+    assert webhooks.stats['failed'] == 2
+    letters = {letter.record_id: letter for letter in DeadLetter.pending('kobo')}
+    assert set(letters) == {'1', '2'}
+    assert letters['1'].stage == 'write'
+    assert letters['1'].payload == pushed(1)
+
+
+@pytest.fixture
+def listening(database, monkeypatch):
+    monkeypatch.setattr(Config, 'KOBO_WEBHOOK_SECRET', "s3cret")
+    monkeypatch.setattr(Config, 'SYNC_RECONCILE_MINUTES', 0)
+    webhooks = receiver()
+    webhooks.ingested = []
+    webhooks.arrived = threading.Event()
+
+    def ingest(batch):
+        webhooks.ingested.extend(batch)
+        webhooks.arrived.set()
+        if any(payload.get('broken') for _, payload in batch):
+            raise AttributeError("bad batch")
+    webhooks._ingest = ingest
+    webhooks.start()
+    yield webhooks
+    webhooks.stop()
+
+
+def post(webhooks, body, content_length=None):
+    connection = http.client.HTTPConnection(webhooks.host, webhooks.port, timeout=5)
+    headers = {'X-Kobo-Webhook-Token': "s3cret",
+               'Content-Length': str(len(body)) if content_length is None else content_length}
+    connection.request('POST', '/kobo', body=body, headers=headers)
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+
+@pytest.mark.parametrize('body', [b'[]', b'null', b'1', b'"text"', b'{not json'])
+def test_non_object_bodies_are_rejected(listening, body):
+    assert post(listening, body) == 400
+    assert listening.queue.empty() and not listening.ingested
+
+
+@pytest.mark.parametrize('content_length', ["many", "-1"])
+def test_bad_content_length_is_rejected(listening, content_length):
+    assert post(listening, b'{}', content_length=content_length) == 400
+
+
+def test_consumer_survives_a_failing_batch(listening):
+    assert post(listening, b'{"_id": 1, "broken": true}') == 202
+    assert listening.arrived.wait(5)
+    listening.arrived.clear()
+
+    assert post(listening, b'{"_id": 2}') == 202
+    assert listening.arrived.wait(5)
+    assert [payload['_id'] for _, payload in listening.ingested] == [1, 2]
+    assert listening.stats['failed'] == 1
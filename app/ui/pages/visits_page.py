@@ -4,12 +4,14 @@ Visits management page with detailed popups and comprehensive visit data display
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 import tkinter as tk
-from tkinter import messagebox
+from tkinter import filedialog, messagebox
+import threading
 from datetime import date, datetime
-from core.models import Visit, Volunteer
-from config import Colors, Theme
+from core.models import Visit, Volunteer, in_period
+from config import Colors, Config, Theme
 import logging
 from peewee import fn
+from PIL import Image, ImageTk
 
 logger = logging.getLogger(__name__)
 
@@ -69,10 +71,8 @@ class VisitsPage(ttk.Frame):
         
         # Get visit statistics
         total_visits = Visit.select().count()
-        this_month_visits = Visit.select().where(
-            (Visit.visit_date.month == datetime.now().month) &
-            (Visit.visit_date.year == datetime.now().year)
-        ).count()
+        today = date.today()
+        this_month_visits = Visit.select().where(in_period(Visit.visit_date, today.year, today.month)).count()
         visits_with_issues = Visit.select().where(
             (Visit.mold_issues == True) | 
             (Visit.moisture_issues == True) | 
@@ -202,6 +202,14 @@ class VisitsPage(ttk.Frame):
             bootstyle=SUCCESS,
             width=15
         ).pack(side=LEFT, padx=5)
+        
+        ttk.Button(
+            actions_frame,
+            text="📥 Import",
+            command=self.import_visits,
+            bootstyle=PRIMARY,
+            width=15
+        ).pack(side=LEFT, padx=5)
     
     def refresh_data(self):
         """Refresh visits table data"""
@@ -211,7 +219,7 @@ class VisitsPage(ttk.Frame):
                 self.visits_tree.delete(item)
             
             # Load visits
-            visits = list(Visit.select().order_by(Visit.visit_date.desc()))
+            visits = list(Visit.select_without_payloads().order_by(Visit.visit_date.desc()))
             
             # Populate table
             for visit in visits:
@@ -296,6 +304,10 @@ class VisitsPage(ttk.Frame):
         # Community Building Tab
         self.create_community_tab(notebook, visit)
         
+        # Photos Tab
+        if visit.photos_url:
+            self.create_photos_tab(notebook, visit)
+        
         # Close button
         ttk.Button(
             popup,
@@ -649,6 +661,130 @@ class VisitsPage(ttk.Frame):
             text_widget.insert("1.0", visit.community_building)
             text_widget.config(state="disabled")
     
+    def create_photos_tab(self, notebook, visit):
+        """Create photos tab; thumbnails are rendered in the background as they scroll into view"""
+        from core.services.thumbnails import get_thumbnail_cache
+        
+        frame = ttk.Frame(notebook)
+        notebook.add(frame, text="📷 Photos")
+        
+        paths = [Config.KOBO_ATTACHMENT_DIR / path for path in (visit.photos_local or "").splitlines() if path]
+        if not paths:
+            message = "No photos attached." if visit.photos_local == "" else "Photos have not been downloaded yet."
+            ttk.Label(frame, text=message, font=(Theme.FONT_FAMILY, Theme.FONT_SIZE_NORMAL),
+                      foreground=self.colors.TEXT_SECONDARY).pack(pady=40)
+            return
+        
+        canvas = tk.Canvas(frame, highlightthickness=0)
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=canvas.yview)
+        scrollable_frame = ttk.Frame(canvas)
+        
+        scrollable_frame.bind(
+            "<Configure>",
+            lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
+        )
+        
+        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
+        canvas.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        
+        # Fixed-size placeholders keep the layout stable while thumbnails arrive
+        width, height = Config.THUMBNAIL_SIZE
+        columns = 4
+        cells = []
+        for i, path in enumerate(paths):
+            cell = tk.Label(scrollable_frame, text="Loading...", width=width, height=height,
+                            image=self._blank_thumbnail(), compound="center", cursor="hand2")
+            cell.grid(row=i // columns, column=i % columns, padx=5, pady=5)
+            cell.bind("<Button-1>", lambda e, p=path: self.show_photo_preview(p))
+            cells.append(cell)
+        
+        cache = get_thumbnail_cache()
+        requested = set()
+        futures = {}
+        
+        def load_visible(*args):
+            # One row below the visible area is fetched ahead
+            top = canvas.canvasy(0)
+            bottom = top + canvas.winfo_height() + height
+            for i, (cell, path) in enumerate(zip(cells, paths)):
+                if i in requested or not top - height <= cell.winfo_y() <= bottom:
+                    continue
+                requested.add(i)
+                cached = cache.cached(path)
+                if cached:
+                    self._show_thumbnail(cell, cached)
+                else:
+                    futures[i] = cache.request(path)
+                    if len(futures) == 1:
+                        frame.after(100, poll)
+        
+        def poll():
+            if not frame.winfo_exists():
+                return
+            for i, future in list(futures.items()):
+                if not future.done():
+                    continue
+                del futures[i]
+                try:
+                    self._show_thumbnail(cells[i], future.result())
+                except Exception as e:
+                    logger.warning(f"Could not render {paths[i]}: {e}")
+                    cells[i].configure(text="Unavailable")
+            if futures:
+                frame.after(100, poll)
+        
+        def on_scroll(*args):
+            scrollbar.set(*args)
+            load_visible()
+        
+        canvas.configure(yscrollcommand=on_scroll)
+        canvas.bind("<Configure>", load_visible)
+    
+    def _blank_thumbnail(self):
+        """Transparent placeholder so labels are sized in pixels"""
+        if not hasattr(self, '_blank_thumbnail_image'):
+            self._blank_thumbnail_image = tk.PhotoImage(width=Config.THUMBNAIL_SIZE[0], height=Config.THUMBNAIL_SIZE[1])
+        return self._blank_thumbnail_image
+    
+    def _show_thumbnail(self, cell, path):
+        with Image.open(path) as image:
+            cell.image = ImageTk.PhotoImage(image)
+        cell.configure(image=cell.image, text="")
+    
+    def show_photo_preview(self, path):
+        """Show a medium-size preview of a photo, rendered off the UI thread"""
+        from core.services.thumbnails import get_thumbnail_cache
+        
+        popup = tk.Toplevel(self)
+        popup.title(path.name)
+        popup.transient(self.winfo_toplevel())
+        
+        label = ttk.Label(popup, text="Loading preview...", font=(Theme.FONT_FAMILY, Theme.FONT_SIZE_NORMAL))
+        label.pack(padx=10, pady=10)
+        ttk.Button(popup, text="Close", command=popup.destroy, bootstyle=SECONDARY, width=15).pack(pady=(0, 10))
+        
+        cache = get_thumbnail_cache()
+        cached = cache.cached(path, 'preview')
+        if cached:
+            self._show_thumbnail(label, cached)
+            return
+        future = cache.request(path, 'preview')
+        
+        def poll():
+            if not popup.winfo_exists():
+                return
+            if not future.done():
+                popup.after(100, poll)
+                return
+            try:
+                self._show_thumbnail(label, future.result())
+            except Exception as e:
+                logger.warning(f"Could not render {path}: {e}")
+                label.configure(text="Preview unavailable")
+        
+        popup.after(100, poll)
+    
     def apply_filters(self):
         """Apply filters to visits table"""
         try:
@@ -657,7 +793,7 @@ class VisitsPage(ttk.Frame):
                 self.visits_tree.delete(item)
             
             # Build query with filters
-            query = Visit.select()
+            query = Visit.select_without_payloads()
             
             # Date range filter
             if self.from_date_var.get():
@@ -729,6 +865,70 @@ class VisitsPage(ttk.Frame):
         """Export visits to CSV (placeholder)"""
         messagebox.showinfo("Export", "Export functionality will be implemented soon!")
     
+    def import_visits(self):
+        """Import a downloaded KoboToolbox CSV/XLSX export in the background"""
+        path = filedialog.askopenfilename(
+            title="Import KoboToolbox export",
+            filetypes=[("Kobo exports", "*.csv *.xlsx"), ("CSV files", "*.csv"), ("Excel files", "*.xlsx")]
+        )
+        if not path:
+            return
+        
+        popup = tk.Toplevel(self)
+        popup.title("Importing visits")
+        popup.geometry("420x140")
+        popup.transient(self.winfo_toplevel())
+        popup.grab_set()
+        
+        status_var = tk.StringVar(value="Reading export...")
+        ttk.Label(popup, textvariable=status_var, font=(Theme.FONT_FAMILY, Theme.FONT_SIZE_NORMAL)).pack(pady=(20, 10))
+        progress_bar = ttk.Progressbar(popup, mode='indeterminate', bootstyle=PRIMARY, length=360)
+        progress_bar.pack(pady=10)
+        progress_bar.start(10)
+        
+        # Written by the import thread, read by the Tk loop
+        state = {'rows': 0, 'stats': None, 'result': None, 'error': None}
+        
+        def report(rows, stats):
+            state['rows'], state['stats'] = rows, dict(stats)
+        
+        def run():
+            from core.database import db
+            from core.services.kobo_import import import_export_file
+            try:
+                state['result'] = import_export_file(path, progress=report)
+            except Exception as e:
+                state['error'] = e
+            finally:
+                db.close()
+        
+        def poll():
+            if state['stats']:
+                status_var.set(f"{state['rows']:,} rows processed ({state['stats']['inserted']:,} new)")
+            if worker.is_alive():
+                self.after(200, poll)
+                return
+            
+            progress_bar.stop()
+            popup.destroy()
+            if state['error']:
+                logger.error(f"Import failed: {state['error']}")
+                messagebox.showerror("Import", f"Import failed: {state['error']}")
+                return
+            
+            result = state['result']
+            messagebox.showinfo(
+                "Import",
+                f"Imported {result['rows']:,} rows: {result['inserted']:,} new, "
+                f"{result['updated']:,} updated, {result['unchanged']:,} unchanged.\n"
+                f"{result['skipped']} rows skipped, {result['needs_review']} volunteer names need review."
+            )
+            self.refresh_data()
+        
+        worker = threading.Thread(target=run, name='visit-import', daemon=True)
+        worker.start()
+        self.after(200, poll)
+    
     def refresh_styling(self):
         """Refresh styling when theme changes"""
         self.colors = Colors(getattr(self.app, 'current_theme', 'flatly'))
@@ -6,7 +6,9 @@ from ttkbootstrap.constants import *
 import tkinter as tk
 from tkinter import messagebox
 from datetime import date, datetime
-from core.models import Volunteer, Visit, search_volunteers
+from core.models import (
+    Volunteer, Visit, EMPTY_VOLUNTEER_AGGREGATES, get_volunteer_aggregates, search_volunteers
+)
 from config import Colors, Theme
 import logging
 
@@ -19,6 +21,7 @@ class VolunteerPage(ttk.Frame):
         super().__init__(parent)
         self.app = app
         self.selected_volunteer = None
+        self.volunteer_aggregates = {}  # Visit statistics per volunteer id, loaded with the list
         self.colors = Colors(getattr(app, 'current_theme', 'flatly'))
         self.setup_ui()
         self.refresh_data()
@@ -528,52 +531,26 @@ class VolunteerPage(ttk.Frame):
             width=15
         ).pack(side=LEFT, padx=5)
     
+    def get_volunteer_aggregates(self, volunteer):
+        """Visit statistics for a volunteer from the last aggregate query"""
+        return self.volunteer_aggregates.get(volunteer.id, EMPTY_VOLUNTEER_AGGREGATES)
+    
+    def refresh_volunteer_aggregates(self, volunteer):
+        """Reload the statistics of one volunteer, e.g. before showing details"""
+        aggregates = get_volunteer_aggregates([volunteer.id])
+        self.volunteer_aggregates[volunteer.id] = aggregates.get(volunteer.id, EMPTY_VOLUNTEER_AGGREGATES)
+    
     def get_volunteer_visit_count(self, volunteer):
         """Get total visit count for volunteer (uitvoerder 1 or 2)"""
-        try:
-            count = Visit.select().where(
-                (Visit.volunteer == volunteer) | 
-                (Visit.volunteer_2 == volunteer)
-            ).count()
-            return count
-        except Exception as e:
-            logger.error(f"Failed to get visit count for {volunteer.name}: {e}")
-            return 0
+        return self.get_volunteer_aggregates(volunteer)["visit_count"]
     
     def get_volunteer_last_visit(self, volunteer):
         """Get last visit date for volunteer"""
-        try:
-            last_visit = Visit.select().where(
-                (Visit.volunteer == volunteer) | 
-                (Visit.volunteer_2 == volunteer)
-            ).order_by(Visit.visit_date.desc()).first()
-            return last_visit.visit_date if last_visit else None
-        except Exception as e:
-            logger.error(f"Failed to get last visit for {volunteer.name}: {e}")
-            return None
+        return self.get_volunteer_aggregates(volunteer)["last_visit"]
     
     def get_volunteer_monthly_average(self, volunteer):
         """Calculate monthly average visits for volunteer"""
-        try:
-            visits = list(Visit.select().where(
-                (Visit.volunteer == volunteer) | 
-                (Visit.volunteer_2 == volunteer)
-            ))
-            
-            if not visits:
-                return 0
-            
-            # Calculate months between first and last visit
-            first_visit = min(visit.visit_date for visit in visits)
-            last_visit = max(visit.visit_date for visit in visits)
-            
-            months_diff = ((last_visit.year - first_visit.year) * 12 + 
-                          last_visit.month - first_visit.month) + 1
-            
-            return round(len(visits) / max(months_diff, 1), 1)
-        except Exception as e:
-            logger.error(f"Failed to calculate monthly average for {volunteer.name}: {e}")
-            return 0
+        return self.get_volunteer_aggregates(volunteer)["monthly_average"]
     
     def get_volunteer_experience_level(self, visit_count):
         """Calculate experience level based on visit count"""
@@ -586,16 +563,7 @@ class VolunteerPage(ttk.Frame):
     
     def get_volunteer_monthly_visits(self, volunteer, month, year):
         """Get visits for specific month and year"""
-        try:
-            count = Visit.select().where(
-                ((Visit.volunteer == volunteer) | (Visit.volunteer_2 == volunteer)) &
-                (Visit.visit_date.month == month) &
-                (Visit.visit_date.year == year)
-            ).count()
-            return count
-        except Exception as e:
-            logger.error(f"Failed to get monthly visits for {volunteer.name}: {e}")
-            return 0
+        return self.get_volunteer_aggregates(volunteer)["monthly"].get((year, month), 0)
     
     def populate_details(self, volunteer):
         """Populate details panel with volunteer information"""
@@ -611,6 +579,7 @@ class VolunteerPage(ttk.Frame):
             self.active_var.set(volunteer.is_active)
             
             # Update statistics
+            self.refresh_volunteer_aggregates(volunteer)
             self.update_volunteer_statistics(volunteer)
             
             # Update visits section
@@ -775,7 +744,7 @@ class VolunteerPage(ttk.Frame):
         
         try:
             # Get all visits for this volunteer
-            visits = list(Visit.select().where(
+            visits = list(Visit.select_without_payloads().where(
                 (Visit.volunteer == self.selected_volunteer) | 
                 (Visit.volunteer_2 == self.selected_volunteer)
             ).order_by(Visit.visit_date.desc()))
@@ -866,8 +835,9 @@ class VolunteerPage(ttk.Frame):
                 widget.destroy()
             self.volunteer_cards.clear()
             
-            # Load volunteers
+            # Load volunteers and their visit statistics
             volunteers = list(Volunteer.select().order_by(Volunteer.name))
+            self.volunteer_aggregates = get_volunteer_aggregates()
             
             # Update summary
             active_count = sum(1 for v in volunteers if v.is_active)